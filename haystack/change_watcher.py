@@ -0,0 +1,278 @@
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+import time
+
+from config import Config
+from util import Util
+
+# inotify flags, from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0x00000800
+IN_CLOEXEC = 0x00080000
+
+EVENT_HEADER = 'iIII'
+EVENT_HEADER_SIZE = struct.calcsize(EVENT_HEADER)
+READ_SIZE = 65536
+
+# Files landing in staging, and devices appearing (or disappearing) under the mount points.
+STAGING_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE_SELF | IN_ONLYDIR
+MOUNT_POINT_MASK = IN_CREATE | IN_DELETE | IN_MOVED_TO | IN_MOVED_FROM | IN_DELETE_SELF | IN_ONLYDIR
+
+# Linux marks this as exceptional (POLLPRI) whenever something is mounted or unmounted, until it's read again.
+MOUNTINFO = '/proc/self/mountinfo'
+
+# Once something changes, keep collecting events for a moment so that a burst of files results in a single wake up.
+SETTLE_TIME_IN_SECONDS = 0.5
+
+
+# A minimal ctypes binding for Linux's inotify. Raises an OSError if inotify isn't available.
+class Inotify:
+    def __init__(self):
+        library = ctypes.util.find_library('c')
+        libc = ctypes.CDLL(library, use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, 'inotify is not available on this system!')
+
+        self.libc = libc
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+
+    def fileno(self):
+        return self.fd
+
+    def add_watch(self, path, mask):
+        wd = self.libc.inotify_add_watch(self.fd, path, mask)
+        if wd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error), path)
+
+        return wd
+
+    # Returns the pending events as (wd, mask, name) tuples, without blocking.
+    def read_events(self):
+        try:
+            data = os.read(self.fd, READ_SIZE)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return []
+            raise
+
+        events = []
+        offset = 0
+        while offset + EVENT_HEADER_SIZE <= len(data):
+            wd, mask, cookie, length = struct.unpack_from(EVENT_HEADER, data, offset)
+            offset += EVENT_HEADER_SIZE
+            name = data[offset:offset + length].rstrip('\x00')
+            offset += length
+            events.append((wd, mask, name))
+
+        return events
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+# Waits for something worth indexing to happen: new files in staging, a device showing up under one of the USB mount
+# points, or anything being mounted. Staging is watched recursively, the mount points are not, since a new device is a
+# new directory. The mount table is watched too, since a volume can be mounted on a directory that already exists. If
+# inotify isn't available (on OS X, for example), waiting just sleeps for the whole timeout, like the old fixed
+# interval.
+class ChangeWatcher:
+    def __init__(self, config=None, util=None, inotify=None, mountinfo_path=MOUNTINFO):
+        if config is None:
+            config = Config()
+
+        if util is None:
+            util = Util()
+
+        if inotify is None:
+            try:
+                inotify = Inotify()
+            except OSError as e:
+                logging.warn('Unable to use inotify, falling back to polling. error=%s', e)
+
+        self.config = config
+        self.util = util
+        self.inotify = inotify
+        self.staging_watches = {}
+        self.needs_watches = True
+        self.mountinfo = None
+        if self.inotify is not None:
+            self.mountinfo = self.__open_mountinfo(mountinfo_path)
+
+    # Forgets about any changes seen so far. Call this at the start of a run, before looking for devices.
+    def mark(self):
+        if self.inotify is None:
+            return
+
+        if self.needs_watches:
+            self.__add_watches()
+
+        self.__handle_events(self.inotify.read_events())
+        self.__read_mountinfo()
+
+    # Returns True if a device was mounted or unmounted since mark() was called, without blocking. Changes to staging
+    # are forgotten, since during a run they are the run's own writes. Call this at the end of a run: a device that
+    # showed up after the run looked for devices needs another run right away.
+    def devices_changed(self):
+        if self.inotify is None:
+            return False
+
+        if self.needs_watches:
+            self.__add_watches()
+
+        changed = self.__mount_table_changed()
+        return self.__handle_events(self.inotify.read_events(), include_staging=False) or changed
+
+    # Blocks until something changes, or the timeout expires. Returns True if something changed.
+    def wait(self, timeout):
+        if self.inotify is None:
+            time.sleep(timeout)
+            return False
+
+        if self.needs_watches:
+            self.__add_watches()
+
+        deadline = time.time() + timeout
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+
+            if self.__wait_for_events(remaining):
+                break
+
+        # Let the rest of a burst arrive, then report it as one change.
+        settle_deadline = time.time() + SETTLE_TIME_IN_SECONDS
+        while self.__wait_for_events(settle_deadline - time.time()):
+            pass
+
+        logging.info('Detected changes, starting the next run early.')
+        return True
+
+    def close(self):
+        if self.inotify is not None:
+            self.inotify.close()
+
+        if self.mountinfo is not None:
+            self.mountinfo.close()
+            self.mountinfo = None
+
+    def __wait_for_events(self, timeout):
+        if timeout <= 0:
+            return False
+
+        mount_table = [self.mountinfo] if self.mountinfo is not None else []
+        try:
+            readable, _, exceptional = select.select([self.inotify], [], mount_table, timeout)
+        except select.error as e:
+            if e.args[0] == errno.EINTR:
+                return False
+            raise
+
+        changed = False
+        if exceptional:
+            logging.info('Detected a change to the mount table.')
+            self.__read_mountinfo()
+            changed = True
+
+        if readable:
+            changed = self.__handle_events(self.inotify.read_events()) or changed
+
+        return changed
+
+    def __mount_table_changed(self):
+        if self.mountinfo is None:
+            return False
+
+        try:
+            _, _, exceptional = select.select([], [], [self.mountinfo], 0)
+        except select.error as e:
+            if e.args[0] == errno.EINTR:
+                # Another run is cheaper than missing a device.
+                return True
+            raise
+
+        if exceptional:
+            self.__read_mountinfo()
+            return True
+
+        return False
+
+    def __open_mountinfo(self, mountinfo_path):
+        try:
+            mountinfo = open(mountinfo_path, 'r')
+        except IOError as e:
+            logging.info('Unable to watch the mount table, relying on the mount points. error=%s', e)
+            return None
+
+        mountinfo.read()
+        return mountinfo
+
+    # Reading the mount table again clears the change that was signalled.
+    def __read_mountinfo(self):
+        if self.mountinfo is not None:
+            self.mountinfo.seek(0)
+            self.mountinfo.read()
+
+    # Keeps the watches up to date, and returns True if any of the events are worth waking up for. Unless
+    # include_staging is set, only events under the mount points count.
+    def __handle_events(self, events, include_staging=True):
+        changed = False
+        for wd, mask, name in events:
+            if mask & IN_Q_OVERFLOW:
+                self.needs_watches = True
+            elif mask & (IN_IGNORED | IN_DELETE_SELF):
+                # A watched directory went away. It'll be watched again if it comes back.
+                self.staging_watches.pop(wd, None)
+                self.needs_watches = True
+                continue
+            elif wd in self.staging_watches and mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                self.__watch_staging_tree(os.path.join(self.staging_watches[wd], name))
+
+            if include_staging or wd not in self.staging_watches:
+                changed = True
+
+        return changed
+
+    def __add_watches(self):
+        self.needs_watches = False
+
+        staging_root = self.config.staging_root()
+        self.util.mkdirp(staging_root)
+        self.__watch_staging_tree(staging_root)
+
+        for mount_point in self.config.usb_mount_points():
+            self.__add_watch(mount_point, MOUNT_POINT_MASK)
+
+    def __watch_staging_tree(self, path):
+        for directory, _, _ in os.walk(path):
+            wd = self.__add_watch(directory, STAGING_MASK)
+            if wd is not None:
+                self.staging_watches[wd] = directory
+
+    def __add_watch(self, path, mask):
+        try:
+            return self.inotify.add_watch(path, mask)
+        except OSError as e:
+            logging.info('Unable to watch directory, relying on polling for it. path=%s error=%s', path, e)
+            return None
@@ -1,4 +1,8 @@
+import collections
+import logging
 import os
+import threading
+import time
 
 from ConfigParser import ConfigParser
 
@@ -10,62 +14,270 @@ MTP_SECTION = 'MTP'
 USB_SECTION = 'USB'
 PATHS_TO_FILES_SECTION = 'PathsToFiles'
 INDEX_SECTION = 'Index'
+INDEXER_SECTION = 'Indexer'
 
 # Config Keys
 EXECUTION_INTERVAL = 'ExecutionIntervalInSeconds'
+MAX_EXECUTION_INTERVAL = 'MaxExecutionIntervalInSeconds'
 PATHS_TO_INDEX = 'PathsToIndex'
 IGNORE = 'Ignore'
+USE_LIBMTP = 'UseLibMTP'
 MOUNT_POINTS = 'MountPoints'
 HAYSTACK_ROOT = 'HaystackRoot'
 THUMBNAIL_PATH = 'ThumbnailPath'
 PICTURE_PATH = 'PicturePath'
 VIDEO_PATH = 'VideoPath'
 THUMBNAIL_SIZE = 'ThumbnailSize'
+STATE_DATABASE_PATH = 'StateDatabasePath'
 FIREBASE_NAME = 'Firebase'
 FIREBASE_SECRET = 'Secret'
+SYNC_TO_FIREBASE = 'SyncToFirebase'
+WORKERS = 'Workers'
+MAX_FILES_PER_RUN = 'MaxFilesPerRun'
+STREAM_TRANSFERS = 'StreamTransfers'
+MAX_CONCURRENT_TRANSFERS = 'MaxConcurrentTransfers'
+HASH_ALGORITHM = 'HashAlgorithm'
+TREE_HASH = 'TreeHash'
+TREE_HASH_CHUNK_SIZE = 'TreeHashChunkSizeInMB'
+HASH_THREADS = 'HashThreads'
+MAX_INDEX_ATTEMPTS = 'MaxIndexAttempts'
+FAILURE_BACKOFF = 'FailureBackoffInSeconds'
 
 STAGING_DIRECTORY = 'staging'
+QUARANTINE_DIRECTORY = 'quarantine'
 DELIMITER = ','
 
+# The config file is checked for changes at most this often.
+RELOAD_CHECK_INTERVAL_IN_SECONDS = 1
 
+# Bumped by request_reload, so that every Config reloads on its next use, even if the file's mtime didn't change.
+reload_generation = 0
+
+# An immutable, validated view of config.properties. Everything is parsed and checked once, when the snapshot is
+# loaded, so reading a value from it is just an attribute lookup.
+ConfigSnapshot = collections.namedtuple('ConfigSnapshot', [
+    'indexer_delay',
+    'indexer_max_delay',
+    'indexer_run_budget',
+    'indexer_workers',
+    'stream_transfers',
+    'max_concurrent_transfers',
+    'hash_algorithm',
+    'tree_hash',
+    'tree_hash_chunk_size_in_mb',
+    'hash_threads',
+    'max_index_attempts',
+    'failure_backoff',
+    'mtp_media_directories',
+    'mtp_devices_to_ignore',
+    'mtp_use_libmtp',
+    'usb_media_directories',
+    'usb_mount_points',
+    'usb_devices_to_ignore',
+    'haystack_root',
+    'thumbnail_path_pattern',
+    'picture_path_pattern',
+    'video_path_pattern',
+    'thumbnail_size',
+    'state_database_path',
+    'firebase_name',
+    'firebase_secret',
+    'firebase_sync_enabled'
+])
+
+
+# Keys added after the first release fall back to these, so that an older config.properties keeps working the way it
+# did before the key existed.
+DEFAULT_MAX_FILES_PER_RUN = 500
+DEFAULT_WORKERS = 1
+DEFAULT_STREAM_TRANSFERS = False
+DEFAULT_MAX_CONCURRENT_TRANSFERS = 1
+DEFAULT_HASH_ALGORITHM = 'md5'
+DEFAULT_TREE_HASH = False
+DEFAULT_TREE_HASH_CHUNK_SIZE = 16
+DEFAULT_HASH_THREADS = 0
+DEFAULT_MAX_INDEX_ATTEMPTS = 6
+DEFAULT_FAILURE_BACKOFF = 120
+DEFAULT_USE_LIBMTP = False
+DEFAULT_STATE_DATABASE_PATH = 'state.db'
+DEFAULT_SYNC_TO_FIREBASE = True
+
+
+def request_reload():
+    global reload_generation
+    reload_generation += 1
+
+
+# Reads an optional key with get (one of parser's get methods), or returns default if the key or its section is missing.
+def get_optional(parser, get, section, option, default):
+    if not parser.has_option(section, option):
+        return default
+
+    return get(section, option)
+
+
+def load_snapshot(parser):
+    haystack_root = parser.get(PATHS_TO_FILES_SECTION, HAYSTACK_ROOT)
+    if not haystack_root.startswith('/'):
+        raise RuntimeError('HaystackRoot must be an absolute path! haystack_root=' + haystack_root)
+
+    def get_path(section, option, default):
+        return os.path.join(haystack_root, get_optional(parser, parser.get, section, option, default))
+
+    indexer_delay = parser.getint(TIMING_SECTION, EXECUTION_INTERVAL)
+    snapshot = ConfigSnapshot(
+        indexer_delay=indexer_delay,
+        # Without a maximum, the interval never grows.
+        indexer_max_delay=get_optional(parser, parser.getint, TIMING_SECTION, MAX_EXECUTION_INTERVAL, indexer_delay),
+        indexer_run_budget=get_optional(parser, parser.getint, INDEXER_SECTION, MAX_FILES_PER_RUN,
+                                        DEFAULT_MAX_FILES_PER_RUN),
+        indexer_workers=get_optional(parser, parser.getint, INDEXER_SECTION, WORKERS, DEFAULT_WORKERS),
+        stream_transfers=get_optional(parser, parser.getboolean, INDEXER_SECTION, STREAM_TRANSFERS,
+                                      DEFAULT_STREAM_TRANSFERS),
+        max_concurrent_transfers=get_optional(parser, parser.getint, INDEXER_SECTION, MAX_CONCURRENT_TRANSFERS,
+                                              DEFAULT_MAX_CONCURRENT_TRANSFERS),
+        hash_algorithm=get_optional(parser, parser.get, INDEXER_SECTION, HASH_ALGORITHM, DEFAULT_HASH_ALGORITHM),
+        tree_hash=get_optional(parser, parser.getboolean, INDEXER_SECTION, TREE_HASH, DEFAULT_TREE_HASH),
+        tree_hash_chunk_size_in_mb=get_optional(parser, parser.getint, INDEXER_SECTION, TREE_HASH_CHUNK_SIZE,
+                                                DEFAULT_TREE_HASH_CHUNK_SIZE),
+        hash_threads=get_optional(parser, parser.getint, INDEXER_SECTION, HASH_THREADS, DEFAULT_HASH_THREADS),
+        max_index_attempts=get_optional(parser, parser.getint, INDEXER_SECTION, MAX_INDEX_ATTEMPTS,
+                                        DEFAULT_MAX_INDEX_ATTEMPTS),
+        failure_backoff=get_optional(parser, parser.getint, INDEXER_SECTION, FAILURE_BACKOFF, DEFAULT_FAILURE_BACKOFF),
+        mtp_media_directories=tuple(parser.get(MTP_SECTION, PATHS_TO_INDEX).split(DELIMITER)),
+        mtp_devices_to_ignore=tuple(parser.get(MTP_SECTION, IGNORE).split(DELIMITER)),
+        mtp_use_libmtp=get_optional(parser, parser.getboolean, MTP_SECTION, USE_LIBMTP, DEFAULT_USE_LIBMTP),
+        usb_media_directories=tuple(parser.get(USB_SECTION, PATHS_TO_INDEX).split(DELIMITER)),
+        usb_mount_points=tuple(parser.get(USB_SECTION, MOUNT_POINTS).split(DELIMITER)),
+        usb_devices_to_ignore=tuple(parser.get(USB_SECTION, IGNORE).split(DELIMITER)),
+        haystack_root=haystack_root,
+        thumbnail_path_pattern=os.path.join(haystack_root, parser.get(PATHS_TO_FILES_SECTION, THUMBNAIL_PATH)),
+        picture_path_pattern=os.path.join(haystack_root, parser.get(PATHS_TO_FILES_SECTION, PICTURE_PATH)),
+        video_path_pattern=os.path.join(haystack_root, parser.get(PATHS_TO_FILES_SECTION, VIDEO_PATH)),
+        thumbnail_size=parser.getint(PATHS_TO_FILES_SECTION, THUMBNAIL_SIZE),
+        state_database_path=get_path(PATHS_TO_FILES_SECTION, STATE_DATABASE_PATH, DEFAULT_STATE_DATABASE_PATH),
+        firebase_name=parser.get(INDEX_SECTION, FIREBASE_NAME),
+        firebase_secret=parser.get(INDEX_SECTION, FIREBASE_SECRET),
+        firebase_sync_enabled=get_optional(parser, parser.getboolean, INDEX_SECTION, SYNC_TO_FIREBASE,
+                                           DEFAULT_SYNC_TO_FIREBASE))
+
+    for name in ['indexer_delay', 'indexer_run_budget', 'indexer_workers', 'max_concurrent_transfers',
+                 'tree_hash_chunk_size_in_mb', 'max_index_attempts', 'failure_backoff', 'thumbnail_size']:
+        if getattr(snapshot, name) < 1:
+            raise RuntimeError('Config value must be at least 1! {0}={1}'.format(name, getattr(snapshot, name)))
+
+    if snapshot.hash_threads < 0:
+        raise RuntimeError('HashThreads must not be negative! hash_threads={0}'.format(snapshot.hash_threads))
+
+    if snapshot.indexer_max_delay < snapshot.indexer_delay:
+        raise RuntimeError('MaxExecutionIntervalInSeconds must not be less than ExecutionIntervalInSeconds!')
+
+    return snapshot
+
+
+# Reads config.properties into ConfigSnapshots. The file is only parsed again when its mtime changes, or after
+# request_reload is called (on SIGHUP, for example), into a new parser each time, so that keys removed from the file
+# go back to their defaults. A config file that fails validation on reload is logged and ignored, and the previous
+# snapshot stays in use.
 class Config:
-    def __init__(self, config=None):
-        if config is None:
-            config = ConfigParser()
+    def __init__(self, new_parser=None):
+        if new_parser is None:
+            new_parser = ConfigParser
 
-        self.config = config
+        self.new_parser = new_parser
+        # Config is shared by threads (the indexing pipeline and device transfers), so only one of them reloads it.
+        self.lock = threading.Lock()
+        self.current = None
+        self.mtime = None
+        self.reload_generation = None
+        self.next_check = 0
         self.refresh_config()
 
     def refresh_config(self):
-        self.config.read(CONFIG_FILE)
+        with self.lock:
+            now = time.time()
+            reload_requested = self.reload_generation != reload_generation
+            if self.current is not None and not reload_requested and now < self.next_check:
+                return
 
-    def indexer_delay(self):
+            self.next_check = now + RELOAD_CHECK_INTERVAL_IN_SECONDS
+            mtime = self.__config_file_mtime()
+            if self.current is not None and not reload_requested and mtime == self.mtime:
+                return
+
+            self.mtime = mtime
+            self.reload_generation = reload_generation
+            parser = self.new_parser()
+            parser.read(CONFIG_FILE)
+            try:
+                self.current = load_snapshot(parser)
+            except Exception:
+                if self.current is None:
+                    raise
+
+                logging.exception('Unable to reload config, keeping the previous values. config_file=%s', CONFIG_FILE)
+
+    # Returns the current snapshot. Hold on to it to use a consistent set of values across several lookups.
+    def snapshot(self):
         self.refresh_config()
-        return int(self.config.get(TIMING_SECTION, EXECUTION_INTERVAL))
+        return self.current
+
+    def indexer_delay(self):
+        return self.snapshot().indexer_delay
+
+    def indexer_max_delay(self):
+        return self.snapshot().indexer_max_delay
+
+    def indexer_run_budget(self):
+        return self.snapshot().indexer_run_budget
+
+    def indexer_workers(self):
+        return self.snapshot().indexer_workers
+
+    def stream_transfers(self):
+        return self.snapshot().stream_transfers
+
+    def max_concurrent_transfers(self):
+        return self.snapshot().max_concurrent_transfers
+
+    def hash_algorithm(self):
+        return self.snapshot().hash_algorithm
+
+    def tree_hash(self):
+        return self.snapshot().tree_hash
+
+    def tree_hash_chunk_size_in_mb(self):
+        return self.snapshot().tree_hash_chunk_size_in_mb
+
+    def hash_threads(self):
+        return self.snapshot().hash_threads
+
+    def max_index_attempts(self):
+        return self.snapshot().max_index_attempts
+
+    def failure_backoff(self):
+        return self.snapshot().failure_backoff
 
     def mtp_media_directories(self):
-        self.refresh_config()
-        return self.config.get(MTP_SECTION, PATHS_TO_INDEX).split(DELIMITER)
+        return list(self.snapshot().mtp_media_directories)
 
     def mtp_devices_to_ignore(self):
-        self.refresh_config()
-        return self.config.get(MTP_SECTION, IGNORE).split(DELIMITER)
+        return list(self.snapshot().mtp_devices_to_ignore)
+
+    def mtp_use_libmtp(self):
+        return self.snapshot().mtp_use_libmtp
 
     def usb_media_directories(self):
-        self.refresh_config()
-        return self.config.get(USB_SECTION, PATHS_TO_INDEX).split(DELIMITER)
+        return list(self.snapshot().usb_media_directories)
 
     def usb_mount_points(self):
-        self.refresh_config()
-        return self.config.get(USB_SECTION, MOUNT_POINTS).split(DELIMITER)
+        return list(self.snapshot().usb_mount_points)
 
     def usb_devices_to_ignore(self):
-        self.refresh_config()
-        return self.config.get(USB_SECTION, IGNORE).split(DELIMITER)
+        return list(self.snapshot().usb_devices_to_ignore)
 
     def haystack_root(self):
-        self.refresh_config()
-        return self.config.get(PATHS_TO_FILES_SECTION, HAYSTACK_ROOT)
+        return self.snapshot().haystack_root
 
     def staging_root(self):
         return os.path.join(self.haystack_root(), STAGING_DIRECTORY)
@@ -73,26 +285,35 @@ class Config:
     def staging_directory(self, device_id):
         return os.path.join(self.staging_root(), device_id)
 
+    def quarantine_directory(self, device_id):
+        return os.path.join(self.haystack_root(), QUARANTINE_DIRECTORY, device_id)
+
     def thumbnail_path_pattern(self):
-        pattern = self.config.get(PATHS_TO_FILES_SECTION, THUMBNAIL_PATH)
-        return os.path.join(self.haystack_root(), pattern)
+        return self.snapshot().thumbnail_path_pattern
 
     def picture_path_pattern(self):
-        pattern = self.config.get(PATHS_TO_FILES_SECTION, PICTURE_PATH)
-        return os.path.join(self.haystack_root(), pattern)
+        return self.snapshot().picture_path_pattern
 
     def video_path_pattern(self):
-        pattern = self.config.get(PATHS_TO_FILES_SECTION, VIDEO_PATH)
-        return os.path.join(self.haystack_root(), pattern)
+        return self.snapshot().video_path_pattern
 
     def thumbnail_size(self):
-        self.refresh_config()
-        return self.config.getint(PATHS_TO_FILES_SECTION, THUMBNAIL_SIZE)
+        return self.snapshot().thumbnail_size
+
+    def state_database_path(self):
+        return self.snapshot().state_database_path
 
     def firebase_name(self):
-        self.refresh_config()
-        return self.config.get(INDEX_SECTION, FIREBASE_NAME)
+        return self.snapshot().firebase_name
 
     def firebase_secret(self):
-        self.refresh_config()
-        return self.config.get(INDEX_SECTION, FIREBASE_SECRET)
+        return self.snapshot().firebase_secret
+
+    def firebase_sync_enabled(self):
+        return self.snapshot().firebase_sync_enabled
+
+    def __config_file_mtime(self):
+        try:
+            return os.stat(CONFIG_FILE).st_mtime
+        except OSError:
+            return None
@@ -0,0 +1,210 @@
+import hashlib
+import multiprocessing
+import os
+import re
+
+from multiprocessing.pool import ThreadPool
+
+# BLAKE2b is built into hashlib from Python 3.6. Before that, it comes from the pyblake2 package, if it's installed.
+try:
+    from hashlib import blake2b
+except ImportError:
+    try:
+        from pyblake2 import blake2b
+    except ImportError:
+        blake2b = None
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+MD5 = 'md5'
+BLAKE2B = 'blake2b'
+XXH64 = 'xxh64'
+
+# Half of BLAKE2b's largest digest, which is still plenty for telling files apart, and keeps the filenames of placed
+# media to a reasonable length.
+BLAKE2B_DIGEST_SIZE = 32
+
+BLOCK_SIZE_1M = 1048576  # 1024 Bytes * 1024 Bytes = 1M
+READ_ONLY_RAW = 'rb'
+
+HASH_SEPARATOR = '-'
+TREE_LABEL_TEMPLATE = 'tree{0}m'
+TREE_LABEL_PATTERN = re.compile(r'^tree(\d+)m$')
+
+
+# Raised when a file can't be read to hash it. Unlike a problem with where the file is going, this is a problem with
+# the file itself.
+class UnreadableFileError(IOError):
+    pass
+
+
+def new_blake2b():
+    return blake2b(digest_size=BLAKE2B_DIGEST_SIZE)
+
+
+def new_xxh64():
+    return xxhash.xxh64()
+
+
+# Each algorithm, along with whether it's available here.
+def available_algorithms():
+    return {MD5: True, BLAKE2B: blake2b is not None, XXH64: xxhash is not None}
+
+
+def new_hash(algorithm):
+    return {MD5: hashlib.md5, BLAKE2B: new_blake2b, XXH64: new_xxh64}[algorithm]()
+
+
+def create_content_hasher(config):
+    threads = config.hash_threads() or multiprocessing.cpu_count()
+    tree_chunk_size_in_mb = config.tree_hash_chunk_size_in_mb() if config.tree_hash() else None
+    return ContentHasher(config.hash_algorithm(), tree_chunk_size_in_mb, threads)
+
+
+# Returns the label a hash starts with, which tells how it was computed. Plain MD5 hashes have an empty label. Hex
+# digests never contain the separator, so the label is everything up to the last one.
+def get_hash_label(file_hash):
+    return file_hash[:file_hash.rfind(HASH_SEPARATOR) + 1]
+
+
+# Creates a ContentHasher that computes hashes with the given label, like one from get_hash_label.
+def create_content_hasher_for_label(label, threads=1):
+    algorithm = MD5
+    tree_chunk_size_in_mb = None
+    for part in label.split(HASH_SEPARATOR)[:-1]:
+        tree_label = TREE_LABEL_PATTERN.match(part)
+        if tree_label is not None:
+            tree_chunk_size_in_mb = int(tree_label.group(1))
+        elif part in available_algorithms():
+            algorithm = part
+        else:
+            raise RuntimeError('Unknown hash label! label=' + label)
+
+    return ContentHasher(algorithm, tree_chunk_size_in_mb, threads)
+
+
+# A tree hash, computed as the file is read: the file is split into chunks, each chunk is hashed on its own, and the
+# result is the hash of all of the chunks' digests, in order. Works like a hashlib object.
+class TreeHash:
+    def __init__(self, algorithm, chunk_size):
+        self.algorithm = algorithm
+        self.chunk_size = chunk_size
+        self.root = new_hash(algorithm)
+        self.chunk = new_hash(algorithm)
+        self.chunk_length = 0
+
+    def update(self, data):
+        data = memoryview(data)
+        while len(data) > 0:
+            count = min(len(data), self.chunk_size - self.chunk_length)
+            self.chunk.update(data[:count])
+            self.chunk_length += count
+            data = data[count:]
+
+            if self.chunk_length == self.chunk_size:
+                self.root.update(self.chunk.digest())
+                self.chunk = new_hash(self.algorithm)
+                self.chunk_length = 0
+
+    def hexdigest(self):
+        root = self.root.copy()
+        if self.chunk_length > 0:
+            root.update(self.chunk.digest())
+        return root.hexdigest()
+
+
+# A hash of a file's contents, computed as the file is read. Its hexdigest is the value stored in the index and used to
+# name placed media, which starts with the algorithm (and the tree's chunk size) so that hashes from different
+# algorithms can't be confused. Plain MD5 hashes have no prefix, the way they were always stored.
+class ContentHash:
+    def __init__(self, checksum, prefix):
+        self.checksum = checksum
+        self.prefix = prefix
+
+    def update(self, data):
+        self.checksum.update(data)
+
+    def hexdigest(self):
+        return self.prefix + self.checksum.hexdigest()
+
+
+# Hashes media files to identify them. With a tree chunk size, large files are hashed as a tree of chunks, and the
+# chunks are hashed on a pool of threads. hashlib releases the GIL while it hashes large buffers, and reads release it
+# too, so a multi-GB video is hashed on every core instead of just one.
+class ContentHasher:
+    def __init__(self, algorithm=MD5, tree_chunk_size_in_mb=None, threads=1):
+        if algorithm not in available_algorithms():
+            raise RuntimeError('Unknown hash algorithm! algorithm=' + algorithm)
+
+        if not available_algorithms()[algorithm]:
+            raise RuntimeError('Hash algorithm is not installed! algorithm=' + algorithm)
+
+        label = []
+        if algorithm != MD5 or tree_chunk_size_in_mb is not None:
+            label.append(algorithm)
+        if tree_chunk_size_in_mb is not None:
+            label.append(TREE_LABEL_TEMPLATE.format(tree_chunk_size_in_mb))
+
+        self.algorithm = algorithm
+        self.tree_chunk_size = tree_chunk_size_in_mb * BLOCK_SIZE_1M if tree_chunk_size_in_mb is not None else None
+        self.threads = threads
+        self.prefix = ''.join(part + HASH_SEPARATOR for part in label)
+
+    # Returns a new ContentHash, to be updated with a file's contents as it's read.
+    def new(self):
+        if self.tree_chunk_size is None:
+            return ContentHash(new_hash(self.algorithm), self.prefix)
+
+        return ContentHash(TreeHash(self.algorithm, self.tree_chunk_size), self.prefix)
+
+    # Raises UnreadableFileError if the file can't be read.
+    def hash_file(self, path_to_file):
+        try:
+            return self.__hash_file(path_to_file)
+        except (IOError, OSError) as e:
+            raise UnreadableFileError(e.errno, e.strerror, path_to_file)
+
+    def __hash_file(self, path_to_file):
+        if self.tree_chunk_size is not None and self.threads > 1:
+            offsets = range(0, os.path.getsize(path_to_file), self.tree_chunk_size)
+            if len(offsets) > 1:
+                return self.__hash_chunks_in_parallel(path_to_file, offsets)
+
+        content_hash = self.new()
+        with open(path_to_file, READ_ONLY_RAW) as f:
+            for block in iter(lambda: f.read(BLOCK_SIZE_1M), b''):
+                content_hash.update(block)
+
+        return content_hash.hexdigest()
+
+    def __hash_chunks_in_parallel(self, path_to_file, offsets):
+        pool = ThreadPool(min(self.threads, len(offsets)))
+        try:
+            digests = pool.map(lambda offset: self.__hash_chunk(path_to_file, offset), offsets)
+        finally:
+            pool.terminate()
+            pool.join()
+
+        root = new_hash(self.algorithm)
+        for digest in digests:
+            root.update(digest)
+
+        return self.prefix + root.hexdigest()
+
+    def __hash_chunk(self, path_to_file, offset):
+        chunk = new_hash(self.algorithm)
+        remaining = self.tree_chunk_size
+        with open(path_to_file, READ_ONLY_RAW) as f:
+            f.seek(offset)
+            while remaining > 0:
+                block = f.read(min(remaining, BLOCK_SIZE_1M))
+                if not block:
+                    break
+
+                chunk.update(block)
+                remaining -= len(block)
+
+        return chunk.digest()
@@ -0,0 +1,142 @@
+import ctypes
+import ctypes.util
+import errno
+import io
+import logging
+import os
+import sys
+import threading
+
+# Big enough that copying a photo takes a handful of reads, and a multiple of every common block size.
+BUFFER_SIZE = 4 * 1048576
+
+# The most bytes a single copy_file_range or sendfile call is asked to copy. Linux copies at most about 2G per call.
+MAX_KERNEL_COPY_SIZE = 1073741824
+
+# Errors meaning the kernel can't copy between these two files, so they have to be copied through a buffer instead.
+UNSUPPORTED_ERRNOS = set([errno.ENOSYS, errno.EXDEV, errno.EINVAL, errno.EOPNOTSUPP])
+
+
+def load_libc():
+    libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    if hasattr(libc, 'copy_file_range'):
+        libc.copy_file_range.restype = ctypes.c_ssize_t
+        libc.copy_file_range.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_int, ctypes.c_void_p,
+                                         ctypes.c_size_t, ctypes.c_uint]
+    if hasattr(libc, 'sendfile'):
+        libc.sendfile.restype = ctypes.c_ssize_t
+        libc.sendfile.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_void_p, ctypes.c_size_t]
+    return libc
+
+
+# Copies files without passing the bytes through Python when it can. On Linux, copy_file_range (or sendfile, on older
+# kernels) copies inside the kernel, and can even share blocks on filesystems that support it. Everywhere else, files
+# are copied through a large buffer. Copies keep the source's modification time, and a copy that doesn't end up the
+# same size as the source is an error.
+class CopyEngine:
+    def __init__(self, libc=None):
+        if libc is None:
+            try:
+                libc = load_libc()
+            except OSError as e:
+                logging.warn('Unable to load libc, copying files through a buffer. error=%s', e)
+
+        # Other systems have functions with these names, but they don't copy between files.
+        self.kernel_copies = []
+        if libc is not None and sys.platform.startswith('linux'):
+            if hasattr(libc, 'copy_file_range'):
+                self.kernel_copies.append(self.__copy_file_range)
+            if hasattr(libc, 'sendfile'):
+                self.kernel_copies.append(self.__sendfile)
+
+        self.libc = libc
+        # Files can be copied from several threads at once, so each one gets its own buffer.
+        self.buffers = threading.local()
+
+    # Copies src to dest. If given, checksum (a hashlib object) is updated with every byte of the copy: the copy is read
+    # back once if the kernel copied it, and otherwise the bytes are checksummed as they pass through the buffer.
+    def copy(self, src, dest, checksum=None):
+        with io.open(src, 'rb', buffering=0) as src_file:
+            stat = os.fstat(src_file.fileno())
+            with io.open(dest, 'w+b', buffering=0) as dest_file:
+                copied = self.__copy_in_kernel(src_file, dest_file)
+                if copied is None:
+                    copied = self.__copy_through_buffer(src_file, dest_file, checksum)
+                elif checksum is not None:
+                    dest_file.seek(0)
+                    self.__checksum(dest_file, checksum)
+
+        if copied != stat.st_size:
+            msg = 'Copy of file is incomplete! src={0} size={1} copied_size={2}'
+            raise RuntimeError(msg.format(src, stat.st_size, copied))
+
+        os.utime(dest, (stat.st_atime, stat.st_mtime))
+
+    # Returns the number of bytes copied, or None if the kernel can't copy between these files. Nothing has been copied
+    # in that case.
+    def __copy_in_kernel(self, src_file, dest_file):
+        for kernel_copy in self.kernel_copies:
+            copied = 0
+            while True:
+                count = kernel_copy(src_file.fileno(), dest_file.fileno())
+                if count < 0:
+                    error = ctypes.get_errno()
+                    if error == errno.EINTR:
+                        continue
+                    if copied == 0 and error in UNSUPPORTED_ERRNOS:
+                        break
+                    raise OSError(error, os.strerror(error), src_file.name)
+
+                if count == 0:
+                    return copied
+
+                copied += count
+
+        return None
+
+    def __copy_file_range(self, src_fd, dest_fd):
+        return self.libc.copy_file_range(src_fd, None, dest_fd, None, MAX_KERNEL_COPY_SIZE, 0)
+
+    def __sendfile(self, src_fd, dest_fd):
+        return self.libc.sendfile(dest_fd, src_fd, None, MAX_KERNEL_COPY_SIZE)
+
+    # Returns the number of bytes copied.
+    def __copy_through_buffer(self, src_file, dest_file, checksum):
+        view = self.__get_buffer()
+        copied = 0
+        while True:
+            count = src_file.readinto(view)
+            if not count:
+                return copied
+
+            if checksum is not None:
+                checksum.update(view[:count])
+
+            written = 0
+            while written < count:
+                written += dest_file.write(view[written:count])
+
+            copied += count
+
+    def __checksum(self, f, checksum):
+        view = self.__get_buffer()
+        while True:
+            count = f.readinto(view)
+            if not count:
+                return
+
+            checksum.update(view[:count])
+
+    def __get_buffer(self):
+        if not hasattr(self.buffers, 'buffer'):
+            self.buffers.buffer = bytearray(BUFFER_SIZE)
+
+        return memoryview(self.buffers.buffer)
+
+
+def remove_quietly(path_to_file):
+    try:
+        os.remove(path_to_file)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
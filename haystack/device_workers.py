@@ -0,0 +1,38 @@
+import logging
+import threading
+
+JOIN_INTERVAL_IN_SECONDS = 1
+
+
+# Transfers from every device at the same time, each on its own thread, instead of draining devices one after another.
+# Staged files can't collide: MTP devices stage into a directory per serial number, and files from USB devices are
+# given unique names. A failure on one device doesn't stop the others; once every worker is done, the first failure is
+# raised again.
+class DeviceWorkers:
+    # Runs each (device_id, transfer) pair, where transfer is a function that transfers everything from the device, and
+    # waits for all of them to finish.
+    def run(self, transfers):
+        failures = []
+        threads = []
+        for device_id, transfer in transfers:
+            thread = threading.Thread(target=self.__run_transfer, args=(device_id, transfer, failures),
+                                      name='transfer-{0}'.format(device_id))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+        # On Python 2, a join without a timeout holds off signal handlers until the thread finishes, so wait in short
+        # steps to let SIGTERM stop a long transfer.
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(JOIN_INTERVAL_IN_SECONDS)
+
+        if failures:
+            raise failures[0]
+
+    def __run_transfer(self, device_id, transfer, failures):
+        try:
+            transfer()
+        except Exception as e:
+            logging.exception('Unable to transfer media from device. device_id=%s', device_id)
+            failures.append(e)
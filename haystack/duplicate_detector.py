@@ -0,0 +1,113 @@
+import hashlib
+import logging
+import multiprocessing
+import os
+
+from config import Config
+from content_hash import create_content_hasher_for_label
+from content_hash import get_hash_label
+from local_index import LocalIndex
+
+# How much of the start, and of the end, of a file is read for its sample hash.
+SAMPLE_SIZE = 2 * 1048576
+READ_ONLY_RAW = 'rb'
+
+
+# Hashes the first and last SAMPLE_SIZE bytes of a file. Files that big or smaller are read once, in full.
+def get_sample_hash(path_to_file, size):
+    md5 = hashlib.md5()
+    with open(path_to_file, READ_ONLY_RAW) as f:
+        md5.update(f.read(SAMPLE_SIZE))
+        if size > SAMPLE_SIZE:
+            f.seek(max(SAMPLE_SIZE, size - SAMPLE_SIZE))
+            md5.update(f.read(SAMPLE_SIZE))
+
+    return md5.hexdigest()
+
+
+# Tells whether a staged file could be a duplicate of indexed media without hashing all of it. The local index records
+# the size of all media, so a file whose size matches nothing can't be a duplicate. If the size matches, the file's
+# first and last few MB are hashed and compared with the same samples of the media with that size, which are only read
+# the first time they're needed and then kept in the index. Only a file that matches both ways is likely enough to be a
+# duplicate to be worth a full hash.
+class DuplicateDetector:
+    def __init__(self, config=None, index=None):
+        if config is None:
+            config = Config()
+
+        if index is None:
+            index = LocalIndex(config)
+
+        self.config = config
+        self.index = index
+        self.content_hashers = {}
+
+    # Returns False only if the file can't be a duplicate of any indexed media. If the file can't be read, it's left to
+    # the full hash to fail.
+    def may_be_duplicate(self, path_to_file):
+        try:
+            size = os.path.getsize(path_to_file)
+            candidates = self.index.find_media_with_size(size)
+            if not candidates:
+                return False
+
+            sample_hash = get_sample_hash(path_to_file, size)
+        except (IOError, OSError):
+            logging.exception('Unable to sample file, assuming it may be a duplicate. path_to_file=%s', path_to_file)
+            return True
+
+        for media_id, path_to_media, candidate_sample_hash in candidates:
+            if candidate_sample_hash is None:
+                candidate_sample_hash = self.__sample_media(media_id, path_to_media, size)
+
+            if candidate_sample_hash is None or candidate_sample_hash == sample_hash:
+                logging.info('File may be a duplicate. path_to_file=%s path_to_media=%s', path_to_file, path_to_media)
+                return True
+
+        return False
+
+    # Returns True if the file is a duplicate of media that was indexed with a different hash algorithm than file_hash
+    # (before HashAlgorithm or TreeHash changed), which can only be found by hashing the file the same way again. Only
+    # media of the same size can match, so the file is rarely hashed more than once.
+    def matches_other_hash_algorithms(self, path_to_file, file_hash):
+        label = get_hash_label(file_hash)
+        for other_label in self.index.find_hash_labels_with_size(os.path.getsize(path_to_file)):
+            if other_label == label:
+                continue
+
+            content_hasher = self.__content_hasher(other_label)
+            if content_hasher is None:
+                continue
+
+            other_hash = content_hasher.hash_file(path_to_file)
+            if self.index.is_duplicate(other_hash):
+                logging.info('File matches media indexed with another hash algorithm. path_to_file=%s hash=%s',
+                             path_to_file, other_hash)
+                return True
+
+        return False
+
+    # Returns None if the algorithm isn't available here, like one from a newer version of hashlib. Files can't be
+    # compared with media hashed that way, which is only logged the first time.
+    def __content_hasher(self, label):
+        if label not in self.content_hashers:
+            threads = self.config.hash_threads() or multiprocessing.cpu_count()
+            try:
+                self.content_hashers[label] = create_content_hasher_for_label(label, threads)
+            except RuntimeError as e:
+                logging.warn('Unable to compare files with media indexed with this hash algorithm. label=%s error=%s',
+                             label, e)
+                self.content_hashers[label] = None
+
+        return self.content_hashers[label]
+
+    # Returns None if the media can't be read.
+    def __sample_media(self, media_id, path_to_media, size):
+        try:
+            sample_hash = get_sample_hash(os.path.join(self.config.haystack_root(), path_to_media), size)
+        except IOError as e:
+            logging.warn('Unable to sample indexed media. path_to_media=%s error=%s', path_to_media, e)
+            return None
+
+        self.index.record_sample_hash(media_id, sample_hash)
+        return sample_hash
@@ -12,3 +12,19 @@ class Executor:
         output = subprocess.check_output(args)
         logging.info('Returning command output. args=%s output=%s', str(args), output)
         return output
+
+    # Yields the command's output one line at a time, as it's written, instead of waiting for the whole thing. Raises a
+    # CalledProcessError once the output is exhausted if the command failed.
+    def execute_lines(self, args):
+        logging.info('Executing command and streaming output. args=%s', str(args))
+        process = subprocess.Popen(args, stdout=subprocess.PIPE)
+        try:
+            for line in iter(process.stdout.readline, ''):
+                yield line.rstrip('\r\n')
+        finally:
+            # If the caller stops early, closing the pipe makes the command exit rather than block on a full pipe.
+            process.stdout.close()
+            process.wait()
+
+        if process.returncode != 0:
+            raise subprocess.CalledProcessError(process.returncode, args)
@@ -0,0 +1,175 @@
+import errno
+import json
+import logging
+import os
+import select
+import subprocess
+import threading
+import time
+
+EXIFTOOL_COMMAND = ['exiftool']
+DEFAULT_TIMEOUT_IN_SECONDS = 30
+TERMINATE_TIMEOUT_IN_SECONDS = 5
+
+STAY_OPEN_ARGS = ['-stay_open', 'True', '-@', '-', '-common_args', '-G', '-n']
+EXECUTE = '-execute\n'
+STAY_OPEN_FALSE = '-stay_open\nFalse\n'
+JSON_ARG = '-j'
+TAG_ARG_TEMPLATE = '-{0}'
+
+SENTINEL = '{ready}'
+BLOCK_SIZE = 4096
+NEWLINE = '\n'
+
+
+# Calls function until it isn't interrupted by a signal.
+def retry_on_eintr(function, *args):
+    while True:
+        try:
+            return function(*args)
+        except (IOError, OSError) as e:
+            if e.errno != errno.EINTR:
+                raise
+
+
+# A long-lived exiftool process running in -stay_open mode. The process is started lazily on first use, restarted if it
+# dies, and killed if a single request takes longer than the configured timeout. All requests are serialized, so a
+# single session may be shared by everything running in the indexer process.
+class ExifToolSession:
+    def __init__(self, command=None, timeout=DEFAULT_TIMEOUT_IN_SECONDS):
+        if command is None:
+            command = EXIFTOOL_COMMAND
+
+        self.command = command
+        self.timeout = timeout
+        self.process = None
+        self.lock = threading.Lock()
+
+    def execute(self, *params):
+        with self.lock:
+            try:
+                try:
+                    self.__send(params)
+                except (IOError, OSError):
+                    # The process died in between requests. Start a new one and try once more.
+                    logging.warn('exiftool process is not responding, restarting it. command=%s', self.command)
+                    self.__kill()
+                    self.__send(params)
+
+                return self.__read_output(params)
+            except BaseException:
+                # Whatever stopped the request (even a signal handler), its output may still be on its way. The next
+                # request would read it as its own, so the process can't be used again.
+                self.__kill()
+                raise
+
+    def execute_json(self, *params):
+        output = self.execute(JSON_ARG, *params)
+        if not output:
+            return []
+
+        return json.loads(output)
+
+    def get_metadata(self, filename):
+        return self.get_metadata_batch([filename])[0]
+
+    def get_metadata_batch(self, filenames):
+        results = self.execute_json(*filenames)
+        if len(results) != len(filenames):
+            logging.error('exiftool did not return metadata for every file. filenames=%s', filenames)
+            raise RuntimeError('exiftool did not return metadata for every file!')
+
+        return results
+
+    # Returns only the requested tags for each file. Files that exiftool could not read are left out of the results, so
+    # the results should be matched up with the filenames using the 'SourceFile' key.
+    def get_tags_batch(self, tags, filenames):
+        tag_args = [TAG_ARG_TEMPLATE.format(tag) for tag in tags]
+        return self.execute_json(*(tag_args + list(filenames)))
+
+    def is_running(self):
+        return self.process is not None and self.process.poll() is None
+
+    def close(self):
+        with self.lock:
+            if not self.is_running():
+                self.process = None
+                return
+
+            logging.info('Shutting down exiftool process. pid=%d', self.process.pid)
+            try:
+                self.process.stdin.write(STAY_OPEN_FALSE)
+                self.process.stdin.flush()
+                self.__wait_for_exit(TERMINATE_TIMEOUT_IN_SECONDS)
+            except (IOError, OSError):
+                pass
+
+            self.__kill()
+
+    def __start(self):
+        with open(os.devnull, 'w') as devnull:
+            self.process = subprocess.Popen(self.command + STAY_OPEN_ARGS, stdin=subprocess.PIPE,
+                                            stdout=subprocess.PIPE, stderr=devnull)
+        logging.info('Started exiftool process. pid=%d command=%s', self.process.pid, self.command)
+
+    def __send(self, params):
+        if not self.is_running():
+            self.__start()
+
+        self.process.stdin.write(NEWLINE.join(params) + NEWLINE + EXECUTE)
+        self.process.stdin.flush()
+
+    def __read_output(self, params):
+        fd = self.process.stdout.fileno()
+        deadline = time.time() + self.timeout
+        output = ''
+        while not output[-32:].strip().endswith(SENTINEL):
+            remaining = deadline - time.time()
+            readable = []
+            if remaining > 0:
+                readable = self.__wait_until_readable(fd, remaining)
+
+            if not readable:
+                logging.error('exiftool request timed out, killing the process. timeout=%d params=%s',
+                              self.timeout, params)
+                self.__kill()
+                raise RuntimeError('exiftool request timed out!')
+
+            block = retry_on_eintr(os.read, fd, BLOCK_SIZE)
+            if not block:
+                logging.error('exiftool process exited unexpectedly. params=%s', params)
+                self.__kill()
+                raise RuntimeError('exiftool process exited unexpectedly!')
+
+            output += block
+
+        return output.strip()[:-len(SENTINEL)].strip()
+
+    # Returns an empty list if the timeout expires first. Signals (like SIGHUP, to reload the config) interrupt select,
+    # in which case it waits for whatever is left of the timeout.
+    def __wait_until_readable(self, fd, timeout):
+        deadline = time.time() + timeout
+        while True:
+            try:
+                readable, _, _ = select.select([fd], [], [], max(deadline - time.time(), 0))
+                return readable
+            except select.error as e:
+                if e.args[0] != errno.EINTR:
+                    raise
+
+    def __wait_for_exit(self, timeout):
+        deadline = time.time() + timeout
+        while self.process.poll() is None and time.time() < deadline:
+            time.sleep(0.05)
+
+    def __kill(self):
+        if self.process is None:
+            return
+
+        if self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+
+        self.process.stdin.close()
+        self.process.stdout.close()
+        self.process = None
@@ -0,0 +1,147 @@
+import collections
+import json
+import logging
+import os
+import threading
+import time
+
+from config import Config
+from state_database import open_state_database
+from util import Util
+
+SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS failures (
+           path_to_file TEXT PRIMARY KEY,
+           device_id TEXT NOT NULL,
+           size INTEGER NOT NULL,
+           mtime REAL NOT NULL,
+           reason TEXT NOT NULL,
+           attempts INTEGER NOT NULL,
+           first_failed INTEGER NOT NULL,
+           last_failed INTEGER NOT NULL,
+           retry_after INTEGER NOT NULL)''',
+    'CREATE INDEX IF NOT EXISTS failures_device_id ON failures (device_id)'
+]
+
+SELECT_FAILURE = '''SELECT path_to_file, device_id, size, mtime, reason, attempts, first_failed, last_failed,
+                           retry_after
+                    FROM failures WHERE path_to_file = ?'''
+SELECT_DEVICE_PATHS = 'SELECT path_to_file FROM failures WHERE device_id = ?'
+INSERT_FAILURE = 'INSERT OR REPLACE INTO failures VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)'
+DELETE_FAILURE = 'DELETE FROM failures WHERE path_to_file = ?'
+
+# However many times a file has failed, it's retried at least this often.
+MAX_BACKOFF_IN_SECONDS = 24 * 60 * 60
+
+REPORT_EXT = '.failure.json'
+QUARANTINED_FILE_TEMPLATE = '{0}-{1}'
+
+# The failures of a staged file that hasn't been indexed yet. Times are in seconds since the epoch.
+Failure = collections.namedtuple('Failure', ['path_to_file', 'device_id', 'size', 'mtime', 'reason', 'attempts',
+                                             'first_failed', 'last_failed', 'retry_after'])
+
+
+# Keeps staged files that keep failing to index from being retried on every run. After each failure, a file isn't
+# attempted again until a backoff has passed, which doubles with every attempt. Once a file has failed MaxIndexAttempts
+# times, it's moved to the quarantine directory, next to a report of why it failed. A file that changes (by size or
+# modification time) starts over, and failures of files that are no longer in staging are forgotten. Only failures
+# caused by the file itself should be recorded, since anything else would fail the same way for every staged file.
+class FailureTracker:
+    def __init__(self, config=None, util=None, path_to_database=None):
+        if config is None:
+            config = Config()
+
+        if util is None:
+            util = Util()
+
+        self.config = config
+        self.util = util
+        # Files fail on the indexing pipeline's thread as well as the main thread.
+        self.lock = threading.Lock()
+        self.connection = open_state_database(config, util, SCHEMA, path_to_database)
+
+    # Returns False while the file is waiting out the backoff from its last failure.
+    def may_attempt(self, path_to_file):
+        failure = self.find_failure(path_to_file)
+        return failure is None or not self.__is_same_file(failure, path_to_file) or failure.retry_after <= time.time()
+
+    # Returns the Failure recorded for the file, or None.
+    def find_failure(self, path_to_file):
+        with self.lock:
+            row = self.connection.execute(SELECT_FAILURE, (path_to_file,)).fetchone()
+
+        return Failure(*row) if row is not None else None
+
+    def record_failure(self, device_id, path_to_file, reason):
+        try:
+            stat = os.stat(path_to_file)
+        except OSError:
+            return
+
+        now = int(time.time())
+        failure = self.find_failure(path_to_file)
+        if failure is None or not self.__is_same_file(failure, path_to_file):
+            failure = Failure(path_to_file, device_id, stat.st_size, stat.st_mtime, None, 0, now, None, None)
+
+        attempts = failure.attempts + 1
+        backoff = min(self.config.failure_backoff() * 2 ** (attempts - 1), MAX_BACKOFF_IN_SECONDS)
+        failure = failure._replace(reason=str(reason), attempts=attempts, last_failed=now, retry_after=now + backoff)
+
+        if attempts >= self.config.max_index_attempts():
+            self.__quarantine(failure)
+            return
+
+        logging.info('Backing off from file that failed to index. path_to_file=%s attempts=%d retry_after=%d',
+                     path_to_file, attempts, failure.retry_after)
+        with self.lock, self.connection:
+            self.connection.execute(INSERT_FAILURE, failure)
+
+    # Forgets the failures of every file from the device that isn't among the given files, which should be everything
+    # in the device's staging directory.
+    def forget_missing(self, device_id, paths_to_files):
+        present = set(paths_to_files)
+        with self.lock:
+            missing = [row for row in self.connection.execute(SELECT_DEVICE_PATHS, (device_id,))
+                       if row[0] not in present]
+
+        if not missing:
+            return
+
+        with self.lock, self.connection:
+            self.connection.executemany(DELETE_FAILURE, missing)
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def __is_same_file(self, failure, path_to_file):
+        try:
+            stat = os.stat(path_to_file)
+        except OSError:
+            return False
+
+        return stat.st_size == failure.size and stat.st_mtime == failure.mtime
+
+    def __quarantine(self, failure):
+        quarantine_directory = self.config.quarantine_directory(failure.device_id)
+        path_to_quarantined_file = os.path.join(quarantine_directory, os.path.basename(failure.path_to_file))
+        if os.path.exists(path_to_quarantined_file):
+            path_to_quarantined_file = os.path.join(quarantine_directory, QUARANTINED_FILE_TEMPLATE.format(
+                self.util.get_uuid(), os.path.basename(failure.path_to_file)))
+
+        logging.warn('File failed to index too many times, moving it to quarantine. path_to_file=%s attempts=%d ' +
+                     'path_to_quarantined_file=%s reason=%s', failure.path_to_file, failure.attempts,
+                     path_to_quarantined_file, failure.reason)
+        try:
+            self.util.mkdirp(quarantine_directory)
+            with open(path_to_quarantined_file + REPORT_EXT, 'w') as f:
+                json.dump(failure._asdict(), f, indent=2, sort_keys=True)
+            os.rename(failure.path_to_file, path_to_quarantined_file)
+        except (IOError, OSError):
+            logging.exception('Unable to quarantine file, it will be retried. path_to_file=%s', failure.path_to_file)
+            with self.lock, self.connection:
+                self.connection.execute(INSERT_FAILURE, failure)
+            return
+
+        with self.lock, self.connection:
+            self.connection.execute(DELETE_FAILURE, (failure.path_to_file,))
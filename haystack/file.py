@@ -25,6 +25,16 @@ ROTATION_TAG = {
     '.jpeg': 'EXIF:Orientation'
 }
 
+# Extensions whose metadata can be read in-process, without starting exiftool.
+JPEG_READER = 'jpeg'
+MP4_READER = 'mp4'
+
+NATIVE_METADATA_READER = {
+    '.mp4': MP4_READER,
+    '.jpg': JPEG_READER,
+    '.jpeg': JPEG_READER
+}
+
 
 class File:
     def __init__(self, path_to_file):
@@ -53,6 +63,9 @@ class File:
     def rotation_tag(self):
         return ROTATION_TAG[self.extension]
 
+    def native_metadata_reader(self):
+        return NATIVE_METADATA_READER.get(self.extension)
+
     def __get_extension(self, path_to_file):
         _, extension = os.path.splitext(self.path_to_file)
         extension = extension.lower()
@@ -0,0 +1,137 @@
+import logging
+import os
+import threading
+import time
+
+from config import Config
+from content_hash import create_content_hasher
+from state_database import open_state_database
+from util import Util
+
+SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS hashes (
+           device INTEGER NOT NULL,
+           inode INTEGER NOT NULL,
+           label TEXT NOT NULL,
+           size INTEGER NOT NULL,
+           mtime_ns INTEGER NOT NULL,
+           hash TEXT NOT NULL,
+           last_used INTEGER NOT NULL,
+           PRIMARY KEY (device, inode, label))''',
+    'CREATE INDEX IF NOT EXISTS hashes_last_used ON hashes (last_used)'
+]
+
+SELECT_HASH = 'SELECT size, mtime_ns, hash, last_used FROM hashes WHERE device = ? AND inode = ? AND label = ?'
+INSERT_HASH = 'INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?, ?, ?)'
+TOUCH_HASH = 'UPDATE hashes SET last_used = ? WHERE device = ? AND inode = ? AND label = ?'
+DELETE_HASH = 'DELETE FROM hashes WHERE device = ? AND inode = ? AND label = ?'
+DELETE_FILE = 'DELETE FROM hashes WHERE device = ? AND inode = ?'
+DELETE_UNUSED = 'DELETE FROM hashes WHERE last_used < ?'
+
+# Hashes that haven't been used for this long are evicted when the cache is opened. Most belong to staged files that
+# were indexed and removed long ago.
+MAX_AGE_IN_SECONDS = 30 * 24 * 60 * 60
+
+# A hash's last use is only recorded again once it's this old, so that finding a hash doesn't commit a write every
+# time. It only needs to be precise enough for eviction.
+TOUCH_INTERVAL_IN_SECONDS = 24 * 60 * 60
+
+
+# Python 2 only has the float modification time, which is still precise to the microsecond.
+def get_mtime_ns(stat):
+    return int(stat.st_mtime * 1000000000)
+
+
+# Remembers the hashes of files on disk, by device, inode, size and modification time, so that a file that's hashed
+# again (like a staged file that keeps failing to index) isn't read again. A hash is only returned while the file's
+# size and modification time still match, and a stale hash is evicted as soon as it's found. Hashes are kept per
+# content hash algorithm, since changing it changes every hash.
+class HashCache:
+    def __init__(self, config=None, content_hasher=None, util=None, path_to_database=None):
+        if config is None:
+            config = Config()
+
+        if content_hasher is None:
+            content_hasher = create_content_hasher(config)
+
+        if util is None:
+            util = Util()
+
+        self.content_hasher = content_hasher
+        self.label = content_hasher.prefix
+        self.lock = threading.Lock()
+        self.connection = open_state_database(config, util, SCHEMA, path_to_database)
+
+        with self.lock, self.connection:
+            evicted = self.connection.execute(DELETE_UNUSED, (int(time.time()) - MAX_AGE_IN_SECONDS,)).rowcount
+
+        if evicted > 0:
+            logging.info('Evicted unused hashes from hash cache. count=%d', evicted)
+
+    # Returns the file's hash, reading the file only if its hash isn't known.
+    def hash_file(self, path_to_file):
+        # The file is stat'ed before it's read, so that if it changes while it's being hashed, the hash is stale.
+        stat = os.stat(path_to_file)
+        file_hash = self.__find_hash(stat)
+        if file_hash is None:
+            file_hash = self.content_hasher.hash_file(path_to_file)
+            self.__store_hash(stat, file_hash)
+
+        return file_hash
+
+    # Returns the file's hash if it's known, and None otherwise.
+    def find_hash(self, path_to_file):
+        try:
+            stat = os.stat(path_to_file)
+        except OSError:
+            return None
+
+        return self.__find_hash(stat)
+
+    # Records a hash of the file that was computed elsewhere, like in another process. Nothing is recorded if the file
+    # is gone.
+    def remember(self, path_to_file, file_hash):
+        try:
+            stat = os.stat(path_to_file)
+        except OSError:
+            return
+
+        self.__store_hash(stat, file_hash)
+
+    # Forgets every hash of the file. Call this before removing a file, since its inode may be reused by a file with the
+    # same size and modification time (which some filesystems only keep to the nearest 2 seconds).
+    def forget(self, path_to_file):
+        try:
+            stat = os.stat(path_to_file)
+        except OSError:
+            return
+
+        with self.lock, self.connection:
+            self.connection.execute(DELETE_FILE, (stat.st_dev, stat.st_ino))
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def __find_hash(self, stat):
+        key = (stat.st_dev, stat.st_ino, self.label)
+        with self.lock, self.connection:
+            row = self.connection.execute(SELECT_HASH, key).fetchone()
+            if row is None:
+                return None
+
+            size, mtime_ns, file_hash, last_used = row
+            if size != stat.st_size or mtime_ns != get_mtime_ns(stat):
+                self.connection.execute(DELETE_HASH, key)
+                return None
+
+            now = int(time.time())
+            if now - last_used > TOUCH_INTERVAL_IN_SECONDS:
+                self.connection.execute(TOUCH_HASH, (now,) + key)
+
+            return file_hash
+
+    def __store_hash(self, stat, file_hash):
+        with self.lock, self.connection:
+            self.connection.execute(INSERT_HASH, (stat.st_dev, stat.st_ino, self.label, stat.st_size,
+                                                  get_mtime_ns(stat), file_hash, int(time.time())))
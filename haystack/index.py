@@ -1,3 +1,4 @@
+import hashlib
 import logging
 import time
 
@@ -20,17 +21,45 @@ TYPE = 'type'
 
 ORDER_BY = 'orderBy'
 EQUAL_TO = 'equalTo'
+ERROR = 'error'
+
+# Firebase push ids are 8 characters of timestamp (in milliseconds) followed by 12 random characters, all from this
+# alphabet, which sorts in the same order as the values.
+PUSH_CHARS = '-0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ_abcdefghijklmnopqrstuvwxyz'
+PUSH_ID_TIMESTAMP_LENGTH = 8
+PUSH_ID_RANDOM_LENGTH = 12
+
+
+# Generates a key in the same format as the push ids that Firebase gives media that's posted, so that media sent in
+# batches sorts by when it was indexed, along with everything posted before. The random part comes from the media's
+# hash, so the same media always gets the same key.
+def generate_push_id(date_indexed, hash):
+    timestamp = date_indexed * 1000
+    timestamp_chars = []
+    for _ in range(PUSH_ID_TIMESTAMP_LENGTH):
+        timestamp_chars.append(PUSH_CHARS[timestamp % len(PUSH_CHARS)])
+        timestamp //= len(PUSH_CHARS)
+
+    random_bits = int(hashlib.md5(hash).hexdigest(), 16)
+    random_chars = []
+    for _ in range(PUSH_ID_RANDOM_LENGTH):
+        random_chars.append(PUSH_CHARS[random_bits % len(PUSH_CHARS)])
+        random_bits //= len(PUSH_CHARS)
+
+    return ''.join(reversed(timestamp_chars)) + ''.join(random_chars)
 
 
 class Index:
-    def __init__(self, config=None):
+    def __init__(self, config=None, firebase_url=None):
         if config is None:
             config = Config()
 
         self.config = config
 
-        firebase_name = self.config.firebase_name()
-        self.fb_ref = firebase.FirebaseApplication(FIREBASE_URL_TEMPLATE.format(firebase_name), None)
+        if firebase_url is None:
+            firebase_url = FIREBASE_URL_TEMPLATE.format(self.config.firebase_name())
+
+        self.fb_ref = firebase.FirebaseApplication(firebase_url, None)
 
     def index_media(self, path_to_media, path_to_thumbnail, taken, device_id, hash, type):
         logging.info('Indexing media. path_to_media=%s path_to_thumbnail=%s taken=%d device_id=%s hash=%s type=%s',
@@ -52,6 +81,25 @@ class Index:
 
         self.fb_ref.post(MEDIA_NODE, media_data, params=parameters)
 
+    # Writes many media records with a single multi-path PATCH. Each record is stored under a push id generated from its
+    # index date and hash, so sending the same record more than once (after a retry, for example) leaves a single copy
+    # in the index.
+    def index_media_batch(self, media):
+        logging.info('Indexing media batch. count=%d', len(media))
+
+        updates = {}
+        for media_data in media:
+            updates[generate_push_id(media_data[DATE_INDEXED], media_data[HASH])] = media_data
+
+        parameters = {
+            AUTH: self.config.firebase_secret()
+        }
+
+        result = self.fb_ref.patch(MEDIA_NODE, updates, params=parameters)
+        if isinstance(result, dict) and ERROR in result:
+            logging.error('Firebase rejected media batch. error=%s', result[ERROR])
+            raise RuntimeError('Firebase rejected media batch!')
+
     def is_duplicate(self, hash_to_check):
         parameters = {
             AUTH: self.config.firebase_secret(),
@@ -0,0 +1,74 @@
+import logging
+import threading
+
+FLUSH_INTERVAL_IN_SECONDS = 30
+MIN_BACKOFF_IN_SECONDS = 1
+MAX_BACKOFF_IN_SECONDS = 600
+STOP_TIMEOUT_IN_SECONDS = 10
+
+
+# Pushes media from the local index to its downstream index on a background thread, so the indexer never waits on the
+# network. The flusher wakes up when new media is indexed (or every flush interval), and backs off exponentially while
+# the downstream index is unreachable. Media that hasn't been sent is still in the local index, so nothing is lost if
+# the process restarts before it's flushed.
+class IndexFlusher:
+    def __init__(self, local_index, flush_interval=FLUSH_INTERVAL_IN_SECONDS, min_backoff=MIN_BACKOFF_IN_SECONDS,
+                 max_backoff=MAX_BACKOFF_IN_SECONDS):
+        self.local_index = local_index
+        self.flush_interval = flush_interval
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.backoff = None
+        self.wake_up = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if self.thread is not None:
+            return
+
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.__run, name='index-flusher')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def notify(self):
+        self.wake_up.set()
+
+    # Stops the background thread, after one last attempt to flush anything that's waiting.
+    def stop(self):
+        if self.thread is None:
+            return
+
+        self.stopped.set()
+        self.wake_up.set()
+        self.thread.join(STOP_TIMEOUT_IN_SECONDS)
+        self.thread = None
+
+    def __run(self):
+        while True:
+            if self.backoff is None:
+                self.wake_up.wait(self.flush_interval)
+            else:
+                # While backing off, only a stop request should cut the wait short.
+                self.stopped.wait(self.backoff)
+
+            # Checked before flushing, so a stop request always gets a flush after it, even one that came in while the
+            # previous flush was failing.
+            stopping = self.stopped.is_set()
+            self.wake_up.clear()
+            self.__flush()
+            if stopping:
+                return
+
+    def __flush(self):
+        try:
+            self.local_index.sync_downstream()
+            self.backoff = None
+        except Exception:
+            if self.backoff is None:
+                self.backoff = self.min_backoff
+            else:
+                self.backoff = min(self.backoff * 2, self.max_backoff)
+
+            logging.exception('Unable to flush the index downstream, backing off. backoff=%s', self.backoff)
@@ -1,13 +1,21 @@
-import hashlib
+import collections
 import logging
+import multiprocessing
 import os
 import re
-import shutil
 
 from config import Config
+from content_hash import ContentHasher
+from content_hash import UnreadableFileError
+from content_hash import create_content_hasher
 from datetime import datetime
+from duplicate_detector import DuplicateDetector
+from failure_tracker import FailureTracker
 from file import File
-from index import Index
+from hash_cache import HashCache
+from local_index import LocalIndex
+from media_placer import MediaPlacer
+from metadata_helper import DateTakenError
 from metadata_helper import MetadataHelper
 from PIL import Image
 from preprocessor import Preprocessor
@@ -16,8 +24,7 @@ from time import strptime
 from util import Util
 from video_converter import VideoConverter
 
-BLOCK_SIZE_1M = 1048576  # 1024 Bytes * 1024 Bytes = 1M
-READ_ONLY_RAW = 'rb'
+DATE_PREFETCH_CHUNK_SIZE = 100
 EMPTY = ''
 SLASH = '/'
 THUMBNAIL_EXT = '.jpg'
@@ -28,21 +35,102 @@ PATTERN_REPLACE_YEAR = '%Y'
 PATTERN_REPLACE_MONTH = '%M'
 PATTERN_REPLACE_DAY = '%D'
 
+MAIN_PROCESS = 'MainProcess'
+
+# Only problems with a staged file itself count against it in the failure tracker. Anything else, like an unmounted
+# destination, an exiftool timeout or an index that can't be written to, would fail the same way for every file, so
+# the file is just tried again on the next run.
+FILE_SPECIFIC_ERRORS = (DateTakenError, UnreadableFileError)
+
+# What a single indexer run got through: how many staged files it attempted, how many of those it indexed (or removed
+# as duplicates), and whether it stopped because it reached its maximum number of files. Files that fail stay in
+# staging.
+RunSummary = collections.namedtuple('RunSummary', ['attempted', 'indexed', 'budget_reached'])
+
+# State for the worker processes used when indexing in parallel. See init_indexer_worker.
+worker_metadata_helper = None
+worker_content_hasher = None
+worker_log_records = []
+
+
+class LogRecordCollector(logging.Handler):
+    def emit(self, record):
+        # Log records are sent back to the parent process, so they need to be picklable.
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+
+        record.msg = record.getMessage()
+        record.args = None
+        record.exc_info = None
+        worker_log_records.append(record.__dict__)
+
+
+# Sets up a worker process in the indexer pool. Each worker gets its own exiftool session, and collects its log records
+# so that the parent process can write them to its own log along with the file's result.
+def init_indexer_worker(content_hasher=None):
+    global worker_metadata_helper, worker_content_hasher
+    if content_hasher is None:
+        content_hasher = ContentHasher()
+
+    worker_metadata_helper = MetadataHelper()
+    worker_content_hasher = content_hasher
+
+    if multiprocessing.current_process().name != MAIN_PROCESS:
+        root_logger = logging.getLogger()
+        for handler in list(root_logger.handlers):
+            root_logger.removeHandler(handler)
+        root_logger.addHandler(LogRecordCollector())
+
+
+# Hashes a staged file unless its hash is cached, and reads its date taken if it wasn't prefetched, in a worker process.
+# Errors reading the date are returned rather than raised, the same way MetadataHelper.get_dates_taken reports them.
+def hash_and_date_staged_file(task):
+    path_to_file, date_taken, needs_hash = task
+    del worker_log_records[:]
+    try:
+        if date_taken is None:
+            try:
+                date_taken = worker_metadata_helper.get_date_taken(path_to_file)
+            except DateTakenError as e:
+                date_taken = DateTakenError(str(e))
+            except Exception as e:
+                date_taken = RuntimeError(str(e))
+
+        # A file without a date is going to fail, so it isn't worth reading the whole file to hash it.
+        file_hash = None
+        if needs_hash and not isinstance(date_taken, DateTakenError):
+            file_hash = worker_content_hasher.hash_file(path_to_file)
+
+        return file_hash, date_taken, list(worker_log_records)
+    finally:
+        del worker_log_records[:]
+
 
 class Indexer:
     def __init__(self, config=None, index=None, metadata_helper=None, thumbnail_generator=None, util=None,
-                 video_converter=None, preprocessor=None):
+                 video_converter=None, preprocessor=None, pool=None, media_placer=None, content_hasher=None,
+                 duplicate_detector=None, hash_cache=None, failure_tracker=None):
         if config is None:
             config = Config()
 
+        if content_hasher is None:
+            content_hasher = create_content_hasher(config)
+
+        # The pool is started before anything else so that the worker processes don't inherit any threads or open
+        # resources from the rest of the indexer.
+        if pool is None and config.indexer_workers() > 1:
+            logging.info('Starting indexer worker pool. workers=%d', config.indexer_workers())
+            pool = multiprocessing.Pool(config.indexer_workers(), initializer=init_indexer_worker,
+                                        initargs=(content_hasher,))
+
         if index is None:
-            index = Index()
+            index = LocalIndex(config)
 
         if metadata_helper is None:
             metadata_helper = MetadataHelper()
 
         if thumbnail_generator is None:
-            thumbnail_generator = ThumbnailGenerator()
+            thumbnail_generator = ThumbnailGenerator(metadata_helper=metadata_helper)
 
         if util is None:
             util = Util()
@@ -51,7 +139,19 @@ class Indexer:
             video_converter = VideoConverter()
 
         if preprocessor is None:
-            preprocessor = Preprocessor()
+            preprocessor = Preprocessor(metadata_helper)
+
+        if media_placer is None:
+            media_placer = MediaPlacer(util, content_hasher=content_hasher)
+
+        if duplicate_detector is None:
+            duplicate_detector = DuplicateDetector(config, index)
+
+        if hash_cache is None:
+            hash_cache = HashCache(config, content_hasher, util)
+
+        if failure_tracker is None:
+            failure_tracker = FailureTracker(config, util)
 
         self.config = config
         self.index = index
@@ -60,9 +160,16 @@ class Indexer:
         self.util = util
         self.video_converter = video_converter
         self.preprocessor = preprocessor
+        self.pool = pool
+        self.media_placer = media_placer
+        self.duplicate_detector = duplicate_detector
+        self.hash_cache = hash_cache
+        self.failure_tracker = failure_tracker
 
-    def run(self):
-        logging.info('Indexer started.')
+    # Indexes the staged media. If max_files is given, the run stops after attempting that many files, and the rest are
+    # left for the next run.
+    def run(self, max_files=None):
+        logging.info('Indexer started. max_files=%s', max_files)
 
         # Locate the staging directory.
         staging_root = self.config.staging_root()
@@ -72,8 +179,50 @@ class Indexer:
         if not os.path.isdir(staging_root):
             self.util.mkdirp(staging_root)
 
+        attempted = 0
+        indexed = 0
         for staging_dir in self.__device_staging_dirs(staging_root):
-            self.__index_files(staging_dir)
+            remaining = None
+            if max_files is not None:
+                remaining = max_files - attempted
+                if remaining <= 0:
+                    logging.info('Indexer reached the maximum number of files for this run. max_files=%d', max_files)
+                    break
+
+            device_attempted, device_indexed = self.__index_files(staging_dir, remaining)
+            attempted += device_attempted
+            indexed += device_indexed
+
+        logging.info('Indexer finished. attempted=%d indexed=%d', attempted, indexed)
+        return RunSummary(attempted, indexed, max_files is not None and attempted >= max_files)
+
+    # Indexes the given files, which must all be in the staging directory for device_dir. Returns the number indexed.
+    def index_files(self, device_dir, paths_to_index):
+        # Read the dates for a chunk of files with a single exiftool request, rather than one request per file.
+        indexed = 0
+        for i in range(0, len(paths_to_index), DATE_PREFETCH_CHUNK_SIZE):
+            chunk = paths_to_index[i:i + DATE_PREFETCH_CHUNK_SIZE]
+            dates_taken = self.__prefetch_dates_taken(chunk)
+            if self.pool is None:
+                for path_to_file in chunk:
+                    if self.__index_file(device_dir, path_to_file, dates_taken.get(path_to_file)):
+                        indexed += 1
+            else:
+                indexed += self.__index_files_in_parallel(device_dir, chunk, dates_taken)
+
+        return indexed
+
+    # Releases long-lived resources, like the exiftool process, held by the indexer.
+    def close(self):
+        logging.info('Shutting down indexer.')
+        self.metadata_helper.close()
+        self.hash_cache.close()
+        self.failure_tracker.close()
+        self.index.close()
+
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
 
     def __device_staging_dirs(self, staging_root):
         device_staging_dirs = []
@@ -89,8 +238,10 @@ class Indexer:
 
         return device_staging_dirs
 
-    def __index_files(self, device_dir):
+    # Returns the number of files attempted, and the number indexed.
+    def __index_files(self, device_dir, max_files=None):
         staging_dir = self.config.staging_directory(device_dir)
+        paths_to_index = []
         for filename in os.listdir(staging_dir):
             if os.path.isdir(filename):
                 logging.error('found unexpected subdirectory in device staging directory, ignoring. ' +
@@ -100,7 +251,7 @@ class Indexer:
             path_to_file = os.path.join(staging_dir, filename)
             try:
                 if File(path_to_file).is_image() or File(path_to_file).is_video():
-                    self.__index_file(device_dir, path_to_file)
+                    paths_to_index.append(path_to_file)
                 else:
                     logging.info('File is not an image or video, not indexing. file=%s staging_dir=%s',
                                  path_to_file, staging_dir)
@@ -108,71 +259,192 @@ class Indexer:
                 logging.error('File has an unrecognized extension, not indexing. file=%s stating_dir=%s',
                               path_to_file, staging_dir)
 
-    def __index_file(self, device, path_to_file):
+        # Files that failed recently are skipped until their backoff has passed, without counting against max_files.
+        self.failure_tracker.forget_missing(device_dir, paths_to_index)
+        paths_to_attempt = [p for p in paths_to_index if self.failure_tracker.may_attempt(p)]
+        if len(paths_to_attempt) < len(paths_to_index):
+            logging.info('Skipping files that failed to index recently. staging_dir=%s count=%d',
+                         staging_dir, len(paths_to_index) - len(paths_to_attempt))
+        paths_to_index = paths_to_attempt
+
+        if max_files is not None:
+            paths_to_index = paths_to_index[:max_files]
+
+        return len(paths_to_index), self.index_files(device_dir, paths_to_index)
+
+    # Hashing every file that isn't in the hash cache (and any date lookups that weren't prefetched) happens in the
+    # worker pool, so placing a file only has to hash it again if it's copied to another filesystem. Everything that
+    # touches the index or the final location still happens here, one file at a time, so duplicates can't race each
+    # other.
+    def __index_files_in_parallel(self, device_dir, paths_to_files, dates_taken):
+        # Files whose date couldn't be read are going to fail, so rather than being hashed in the pool, they're indexed
+        # right away, which only hashes them if they may be duplicates, and records the failure.
+        indexed = 0
+        paths_to_hash = []
+        for path_to_file in paths_to_files:
+            if isinstance(dates_taken.get(path_to_file), DateTakenError):
+                if self.__index_file(device_dir, path_to_file, dates_taken[path_to_file]):
+                    indexed += 1
+            else:
+                paths_to_hash.append(path_to_file)
+
+        cached_hashes = [self.hash_cache.find_hash(path_to_file) for path_to_file in paths_to_hash]
+        tasks = [(path_to_file, dates_taken.get(path_to_file), cached_hash is None)
+                 for path_to_file, cached_hash in zip(paths_to_hash, cached_hashes)]
+        results = self.pool.imap(hash_and_date_staged_file, tasks)
+        for path_to_file, cached_hash in zip(paths_to_hash, cached_hashes):
+            try:
+                file_hash, date_taken, log_records = results.next()
+            except Exception as e:
+                logging.exception('Indexer worker failed, leaving file in staging area. path_to_file=%s', path_to_file)
+                self.__record_failure(device_dir, path_to_file, e)
+                continue
+
+            for record in log_records:
+                logging.getLogger().handle(logging.makeLogRecord(record))
+
+            if file_hash is not None:
+                self.hash_cache.remember(path_to_file, file_hash)
+            else:
+                file_hash = cached_hash
+
+            # The full hash is already known, so looking it up in the index is cheaper than sampling the file first.
+            if self.__index_file(device_dir, path_to_file, date_taken, file_hash):
+                indexed += 1
+
+        return indexed
+
+    def __prefetch_dates_taken(self, paths_to_files):
+        try:
+            return self.metadata_helper.get_dates_taken(paths_to_files)
+        except Exception:
+            logging.exception('Unable to prefetch dates taken, falling back to reading them one file at a time. ' +
+                              'paths_to_files=%s', paths_to_files)
+            return {}
+
+    # Returns True if the file was indexed, or removed as a duplicate. If file_hash is given, it's looked up in the
+    # index before placing the file.
+    def __index_file(self, device, path_to_file, prefetched_date_taken=None, file_hash=None):
         logging.info('Indexing file=%s', path_to_file)
 
         # Preprocess files. (Rotate images properly)
         # self.preprocessor.preprocess(path_to_file)
 
-        file_hash = self.__get_media_hash(path_to_file)
-        # if self.index.is_duplicate(file_hash):
-        #     logging.info('File hash already appears in index, file appears to be a duplicate, and will be deleted. ' +
-        #                  'path_to_file=%s file_hash=%s', path_to_file, file_hash)
-        #     os.remove(path_to_file)
-        #     return
-
         try:
+            # Files that may be duplicates are hashed up front (unless their hash is cached), so that duplicates can be
+            # dropped before doing anything else. Otherwise the hash is computed while the file is being placed, and the
+            # duplicate check happens then.
+            if file_hash is None:
+                file_hash = self.hash_cache.find_hash(path_to_file)
+                if file_hash is None and self.duplicate_detector.may_be_duplicate(path_to_file):
+                    file_hash = self.hash_cache.hash_file(path_to_file)
+
+            checked_hash = file_hash
+            if file_hash is not None and self.__remove_if_duplicate(path_to_file, file_hash):
+                return True
+
             f = File(path_to_file)
 
             # Get the date the media was taken.
-            date_taken = self.metadata_helper.get_date_taken(path_to_file)
+            if isinstance(prefetched_date_taken, Exception):
+                raise prefetched_date_taken
+            elif prefetched_date_taken is not None:
+                date_taken = prefetched_date_taken
+            else:
+                date_taken = self.metadata_helper.get_date_taken(path_to_file)
 
             # Generate Thumbnail.
+            path_to_thumbnail = None
             # path_to_thumbnail = self.__generate_path_to_thumbnail(f, date_taken, file_hash)
             # self.thumbnail_generator.generate_thumbnail(path_to_file, path_to_thumbnail)
 
             # Copy file to final place, converting .mts to .mp4 if necessary.
-            path_to_final_file = self.__generate_path_to_final_file(f, date_taken, file_hash)
-            final_directory = os.path.dirname(path_to_final_file)
+            final_directory = os.path.dirname(self.__generate_path_to_final_file(f, date_taken, EMPTY))
             if not os.path.isdir(final_directory):
                 self.util.mkdirp(final_directory)
 
-            # if f.is_video() and f.media_type() == MTS:
-            #     path_to_final_file = os.path.splitext(path_to_final_file)[0] + MP4_EXT
-            #     f = File(path_to_final_file)
-            #     logging.info('Converting .mts video to .mp4. path_to_file=%s path_to_final_file=%s create_time=%d',
-            #                  path_to_file, path_to_final_file, date_taken)
-            #     self.video_converter.convert_to_mp4(path_to_file, path_to_final_file, date_taken)
-            # else:
-            logging.info('Copying staged media to final location. path_to_staged_file=%s path_to_final_file=%s',
-                         path_to_file, path_to_final_file)
-            shutil.copy(path_to_file, path_to_final_file)
-
-            # Send data to index. We strip off the root location so that all indexed paths are relative to the haystack
-            # root. This allows us to start the static file server in haystack root, rather than at the root of the
-            # file system.
-            # haystack_root = self.config.haystack_root()
-            # if not haystack_root.endswith(SLASH):
-            #     haystack_root += SLASH
-
-            # self.index.index_media(path_to_final_file.replace(haystack_root, EMPTY, 1),
-            #                        path_to_thumbnail.replace(haystack_root, EMPTY, 1),
-            #                        date_taken, device, file_hash, f.media_type())
+            placement = self.media_placer.stage(path_to_file, final_directory, file_hash)
+            try:
+                file_hash = placement.file_hash
+                self.hash_cache.remember(path_to_file, file_hash)
+                if file_hash != checked_hash and self.__remove_if_duplicate(path_to_file, file_hash):
+                    placement.discard()
+                    return True
+
+                path_to_final_file = self.__generate_path_to_final_file(f, date_taken, file_hash)
+
+                # if f.is_video() and f.media_type() == MTS:
+                #     path_to_final_file = os.path.splitext(path_to_final_file)[0] + MP4_EXT
+                #     f = File(path_to_final_file)
+                #     logging.info('Converting .mts video to .mp4. path_to_file=%s path_to_final_file=%s ' +
+                #                  'create_time=%d', path_to_file, path_to_final_file, date_taken)
+                #     self.video_converter.convert_to_mp4(path_to_file, path_to_final_file, date_taken)
+                # else:
+                logging.info('Placing staged media at final location. path_to_staged_file=%s path_to_final_file=%s',
+                             path_to_file, path_to_final_file)
+                placement.commit(path_to_final_file)
+
+                # Send data to index. We strip off the root location so that all indexed paths are relative to the
+                # haystack root. This allows us to start the static file server in haystack root, rather than at the
+                # root of the file system.
+                haystack_root = self.config.haystack_root()
+                if not haystack_root.endswith(SLASH):
+                    haystack_root += SLASH
+
+                # Thumbnails aren't being generated yet, so there is no thumbnail path to strip.
+                path_to_media = path_to_final_file.replace(haystack_root, EMPTY, 1)
+                self.index.index_media(path_to_media,
+                                       path_to_thumbnail,
+                                       date_taken, device, file_hash, f.media_type())
+            except Exception:
+                # Undo the placement, so the file is only in staging, ready to be retried.
+                if not self.__discard_placement(placement, path_to_file):
+                    logging.exception('Encountered error while trying to index file, and unable to move it back to ' +
+                                      'staging. It is placed, but not indexed. path_to_file=%s', path_to_file)
+                    return False
+                raise
 
             # Remove file after successful indexing.
-            logging.info('Removing file=%s', path_to_file)
-            os.remove(path_to_file)
+            if placement.moved_staged_file:
+                self.hash_cache.forget(path_to_final_file)
+            else:
+                logging.info('Removing file=%s', path_to_file)
+                self.hash_cache.forget(path_to_file)
+                os.remove(path_to_file)
+
+            return True
         except Exception as e:
             logging.exception('Encountered error while trying to index file, leaving file in staging area. ' +
                               'path_to_file=%s', path_to_file)
-
-    def __get_media_hash(self, path_to_file):
-        md5 = hashlib.md5()
-        with open(path_to_file, READ_ONLY_RAW) as f:
-            for chunk in iter(lambda: f.read(BLOCK_SIZE_1M), b''):
-                md5.update(chunk)
-
-        return md5.hexdigest()
+            self.__record_failure(device, path_to_file, e)
+            return False
+
+    def __record_failure(self, device, path_to_file, error):
+        if isinstance(error, FILE_SPECIFIC_ERRORS):
+            self.failure_tracker.record_failure(device, path_to_file, error)
+        else:
+            logging.info('Not counting the failure against the file, since it is not specific to the file. ' +
+                         'path_to_file=%s', path_to_file)
+
+    # Returns False if the placement couldn't be undone.
+    def __discard_placement(self, placement, path_to_file):
+        try:
+            placement.discard()
+            return True
+        except OSError:
+            logging.exception('Unable to discard placement. path_to_file=%s', path_to_file)
+            return False
+
+    def __remove_if_duplicate(self, path_to_file, file_hash):
+        if not self.index.is_duplicate(file_hash) and \
+                not self.duplicate_detector.matches_other_hash_algorithms(path_to_file, file_hash):
+            return False
+
+        logging.info('File hash already appears in index, file appears to be a duplicate, and will be deleted. ' +
+                     'path_to_file=%s file_hash=%s', path_to_file, file_hash)
+        self.hash_cache.forget(path_to_file)
+        os.remove(path_to_file)
+        return True
 
     def __generate_path_to_thumbnail(self, f, date_taken, hash):
         path_to_thumbnail_pattern = self.config.thumbnail_path_pattern()
@@ -0,0 +1,88 @@
+import collections
+import logging
+import Queue
+import threading
+
+from indexer import DATE_PREFETCH_CHUNK_SIZE
+from indexer import RunSummary
+
+QUEUE_SIZE = 64
+WAIT_INTERVAL_IN_SECONDS = 1
+FINISHED = None
+
+
+# Indexes staged files on a background thread as soon as their transfer has been verified, so that copying from a
+# device and indexing overlap. The queue is bounded, so transfers slow down to match the indexer instead of piling up.
+# Files that fail to index stay in staging, and the next indexer run picks them up.
+class IndexingPipeline:
+    def __init__(self, indexer, queue_size=QUEUE_SIZE):
+        self.indexer = indexer
+        self.queue = Queue.Queue(queue_size)
+        self.thread = None
+        self.attempted = 0
+        self.indexed = 0
+
+    def start(self):
+        if self.thread is not None:
+            return
+
+        self.attempted = 0
+        self.indexed = 0
+        self.thread = threading.Thread(target=self.__run, name='indexing-pipeline')
+        self.thread.daemon = True
+        self.thread.start()
+
+    # Hands a staged file to the indexer. Blocks while the queue is full.
+    def submit(self, device_dir, path_to_file):
+        self.queue.put((device_dir, path_to_file))
+
+    # Waits for everything that was submitted to be indexed, and returns a summary.
+    def finish(self):
+        if self.thread is None:
+            return RunSummary(0, 0, False)
+
+        # On Python 2, waiting without a timeout holds off signal handlers until the wait is over, so wait in short
+        # steps to let SIGTERM stop a run while a large backlog is indexed.
+        while self.thread.is_alive():
+            try:
+                self.queue.put(FINISHED, True, WAIT_INTERVAL_IN_SECONDS)
+                break
+            except Queue.Full:
+                pass
+
+        while self.thread.is_alive():
+            self.thread.join(WAIT_INTERVAL_IN_SECONDS)
+        self.thread = None
+
+        logging.info('Indexing pipeline finished. attempted=%d indexed=%d', self.attempted, self.indexed)
+        return RunSummary(self.attempted, self.indexed, False)
+
+    def __run(self):
+        finished = False
+        while not finished:
+            # Take whatever else is already waiting along with the next file, so the indexer can batch its lookups.
+            batch = [self.queue.get()]
+            while batch[-1] is not FINISHED and len(batch) < DATE_PREFETCH_CHUNK_SIZE:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except Queue.Empty:
+                    break
+
+            if batch[-1] is FINISHED:
+                finished = True
+                batch.pop()
+
+            self.__index_batch(batch)
+
+    def __index_batch(self, batch):
+        paths_by_device = collections.OrderedDict()
+        for device_dir, path_to_file in batch:
+            paths_by_device.setdefault(device_dir, []).append(path_to_file)
+
+        for device_dir, paths_to_files in paths_by_device.items():
+            self.attempted += len(paths_to_files)
+            try:
+                self.indexed += self.indexer.index_files(device_dir, paths_to_files)
+            except Exception:
+                logging.exception('Unable to index transferred files, leaving them for the next run. ' +
+                                  'device_dir=%s paths_to_files=%s', device_dir, paths_to_files)
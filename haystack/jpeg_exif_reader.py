@@ -0,0 +1,158 @@
+import logging
+import struct
+
+READ_ONLY_RAW = 'rb'
+
+# JPEG markers
+MARKER_PREFIX = 0xFF
+SOI = 0xD8
+SOS = 0xDA
+EOI = 0xD9
+APP1 = 0xE1
+STANDALONE_MARKERS = range(0xD0, 0xD8) + [0x01]
+MAX_SEGMENTS = 32
+
+EXIF_HEADER = 'Exif\x00\x00'
+LITTLE_ENDIAN = 'II'
+BIG_ENDIAN = 'MM'
+TIFF_MAGIC = 42
+
+# TIFF tags and types
+ORIENTATION = 0x0112
+EXIF_IFD_POINTER = 0x8769
+DATE_TIME_ORIGINAL = 0x9003
+TYPE_ASCII = 2
+TYPE_SHORT = 3
+TYPE_LONG = 4
+IFD_ENTRY_SIZE = 12
+
+# Tag names, as reported by `exiftool -G -n`
+DATE_TIME_ORIGINAL_TAG = 'EXIF:DateTimeOriginal'
+ORIENTATION_TAG = 'EXIF:Orientation'
+
+
+# Reads the date taken and orientation directly out of a JPEG's EXIF (APP1) segment, without starting exiftool. Only the
+# segment headers in front of the APP1 segment and the APP1 segment itself are read from disk. If the file can't be
+# parsed, or the tags aren't there, an empty (or partial) dict is returned and the caller should fall back to exiftool.
+class JpegExifReader:
+    def read_metadata(self, path_to_file):
+        try:
+            with open(path_to_file, READ_ONLY_RAW) as f:
+                app1 = self.__find_exif_segment(f)
+        except IOError:
+            logging.warn('Unable to read file for EXIF metadata. path_to_file=%s', path_to_file)
+            return {}
+
+        if app1 is None:
+            return {}
+
+        try:
+            return self.__parse_tiff(app1[len(EXIF_HEADER):])
+        except (struct.error, ValueError, IndexError):
+            logging.warn('Unable to parse EXIF metadata. path_to_file=%s', path_to_file)
+            return {}
+
+    def __find_exif_segment(self, f):
+        if f.read(2) != chr(MARKER_PREFIX) + chr(SOI):
+            return None
+
+        for _ in range(MAX_SEGMENTS):
+            marker = self.__read_marker(f)
+            if marker is None or marker in (SOS, EOI):
+                return None
+
+            if marker in STANDALONE_MARKERS:
+                continue
+
+            length_bytes = f.read(2)
+            if len(length_bytes) != 2:
+                return None
+
+            length = struct.unpack('>H', length_bytes)[0] - 2
+            if length < 0:
+                return None
+
+            if marker == APP1:
+                segment = f.read(length)
+                if segment.startswith(EXIF_HEADER):
+                    return segment
+            else:
+                f.seek(length, 1)
+
+        return None
+
+    def __read_marker(self, f):
+        byte = f.read(1)
+        if not byte or ord(byte) != MARKER_PREFIX:
+            return None
+
+        # Markers may be padded with any number of 0xFF bytes.
+        while byte and ord(byte) == MARKER_PREFIX:
+            byte = f.read(1)
+
+        if not byte:
+            return None
+
+        return ord(byte)
+
+    def __parse_tiff(self, tiff):
+        byte_order = tiff[0:2]
+        if byte_order == LITTLE_ENDIAN:
+            endian = '<'
+        elif byte_order == BIG_ENDIAN:
+            endian = '>'
+        else:
+            return {}
+
+        magic, ifd0_offset = struct.unpack(endian + 'HI', tiff[2:8])
+        if magic != TIFF_MAGIC:
+            return {}
+
+        metadata = {}
+        ifd0 = self.__read_ifd(tiff, endian, ifd0_offset)
+
+        if ORIENTATION in ifd0:
+            metadata[ORIENTATION_TAG] = self.__read_integer(tiff, endian, ifd0[ORIENTATION])
+
+        if EXIF_IFD_POINTER in ifd0:
+            exif_ifd_offset = self.__read_integer(tiff, endian, ifd0[EXIF_IFD_POINTER])
+            exif_ifd = self.__read_ifd(tiff, endian, exif_ifd_offset)
+            if DATE_TIME_ORIGINAL in exif_ifd:
+                date_time_original = self.__read_ascii(tiff, endian, exif_ifd[DATE_TIME_ORIGINAL])
+                if date_time_original:
+                    metadata[DATE_TIME_ORIGINAL_TAG] = date_time_original
+
+        return metadata
+
+    # Returns a dict of tag -> (type, count, raw value/offset bytes) for every entry in the IFD at the given offset.
+    def __read_ifd(self, tiff, endian, offset):
+        entry_count = struct.unpack(endian + 'H', tiff[offset:offset + 2])[0]
+        entries = {}
+        for i in range(entry_count):
+            start = offset + 2 + i * IFD_ENTRY_SIZE
+            tag, tag_type, count = struct.unpack(endian + 'HHI', tiff[start:start + 8])
+            entries[tag] = (tag_type, count, tiff[start + 8:start + IFD_ENTRY_SIZE])
+
+        return entries
+
+    def __read_integer(self, tiff, endian, entry):
+        tag_type, count, value = entry
+        if tag_type == TYPE_SHORT:
+            return struct.unpack(endian + 'H', value[0:2])[0]
+        elif tag_type == TYPE_LONG:
+            return struct.unpack(endian + 'I', value)[0]
+
+        raise ValueError('Unexpected TIFF type for an integer tag!')
+
+    def __read_ascii(self, tiff, endian, entry):
+        tag_type, count, value = entry
+        if tag_type != TYPE_ASCII:
+            raise ValueError('Unexpected TIFF type for an ASCII tag!')
+
+        if count > 4:
+            offset = struct.unpack(endian + 'I', value)[0]
+            value = tiff[offset:offset + count]
+            if len(value) != count:
+                raise ValueError('EXIF ASCII value runs past the end of the segment!')
+
+        return value[:count].split('\x00')[0].strip()
@@ -0,0 +1,262 @@
+import ctypes
+import ctypes.util
+import logging
+
+from mtp_driver import MTPDriver
+from mtp_object import MTPObject
+
+LIBMTP_ERROR_NONE = 0
+LIBMTP_ERROR_NO_DEVICE_ATTACHED = 5
+LIBMTP_FILETYPE_FOLDER = 0
+LIBMTP_FILES_AND_FOLDERS_ROOT = 0xFFFFFFFF
+
+# Storage 0 asks libmtp for objects on every storage (internal memory and SD card).
+ALL_STORAGE = 0
+
+
+class LibMTPDeviceEntry(ctypes.Structure):
+    _fields_ = [('vendor', ctypes.c_char_p),
+                ('vendor_id', ctypes.c_uint16),
+                ('product', ctypes.c_char_p),
+                ('product_id', ctypes.c_uint16),
+                ('device_flags', ctypes.c_uint32)]
+
+
+class LibMTPRawDevice(ctypes.Structure):
+    _fields_ = [('device_entry', LibMTPDeviceEntry),
+                ('bus_location', ctypes.c_uint32),
+                ('devnum', ctypes.c_uint8)]
+
+
+# Folders and files are linked lists, so their fields refer to their own types and have to be set after the class.
+class LibMTPFolder(ctypes.Structure):
+    pass
+
+
+LibMTPFolder._fields_ = [('folder_id', ctypes.c_uint32),
+                         ('parent_id', ctypes.c_uint32),
+                         ('storage_id', ctypes.c_uint32),
+                         ('name', ctypes.c_char_p),
+                         ('sibling', ctypes.POINTER(LibMTPFolder)),
+                         ('child', ctypes.POINTER(LibMTPFolder))]
+
+
+class LibMTPFile(ctypes.Structure):
+    pass
+
+
+LibMTPFile._fields_ = [('item_id', ctypes.c_uint32),
+                       ('parent_id', ctypes.c_uint32),
+                       ('storage_id', ctypes.c_uint32),
+                       ('filename', ctypes.c_char_p),
+                       ('filesize', ctypes.c_uint64),
+                       ('modificationdate', ctypes.c_long),
+                       ('filetype', ctypes.c_int),
+                       ('next', ctypes.POINTER(LibMTPFile))]
+
+FUNCTIONS = {
+    'LIBMTP_Init': (None, []),
+    'LIBMTP_Detect_Raw_Devices': (ctypes.c_int, [ctypes.POINTER(ctypes.POINTER(LibMTPRawDevice)),
+                                                 ctypes.POINTER(ctypes.c_int)]),
+    'LIBMTP_Open_Raw_Device_Uncached': (ctypes.c_void_p, [ctypes.POINTER(LibMTPRawDevice)]),
+    'LIBMTP_Release_Device': (None, [ctypes.c_void_p]),
+    'LIBMTP_Get_Manufacturername': (ctypes.c_void_p, [ctypes.c_void_p]),
+    'LIBMTP_Get_Modelname': (ctypes.c_void_p, [ctypes.c_void_p]),
+    'LIBMTP_Get_Serialnumber': (ctypes.c_void_p, [ctypes.c_void_p]),
+    'LIBMTP_Get_Folder_List': (ctypes.POINTER(LibMTPFolder), [ctypes.c_void_p]),
+    'LIBMTP_destroy_folder_t': (None, [ctypes.POINTER(LibMTPFolder)]),
+    'LIBMTP_Get_Filelisting_With_Callback': (ctypes.POINTER(LibMTPFile), [ctypes.c_void_p, ctypes.c_void_p,
+                                                                          ctypes.c_void_p]),
+    'LIBMTP_Get_Files_And_Folders': (ctypes.POINTER(LibMTPFile), [ctypes.c_void_p, ctypes.c_uint32,
+                                                                  ctypes.c_uint32]),
+    'LIBMTP_destroy_file_t': (None, [ctypes.POINTER(LibMTPFile)]),
+    'LIBMTP_Get_File_To_File': (ctypes.c_int, [ctypes.c_void_p, ctypes.c_uint32, ctypes.c_char_p, ctypes.c_void_p,
+                                               ctypes.c_void_p]),
+    'LIBMTP_Delete_Object': (ctypes.c_int, [ctypes.c_void_p, ctypes.c_uint32]),
+    'LIBMTP_Clear_Errorstack': (None, [ctypes.c_void_p])
+}
+
+
+# Loads libmtp and declares the functions the driver uses. Raises an OSError if libmtp isn't installed.
+def load_libmtp():
+    library = ctypes.util.find_library('mtp')
+    if library is None:
+        raise OSError('libmtp is not installed!')
+
+    libmtp = ctypes.CDLL(library)
+    for name, (restype, argtypes) in FUNCTIONS.items():
+        function = getattr(libmtp, name)
+        function.restype = restype
+        function.argtypes = argtypes
+
+    libmtp.LIBMTP_Init()
+    return libmtp
+
+
+def load_libc():
+    libc = ctypes.CDLL(ctypes.util.find_library('c'))
+    libc.free.argtypes = [ctypes.c_void_p]
+    libc.free.restype = None
+    return libc
+
+
+# Picks the MTP driver to use. The libmtp driver is used when it's enabled and libmtp can be loaded, otherwise the
+# mtp-tools commands are used.
+def create_mtp_driver(config):
+    if config.mtp_use_libmtp():
+        try:
+            return LibMTPDriver()
+        except OSError as e:
+            logging.warn('Unable to load libmtp, falling back to mtp-tools. error=%s', e)
+
+    return MTPDriver()
+
+
+# An MTPDriver that talks to libmtp directly through ctypes. The device is opened once by detect_device and used for
+# every listing, download and delete after that, until close is called, rather than being opened again by a new
+# mtp-tools process for every command.
+class LibMTPDriver:
+    def __init__(self, libmtp=None, libc=None):
+        if libmtp is None:
+            libmtp = load_libmtp()
+
+        if libc is None:
+            libc = load_libc()
+
+        self.libmtp = libmtp
+        self.libc = libc
+        self.device = None
+
+    def detect_device(self):
+        self.close()
+
+        raw_devices = ctypes.POINTER(LibMTPRawDevice)()
+        count = ctypes.c_int(0)
+        error = self.libmtp.LIBMTP_Detect_Raw_Devices(ctypes.byref(raw_devices), ctypes.byref(count))
+        if error == LIBMTP_ERROR_NO_DEVICE_ATTACHED or (error == LIBMTP_ERROR_NONE and count.value == 0):
+            return False
+        elif error != LIBMTP_ERROR_NONE:
+            raise RuntimeError('Unable to detect MTP devices! error={0}'.format(error))
+
+        # Only one device is transferred from at a time, like with mtp-tools.
+        try:
+            for i in range(1, count.value):
+                logging.warn('Found more than one MTP device, skipping all but the first. bus_location=%d devnum=%d',
+                             raw_devices[i].bus_location, raw_devices[i].devnum)
+            device = self.libmtp.LIBMTP_Open_Raw_Device_Uncached(ctypes.byref(raw_devices[0]))
+        finally:
+            self.libc.free(raw_devices)
+
+        if not device:
+            raise RuntimeError('Unable to open MTP device!')
+
+        self.device = device
+        return {
+            'manufacturer': self.__get_string(self.libmtp.LIBMTP_Get_Manufacturername(device)),
+            'model': self.__get_string(self.libmtp.LIBMTP_Get_Modelname(device)),
+            'serial': self.__get_string(self.libmtp.LIBMTP_Get_Serialnumber(device))
+        }
+
+    # Returns the folders in the same order as mtp-folders lists them: each folder is followed by its children.
+    def get_folder_list(self):
+        root = self.libmtp.LIBMTP_Get_Folder_List(self.__get_device())
+        if not root:
+            # libmtp returns NULL both for errors and for devices without folders.
+            self.__clear_errors()
+            return []
+
+        folder_list = []
+        try:
+            stack = [root]
+            while stack:
+                folder = stack.pop()
+                if not folder:
+                    continue
+
+                parent_id = folder.contents.parent_id or None
+                folder_list.append(MTPObject(folder.contents.folder_id, folder.contents.name, parent_id))
+                stack.append(folder.contents.sibling)
+                stack.append(folder.contents.child)
+        finally:
+            self.libmtp.LIBMTP_destroy_folder_t(root)
+
+        return folder_list
+
+    def get_filelisting(self):
+        file_list = []
+        files = self.libmtp.LIBMTP_Get_Filelisting_With_Callback(self.__get_device(), None, None)
+        for f in self.__read_file_list(files):
+            file_list.append(MTPObject(f.item_id, f.filename, f.parent_id, f.filesize))
+
+        return file_list
+
+    def can_list_folders(self):
+        return True
+
+    # Lists just the direct children of a folder (or of the root, if folder_id is None), returned as a list of folders
+    # and a list of files.
+    def list_folder(self, folder_id=None):
+        parent_id = LIBMTP_FILES_AND_FOLDERS_ROOT if folder_id is None else folder_id
+        children = self.libmtp.LIBMTP_Get_Files_And_Folders(self.__get_device(), ALL_STORAGE, parent_id)
+
+        folders = []
+        files = []
+        for f in self.__read_file_list(children):
+            if f.filetype == LIBMTP_FILETYPE_FOLDER:
+                folders.append(MTPObject(f.item_id, f.filename, folder_id))
+            else:
+                files.append(MTPObject(f.item_id, f.filename, folder_id, f.filesize))
+
+        return folders, files
+
+    def get_file_to_file(self, id, dest_file):
+        if self.libmtp.LIBMTP_Get_File_To_File(self.__get_device(), id, dest_file, None, None) != 0:
+            self.__clear_errors()
+            raise RuntimeError('Unable to download file from MTP device! id={0} dest_file={1}'.format(id, dest_file))
+
+    def delete_object(self, id):
+        if self.libmtp.LIBMTP_Delete_Object(self.__get_device(), id) != 0:
+            self.__clear_errors()
+            raise RuntimeError('Unable to delete object from MTP device! id={0}'.format(id))
+
+    # Releases the device, if one is open.
+    def close(self):
+        if self.device is not None:
+            self.libmtp.LIBMTP_Release_Device(self.device)
+            self.device = None
+
+    # Copies each file in a list returned by libmtp, and frees the list.
+    def __read_file_list(self, current):
+        if not current:
+            # libmtp returns NULL both for errors and for empty listings.
+            self.__clear_errors()
+
+        file_list = []
+        while current:
+            f = current.contents
+            file_list.append(LibMTPFile(f.item_id, f.parent_id, f.storage_id, f.filename, f.filesize,
+                                        f.modificationdate, f.filetype))
+            next_file = f.next
+            self.libmtp.LIBMTP_destroy_file_t(current)
+            current = next_file
+
+        return file_list
+
+    def __get_device(self):
+        if self.device is None:
+            raise RuntimeError('No MTP device is open! Call detect_device first.')
+
+        return self.device
+
+    def __clear_errors(self):
+        self.libmtp.LIBMTP_Clear_Errorstack(self.device)
+
+    # Strings returned by libmtp are owned by the caller.
+    def __get_string(self, pointer):
+        if not pointer:
+            return None
+
+        try:
+            return ctypes.string_at(pointer)
+        finally:
+            self.libc.free(pointer)
@@ -0,0 +1,243 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from config import Config
+from content_hash import get_hash_label
+from index import DATE_INDEXED
+from index import DATE_TAKEN
+from index import HASH
+from index import Index
+from index import PATH_TO_MEDIA
+from index import PATH_TO_THUMBNAIL
+from index import SOURCE_DEVICE_ID
+from index import TYPE
+from index_flusher import IndexFlusher
+from state_database import open_state_database
+from util import Util
+
+# Columns, in the same order as the Firebase media fields.
+COLUMNS = [
+    (PATH_TO_MEDIA, 'path_to_media'),
+    (PATH_TO_THUMBNAIL, 'path_to_thumbnail'),
+    (DATE_TAKEN, 'date_taken'),
+    (DATE_INDEXED, 'date_indexed'),
+    (SOURCE_DEVICE_ID, 'source_device_id'),
+    (HASH, 'hash'),
+    (TYPE, 'type')
+]
+
+SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS media (
+           id INTEGER PRIMARY KEY,
+           path_to_media TEXT NOT NULL,
+           path_to_thumbnail TEXT,
+           date_taken INTEGER NOT NULL,
+           date_indexed INTEGER NOT NULL,
+           source_device_id TEXT NOT NULL,
+           hash TEXT NOT NULL,
+           type TEXT NOT NULL,
+           synced INTEGER NOT NULL DEFAULT 0,
+           size INTEGER,
+           sample_hash TEXT,
+           hash_label TEXT)''',
+    'CREATE INDEX IF NOT EXISTS media_hash ON media (hash)',
+    'CREATE INDEX IF NOT EXISTS media_date_taken ON media (date_taken)',
+    'CREATE INDEX IF NOT EXISTS media_source_device_id ON media (source_device_id)',
+    'CREATE INDEX IF NOT EXISTS media_type ON media (type)',
+    'CREATE INDEX IF NOT EXISTS media_synced ON media (synced)'
+]
+
+# Columns added since the media table was first created, which are added to older databases when they're opened.
+ADDED_COLUMNS = [
+    ('size', 'INTEGER'),
+    ('sample_hash', 'TEXT'),
+    ('hash_label', 'TEXT')
+]
+
+ADDED_SCHEMA = [
+    'CREATE INDEX IF NOT EXISTS media_size ON media (size)'
+]
+
+SELECT_TABLE_COLUMNS = 'PRAGMA table_info(media)'
+ADD_COLUMN = 'ALTER TABLE media ADD COLUMN {0} {1}'
+
+SELECT_COLUMNS = ', '.join(column for _, column in COLUMNS)
+INSERT_MEDIA = 'INSERT INTO media ({0}, size, hash_label) VALUES ({1}, ?, ?)'.format(
+    SELECT_COLUMNS, ', '.join('?' for _ in COLUMNS))
+SELECT_MEDIA = 'SELECT id, {0} FROM media'.format(SELECT_COLUMNS)
+SELECT_DUPLICATE = 'SELECT 1 FROM media WHERE hash = ? LIMIT 1'
+SELECT_UNSYNCED = SELECT_MEDIA + ' WHERE synced = 0 ORDER BY id LIMIT ?'
+MARK_SYNCED = 'UPDATE media SET synced = 1 WHERE id = ?'
+SELECT_SAME_SIZE = 'SELECT id, path_to_media, sample_hash FROM media WHERE size = ?'
+SELECT_WITHOUT_SIZE = 'SELECT id, path_to_media FROM media WHERE size IS NULL'
+UPDATE_SIZE = 'UPDATE media SET size = ? WHERE id = ?'
+UPDATE_SAMPLE_HASH = 'UPDATE media SET sample_hash = ? WHERE id = ?'
+SELECT_HASH_LABELS_WITH_SIZE = 'SELECT DISTINCT hash_label FROM media WHERE size = ?'
+SELECT_WITHOUT_HASH_LABEL = 'SELECT id, hash FROM media WHERE hash_label IS NULL'
+UPDATE_HASH_LABEL = 'UPDATE media SET hash_label = ? WHERE id = ?'
+
+SYNC_BATCH_SIZE = 200
+
+
+# An index of all media kept in a SQLite database on local disk. It has the same interface as the Firebase Index, so
+# lookups, like duplicate checks, don't need the network. If a downstream index is given, media is also copied there in
+# batches by a background IndexFlusher. Rows stay marked as unsynced until the downstream index accepts them, so the
+# database doubles as a durable journal of pending writes. The size of each media file, and the label of the algorithm
+# its hash was computed with, are recorded too, for the DuplicateDetector. Media indexed before these were recorded has
+# them filled in when the index is opened.
+class LocalIndex:
+    def __init__(self, config=None, downstream_index=None, util=None, path_to_database=None, flusher=None):
+        if config is None:
+            config = Config()
+
+        if util is None:
+            util = Util()
+
+        if downstream_index is None and config.firebase_sync_enabled():
+            downstream_index = Index(config)
+
+        self.config = config
+        self.downstream_index = downstream_index
+        self.lock = threading.Lock()
+        self.connection = open_state_database(config, util, SCHEMA, path_to_database)
+        self.connection.row_factory = sqlite3.Row
+
+        with self.lock, self.connection:
+            existing_columns = set(row['name'] for row in self.connection.execute(SELECT_TABLE_COLUMNS))
+            for column, column_type in ADDED_COLUMNS:
+                if column not in existing_columns:
+                    self.connection.execute(ADD_COLUMN.format(column, column_type))
+
+            for statement in ADDED_SCHEMA:
+                self.connection.execute(statement)
+
+        self.__record_missing_sizes()
+        self.__record_missing_hash_labels()
+
+        if flusher is None and downstream_index is not None:
+            flusher = IndexFlusher(self)
+
+        self.flusher = flusher
+        if self.flusher is not None:
+            self.flusher.start()
+
+    def index_media(self, path_to_media, path_to_thumbnail, taken, device_id, hash, type):
+        logging.info('Adding media to local index. path_to_media=%s path_to_thumbnail=%s taken=%d device_id=%s ' +
+                     'hash=%s type=%s', path_to_media, path_to_thumbnail, taken, device_id, hash, type)
+
+        size = self.__get_size(path_to_media)
+        with self.lock, self.connection:
+            self.connection.execute(INSERT_MEDIA, (path_to_media, path_to_thumbnail, taken, int(time.time()),
+                                                   device_id, hash, type, size, get_hash_label(hash)))
+
+        if self.flusher is not None:
+            self.flusher.notify()
+
+    def is_duplicate(self, hash_to_check):
+        with self.lock:
+            return self.connection.execute(SELECT_DUPLICATE, (hash_to_check,)).fetchone() is not None
+
+    # Returns the media matching every given criteria, as dicts with the same keys used in Firebase.
+    def find_media(self, hash=None, taken_after=None, taken_before=None, device_id=None, type=None):
+        clauses = []
+        parameters = []
+        for clause, value in [('hash = ?', hash),
+                              ('date_taken >= ?', taken_after),
+                              ('date_taken < ?', taken_before),
+                              ('source_device_id = ?', device_id),
+                              ('type = ?', type)]:
+            if value is not None:
+                clauses.append(clause)
+                parameters.append(value)
+
+        query = SELECT_MEDIA
+        if clauses:
+            query += ' WHERE ' + ' AND '.join(clauses)
+
+        with self.lock:
+            rows = self.connection.execute(query + ' ORDER BY date_taken', parameters).fetchall()
+
+        return [self.__to_media_data(row) for row in rows]
+
+    # Returns (id, path_to_media, sample_hash) for all media of the given size. The sample hash is None until it's
+    # recorded.
+    def find_media_with_size(self, size):
+        with self.lock:
+            return [tuple(row) for row in self.connection.execute(SELECT_SAME_SIZE, (size,))]
+
+    # Returns the labels of the hash algorithms that media of the given size was indexed with.
+    def find_hash_labels_with_size(self, size):
+        with self.lock:
+            return [row['hash_label'] for row in self.connection.execute(SELECT_HASH_LABELS_WITH_SIZE, (size,))]
+
+    def record_sample_hash(self, media_id, sample_hash):
+        with self.lock, self.connection:
+            self.connection.execute(UPDATE_SAMPLE_HASH, (sample_hash, media_id))
+
+    # Sends any media that hasn't made it to the downstream index yet, in batches, in the order it was indexed. Errors
+    # from the downstream index are raised, and the media that wasn't sent will be sent by the next call.
+    def sync_downstream(self):
+        if self.downstream_index is None:
+            return
+
+        while True:
+            with self.lock:
+                rows = self.connection.execute(SELECT_UNSYNCED, (SYNC_BATCH_SIZE,)).fetchall()
+
+            if not rows:
+                return
+
+            self.downstream_index.index_media_batch([self.__to_media_data(row) for row in rows])
+
+            with self.lock, self.connection:
+                self.connection.executemany(MARK_SYNCED, [(row['id'],) for row in rows])
+
+            logging.info('Synced media to downstream index. count=%d', len(rows))
+
+    def close(self):
+        if self.flusher is not None:
+            self.flusher.stop()
+
+        with self.lock:
+            self.connection.close()
+
+    def __to_media_data(self, row):
+        return dict((key, row[column]) for key, column in COLUMNS)
+
+    # Returns None if the media can't be found. The path is relative to the haystack root.
+    def __get_size(self, path_to_media):
+        try:
+            return os.path.getsize(os.path.join(self.config.haystack_root(), path_to_media))
+        except OSError as e:
+            logging.warn('Unable to find size of media. path_to_media=%s error=%s', path_to_media, e)
+            return None
+
+    # Only media that's missing is checked again the next time the index is opened.
+    def __record_missing_sizes(self):
+        with self.lock:
+            rows = self.connection.execute(SELECT_WITHOUT_SIZE).fetchall()
+
+        sizes = []
+        for row in rows:
+            size = self.__get_size(row['path_to_media'])
+            if size is not None:
+                sizes.append((size, row['id']))
+
+        if not sizes:
+            return
+
+        with self.lock, self.connection:
+            self.connection.executemany(UPDATE_SIZE, sizes)
+
+        logging.info('Recorded sizes of media indexed before sizes were recorded. count=%d', len(sizes))
+
+    def __record_missing_hash_labels(self):
+        with self.lock, self.connection:
+            rows = self.connection.execute(SELECT_WITHOUT_HASH_LABEL).fetchall()
+            self.connection.executemany(UPDATE_HASH_LABEL, [(get_hash_label(row['hash']), row['id']) for row in rows])
+
+        if rows:
+            logging.info('Recorded hash labels of media indexed before hash labels were recorded. count=%d', len(rows))
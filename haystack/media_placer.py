@@ -0,0 +1,106 @@
+import logging
+import os
+
+from content_hash import ContentHasher
+from copy_engine import CopyEngine
+from copy_engine import remove_quietly
+from util import Util
+
+TEMP_FILE_TEMPLATE = '.{0}.part'
+
+
+# A staged file on its way to its final location. Once the file's hash is known (and it's been checked for duplicates)
+# it can be committed to its final path, or discarded. Discarding a committed placement undoes it, so that a file that
+# fails to be indexed is left in staging, and nowhere else.
+class Placement:
+    def __init__(self, path_to_staged_file, file_hash, path_to_temp_file=None):
+        self.path_to_staged_file = path_to_staged_file
+        self.file_hash = file_hash
+        self.path_to_temp_file = path_to_temp_file
+        self.path_to_placed_file = None
+        self.moved_staged_file = False
+
+    # Puts the file at its final path. The staged file is left in place when possible, so that it can be removed only
+    # after the file has been indexed. Check moved_staged_file to see whether that was possible.
+    def commit(self, path_to_final_file):
+        if os.path.exists(path_to_final_file):
+            logging.info('File already exists at final location. path_to_final_file=%s', path_to_final_file)
+            self.discard()
+            return
+
+        if self.path_to_temp_file is not None:
+            os.rename(self.path_to_temp_file, path_to_final_file)
+            self.path_to_temp_file = None
+            self.path_to_placed_file = path_to_final_file
+            return
+
+        try:
+            os.link(self.path_to_staged_file, path_to_final_file)
+        except OSError as e:
+            # Some filesystems, like FAT, don't support hard links.
+            logging.info('Unable to link staged file, moving it instead. path_to_staged_file=%s error=%s',
+                         self.path_to_staged_file, e)
+            os.rename(self.path_to_staged_file, path_to_final_file)
+            self.moved_staged_file = True
+
+        self.path_to_placed_file = path_to_final_file
+
+    # Removes the temp file, or whatever commit put at the final path. A staged file that was moved into place is moved
+    # back to staging.
+    def discard(self):
+        if self.path_to_temp_file is not None:
+            remove_quietly(self.path_to_temp_file)
+            self.path_to_temp_file = None
+
+        if self.path_to_placed_file is not None:
+            if self.moved_staged_file:
+                os.rename(self.path_to_placed_file, self.path_to_staged_file)
+                self.moved_staged_file = False
+            else:
+                remove_quietly(self.path_to_placed_file)
+            self.path_to_placed_file = None
+
+
+# Places staged media files into their final directories while reading each file as few times as possible. When the
+# final directory is on the same filesystem as the staging directory, the file is only read to hash it, and then linked
+# or renamed into place. Otherwise the file is copied to a temp file in the final directory and hashed by the copy
+# engine, and the temp file is renamed once the hash (and so the final filename) is known.
+class MediaPlacer:
+    def __init__(self, util=None, copy_engine=None, content_hasher=None):
+        if util is None:
+            util = Util()
+
+        if copy_engine is None:
+            copy_engine = CopyEngine()
+
+        if content_hasher is None:
+            content_hasher = ContentHasher()
+
+        self.util = util
+        self.copy_engine = copy_engine
+        self.content_hasher = content_hasher
+
+    def stage(self, path_to_staged_file, final_directory, file_hash=None):
+        if os.stat(path_to_staged_file).st_dev == os.stat(final_directory).st_dev:
+            if file_hash is None:
+                file_hash = self.content_hasher.hash_file(path_to_staged_file)
+            return Placement(path_to_staged_file, file_hash)
+
+        path_to_temp_file = os.path.join(final_directory, TEMP_FILE_TEMPLATE.format(self.util.get_uuid()))
+        logging.info('Copying staged media to final directory. path_to_staged_file=%s path_to_temp_file=%s',
+                     path_to_staged_file, path_to_temp_file)
+        # Cleaned up in a finally, rather than by catching exceptions, so that a copy stopped by SIGTERM is removed too.
+        copied = False
+        try:
+            copied_hash = self.__copy_and_hash(path_to_staged_file, path_to_temp_file)
+            copied = True
+        finally:
+            if not copied:
+                remove_quietly(path_to_temp_file)
+
+        return Placement(path_to_staged_file, copied_hash, path_to_temp_file)
+
+    def __copy_and_hash(self, src, dest):
+        content_hash = self.content_hasher.new()
+        self.copy_engine.copy(src, dest, content_hash)
+        return content_hash.hexdigest()
@@ -1,11 +1,15 @@
 import atexit
-import exiftool
 import logging
 import os
 
 from dateutil import parser
 from dateutil import tz
+from exiftool_session import ExifToolSession
 from file import File
+from file import JPEG_READER
+from file import MP4_READER
+from jpeg_exif_reader import JpegExifReader
+from mp4_box_reader import Mp4BoxReader
 from time import mktime
 
 COLON = ':'
@@ -13,36 +17,77 @@ DASH = '-'
 
 COLONS_IN_YMD = 2
 OVERWRITE_ORIGINAL = '-overwrite_original'
+SOURCE_FILE = 'SourceFile'
 
 
-class MetadataHelper:
+# Raised when a file's date taken is missing, or can't be parsed. Unlike errors from exiftool itself, this is a problem
+# with the file, and retrying won't help.
+class DateTakenError(RuntimeError):
+    pass
 
-    # Given a file, this function returns a UNIX timestamp (seconds)
-    # in UTC that describes when the picture/video was taken.
-    def get_date_taken(self, path_to_file):
-        metadata = {}
-        with exiftool.ExifTool() as et:
-            metadata = et.get_metadata(path_to_file)
 
-        f = File(path_to_file)
+class MetadataHelper:
+    def __init__(self, exiftool_session=None, jpeg_exif_reader=None, mp4_box_reader=None):
+        if exiftool_session is None:
+            exiftool_session = ExifToolSession()
+            atexit.register(exiftool_session.close)
 
-        tag = f.date_taken_tag()
-        self.__check_tag(tag, metadata, path_to_file)
+        if jpeg_exif_reader is None:
+            jpeg_exif_reader = JpegExifReader()
 
-        raw_date_taken_string = metadata[tag]
-        massaged_date_taken_string = raw_date_taken_string.replace(COLON, DASH, COLONS_IN_YMD)
+        if mp4_box_reader is None:
+            mp4_box_reader = Mp4BoxReader()
 
-        dt_object = parser.parse(massaged_date_taken_string)
-        timestamp = mktime(dt_object.timetuple())
+        self.exiftool_session = exiftool_session
+        self.native_readers = {
+            JPEG_READER: jpeg_exif_reader,
+            MP4_READER: mp4_box_reader
+        }
 
-        return int(timestamp)
+    # Given a file, this function returns a UNIX timestamp (seconds)
+    # in UTC that describes when the picture/video was taken.
+    def get_date_taken(self, path_to_file):
+        f = File(path_to_file)
+        metadata = self.__read_metadata(f, path_to_file, f.date_taken_tag())
+        return self.__parse_date_taken(f, metadata, path_to_file)
+
+    # Like get_date_taken, but for many files using a single exiftool request that only asks for the date taken tags.
+    # Returns a dict mapping each path to either its timestamp, or the error that get_date_taken would have raised for
+    # it.
+    def get_dates_taken(self, paths_to_files):
+        results = {}
+        files = {}
+        for path_to_file in paths_to_files:
+            try:
+                files[path_to_file] = File(path_to_file)
+            except RuntimeError as e:
+                results[path_to_file] = e
+
+        # Only files that can't be answered in-process need to go to exiftool.
+        metadata_by_path = {}
+        for path_to_file, f in files.items():
+            metadata = self.__read_native_metadata(f, path_to_file)
+            if f.date_taken_tag() in metadata:
+                metadata_by_path[path_to_file] = metadata
+
+        remaining = [path_to_file for path_to_file in files if path_to_file not in metadata_by_path]
+        if remaining:
+            tags = set(files[path_to_file].date_taken_tag() for path_to_file in remaining)
+            for metadata in self.exiftool_session.get_tags_batch(tags, remaining):
+                metadata_by_path[metadata.get(SOURCE_FILE)] = metadata
+
+        for path_to_file, f in files.items():
+            try:
+                metadata = metadata_by_path.get(path_to_file, {})
+                results[path_to_file] = self.__parse_date_taken(f, metadata, path_to_file)
+            except DateTakenError as e:
+                results[path_to_file] = e
+
+        return results
 
     def get_rotation(self, path_to_file):
-        metadata = {}
-        with exiftool.ExifTool() as et:
-            metadata = et.get_metadata(path_to_file)
-
         f = File(path_to_file)
+        metadata = self.__read_metadata(f, path_to_file, f.rotation_tag())
 
         tag = f.rotation_tag()
         if tag not in metadata:
@@ -52,12 +97,46 @@ class MetadataHelper:
 
     def set_rotation(self, path_to_file, new_rotation):
         f = File(path_to_file)
-        with exiftool.ExifTool() as et:
-            et.execute('-' + f.rotation_tag() + '=' + str(new_rotation), '-n',
-                       OVERWRITE_ORIGINAL, path_to_file)
+        self.exiftool_session.execute('-' + f.rotation_tag() + '=' + str(new_rotation), '-n',
+                                      OVERWRITE_ORIGINAL, path_to_file)
+
+    # Stops the exiftool process backing this helper, if one is running.
+    def close(self):
+        self.exiftool_session.close()
+
+    # Reads metadata in-process if possible, and only asks exiftool if that doesn't turn up the tag we're after.
+    def __read_metadata(self, f, path_to_file, tag):
+        metadata = self.__read_native_metadata(f, path_to_file)
+        if tag in metadata:
+            return metadata
+
+        return self.exiftool_session.get_metadata(path_to_file)
+
+    def __read_native_metadata(self, f, path_to_file):
+        reader = self.native_readers.get(f.native_metadata_reader())
+        if reader is None:
+            return {}
+
+        return reader.read_metadata(path_to_file)
+
+    def __parse_date_taken(self, f, metadata, path_to_file):
+        tag = f.date_taken_tag()
+        self.__check_tag(tag, metadata, path_to_file)
+
+        raw_date_taken_string = metadata[tag]
+        massaged_date_taken_string = raw_date_taken_string.replace(COLON, DASH, COLONS_IN_YMD)
+
+        try:
+            dt_object = parser.parse(massaged_date_taken_string)
+            timestamp = mktime(dt_object.timetuple())
+        except (ValueError, OverflowError) as e:
+            raise DateTakenError('Unable to parse the date taken! date_taken={0} error={1}'.format(
+                raw_date_taken_string, e))
+
+        return int(timestamp)
 
     def __check_tag(self, tag, metadata, path_to_file):
         if tag not in metadata:
             logging.error('This file\'s metadata doesn\'t contain the expected tag. path_to_file=%s tag=%s',
                           path_to_file, tag)
-            raise RuntimeError('This file does not have the expected metedata tag!')
+            raise DateTakenError('This file does not have the expected metedata tag!')
@@ -0,0 +1,93 @@
+import logging
+import struct
+
+from datetime import datetime
+from datetime import timedelta
+
+READ_ONLY_RAW = 'rb'
+
+BOX_HEADER_SIZE = 8
+LARGE_SIZE_FIELD_SIZE = 8
+EXTENDS_TO_EOF = 0
+USE_LARGE_SIZE = 1
+MAX_BOXES = 1024
+
+MOOV = 'moov'
+MVHD = 'mvhd'
+MVHD_VERSION_1 = 1
+
+# ISO-BMFF timestamps are seconds since midnight, Jan. 1, 1904 UTC.
+QUICKTIME_EPOCH = datetime(1904, 1, 1)
+QUICKTIME_DATE_FORMAT = '%Y:%m:%d %H:%M:%S'
+
+# Tag names, as reported by `exiftool -G -n`
+CREATE_DATE_TAG = 'QuickTime:CreateDate'
+
+
+# Reads the creation time out of an MP4's movie header (moov/mvhd) box, without starting exiftool. Only box headers are
+# read on the way to the moov box, so the cost is the same no matter how large the video is, even when moov comes after
+# the media data. If the file can't be parsed an empty dict is returned and the caller should fall back to exiftool.
+class Mp4BoxReader:
+    def read_metadata(self, path_to_file):
+        try:
+            with open(path_to_file, READ_ONLY_RAW) as f:
+                f.seek(0, 2)
+                file_size = f.tell()
+
+                moov = self.__find_box(f, MOOV, 0, file_size)
+                if moov is None:
+                    return {}
+
+                mvhd = self.__find_box(f, MVHD, moov[0], moov[1])
+                if mvhd is None:
+                    return {}
+
+                create_date = self.__read_creation_time(f, mvhd[0])
+        except (IOError, struct.error, OverflowError):
+            logging.warn('Unable to read MP4 metadata. path_to_file=%s', path_to_file)
+            return {}
+
+        if create_date is None:
+            return {}
+
+        return {CREATE_DATE_TAG: create_date}
+
+    # Finds the first box of the given type between start and end, returning the (start, end) offsets of its payload.
+    def __find_box(self, f, box_type, start, end):
+        offset = start
+        for _ in range(MAX_BOXES):
+            if offset + BOX_HEADER_SIZE > end:
+                return None
+
+            f.seek(offset)
+            size, current_type = struct.unpack('>I4s', f.read(BOX_HEADER_SIZE))
+            header_size = BOX_HEADER_SIZE
+            if size == USE_LARGE_SIZE:
+                size = struct.unpack('>Q', f.read(LARGE_SIZE_FIELD_SIZE))[0]
+                header_size += LARGE_SIZE_FIELD_SIZE
+            elif size == EXTENDS_TO_EOF:
+                size = end - offset
+
+            if size < header_size or offset + size > end:
+                return None
+
+            if current_type == box_type:
+                return (offset + header_size, offset + size)
+
+            offset += size
+
+        return None
+
+    def __read_creation_time(self, f, offset):
+        f.seek(offset)
+        version = struct.unpack('>B3x', f.read(4))[0]
+        if version == MVHD_VERSION_1:
+            creation_time = struct.unpack('>Q', f.read(8))[0]
+        else:
+            creation_time = struct.unpack('>I', f.read(4))[0]
+
+        # Cameras without a clock set leave this at zero.
+        if creation_time == 0:
+            return None
+
+        return (QUICKTIME_EPOCH + timedelta(seconds=creation_time)).strftime(QUICKTIME_DATE_FORMAT)
@@ -1,47 +1,86 @@
+import collections
 import logging
 import os
+import subprocess
 import sys
+import threading
 
 from config import Config
 from file import File
-from mtp_driver import MTPDriver
+from libmtp_driver import create_mtp_driver
 from mtp_object import MTPObject
+from mtp_presence import MTPPresence
+from transfer_ledger import TransferLedger
 from util import Util
 
 
 class MTPDevice:
-    def __init__(self, config=None, mtp=None, util=None):
+    # transfer_slots limits how many files are copied at once. Share it with the other devices being transferred from.
+    def __init__(self, config=None, mtp=None, util=None, ledger=None, presence=None, transfer_slots=None):
         if config is None:
             config = Config()
 
         if mtp is None:
-            mtp = MTPDriver()
+            mtp = create_mtp_driver(config)
 
         if util is None:
             util = Util()
 
+        if ledger is None:
+            ledger = TransferLedger(config, util)
+
+        if presence is None:
+            presence = MTPPresence()
+
+        if transfer_slots is None:
+            transfer_slots = threading.BoundedSemaphore(config.max_concurrent_transfers())
+
         self.config = config
         self.mtp = mtp
         self.util = util
+        self.ledger = ledger
+        self.presence = presence
+        self.transfer_slots = transfer_slots
+
+    # If given, on_transferred is called with the staging directory name and path of each file once its download has
+    # been verified.
+    def transfer_media(self, on_transferred=None):
+        if not self.presence.may_be_connected():
+            logging.info('No MTP devices connected, skipping MTP media transfer.')
+            return
 
-    def transfer_media(self):
         device_info = self.mtp.detect_device()
         if not device_info:
+            self.presence.mark_not_connected()
             logging.info('No MTP devices connected, skipping MTP media transfer.')
             return
 
+        try:
+            self.__transfer_media_from_device(device_info, on_transferred)
+        finally:
+            self.mtp.close()
+
+    def close(self):
+        self.ledger.close()
+
+    def __transfer_media_from_device(self, device_info, on_transferred):
         self.__log_connected_msg(device_info)
 
-        folders = self.mtp.get_folder_list()
+        if self.mtp.can_list_folders():
+            media_files = self.__find_files_in_media_directories()
+        else:
+            # The folder list is searched more than once, so keep it around.
+            folders = list(self.mtp.get_folder_list())
+
+            # Get the IDs for the parent folders to index.
+            parent_folder_ids = self.__find_parent_folder_ids(folders)
 
-        # Get the IDs for the parent folders to index.
-        parent_folder_ids = self.__find_parent_folder_ids(folders)
+            # Find all folder ids in the parent folders
+            folder_ids = self.__find_all_folder_ids(parent_folder_ids, folders)
 
-        # Find all folder ids in the parent folders
-        folder_ids = self.__find_all_folder_ids(parent_folder_ids, folders)
+            # Find all media files in these folders
+            media_files = self.__find_files_in_folders(folder_ids)
 
-        # Find all media files in these folders
-        media_files = self.__find_files_in_folders(folder_ids)
         if not media_files:
             logging.info('No files found to transfer.')
 
@@ -49,7 +88,9 @@ class MTPDevice:
         dest_dir = self.__get_staging_dir(device_info['serial'])
         self.util.mkdirp(dest_dir)
         for f in media_files:
-            self.__transfer_file(f, dest_dir)
+            self.__transfer_file(f, dest_dir, device_info['serial'], on_transferred)
+
+        self.ledger.forget_missing(device_info['serial'], media_files)
 
     def __log_connected_msg(self, info):
         msg_str = "Connected to device. serialnumber={} manufacturer={} modelname={}"
@@ -87,26 +128,64 @@ class MTPDevice:
         logging.info('Finding all files in folders: %s', folder_ids)
         files_in_folders = []
 
+        # Only the matching files are kept. The listing has to finish before transferring anything, since the listing
+        # command holds the device open until it's done.
         for f in self.mtp.get_filelisting():
             if f.parent_id in folder_ids:
                 files_in_folders.append(f)
 
         return files_in_folders
 
+    # Walks down from the root of the device to each of the media directories, and lists everything inside them, without
+    # listing anything else on the device. Media directories are paths from the root, like DCIM or Pictures/Screenshots.
+    def __find_files_in_media_directories(self):
+        media_directories = self.config.mtp_media_directories()
+        logging.info('Finding all files in media directories: %s', media_directories)
+
+        # Each folder to list, along with the remaining parts of the media directory paths that lead through it. An
+        # empty path means the folder is inside a media directory.
+        paths = [p.strip('/').split('/') for p in media_directories if p.strip('/')]
+        pending = collections.deque([(None, paths)])
+        files_in_folders = []
+        while pending:
+            folder_id, remaining_paths = pending.popleft()
+            in_media_directory = [] in remaining_paths
+            folders, files = self.mtp.list_folder(folder_id)
+            if in_media_directory:
+                files_in_folders.extend(files)
+
+            for folder in folders:
+                if in_media_directory:
+                    pending.append((folder.id, [[]]))
+                    continue
+
+                matching_paths = [path[1:] for path in remaining_paths if path[0] == folder.name]
+                if matching_paths:
+                    pending.append((folder.id, matching_paths))
+
+        return files_in_folders
+
     def __get_staging_dir(self, serial):
         return self.config.staging_directory(serial)
 
-    def __transfer_file(self, src_file, dest_dir):
+    def __transfer_file(self, src_file, dest_dir, device_dir, on_transferred):
         try:
             f = File(src_file.name)
         except RuntimeError:
             logging.warn('Found unrecognized file in folders to index, skipping. filename=%s', src_file.name)
             return
 
+        if self.ledger.has_transferred(device_dir, src_file):
+            logging.info('File was already transferred, retrying delete. file_id=%s filename=%s',
+                         src_file.id, src_file.name)
+            self.__delete_file(src_file, device_dir)
+            return
+
         dest_file = '{}/{}'.format(dest_dir, src_file.name)
         logging.info('Downloading file from device. file_id=%s filename=%s destination=%s',
                      src_file.id, src_file.name, dest_file)
-        self.mtp.get_file_to_file(src_file.id, dest_file)
+        with self.transfer_slots:
+            self.mtp.get_file_to_file(src_file.id, dest_file)
 
         # Make sure it's successful before deleting.
         if not os.path.isfile(dest_file):
@@ -118,4 +197,20 @@ class MTPDevice:
                          src_file.id, dest_file, os.path.getsize(dest_file), src_file.size)
         else:
             logging.info('Download succeeded, deleting file from dest_file=%s', dest_file)
+            self.ledger.record_transfer(device_dir, src_file)
+            self.__delete_file(src_file, device_dir)
+
+            if on_transferred is not None:
+                on_transferred(device_dir, dest_file)
+
+    # Deletes a transferred file from the device. If that fails, the file stays in the ledger, and only the delete is
+    # retried next time.
+    def __delete_file(self, src_file, serial):
+        try:
             self.mtp.delete_object(src_file.id)
+        except (RuntimeError, subprocess.CalledProcessError) as e:
+            logging.warn('Unable to delete transferred file from device, will retry. file_id=%s filename=%s error=%s',
+                         src_file.id, src_file.name, e)
+            return
+
+        self.ledger.forget_transfer(serial, src_file)
@@ -11,10 +11,6 @@ SERIAL_REGEX = re.compile('   Serial number: (.*)')
 FOLDER_LINE_REGEX = re.compile('^(\d+)\t(\s*)(.*)')
 SPACES_PER_LEVEL = 2
 
-ID_KEY = 'id'
-NAME_KEY = 'name'
-DEPTH_KEY = 'depth'
-
 FILE_ID_REGEX = re.compile('^File ID: (\d+)')
 FILE_NAME_REGEX = re.compile('^   Filename: (.*)')
 FILE_SIZE_REGEX = re.compile('^   File size (\d+) .* bytes')
@@ -41,63 +37,58 @@ class MTPDriver:
             'serial': SERIAL_REGEX.search(output).group(1)
         }
 
+    # Yields the folders as mtp-folders lists them, parsing each line as it's read. Lines that aren't folders (the
+    # frontmatter and endmatter) are skipped.
     def get_folder_list(self):
-        output = self.executor.execute_output('mtp-folders').split('\n')
-
-        # Get rid of the frontmatter
-        while not FOLDER_LINE_REGEX.match(output[0]):
-            del output[0]
-
-        # Get rid of the endmatter
-        while not FOLDER_LINE_REGEX.match(output[-1]):
-            del output[-1]
-
-        folder_list = []
         current_depth = 0
         parents_stack = [None]
         last_id = 0
-        for line in output:
-            line_data = self.__parse_folder_line(line)
-            folder_id = line_data[ID_KEY]
-            folder_name = line_data[NAME_KEY]
-            parent_id = None
-            depth = line_data[DEPTH_KEY]
+        for line in self.executor.execute_lines(['mtp-folders']):
+            match_data = FOLDER_LINE_REGEX.match(line)
+            if match_data is None:
+                continue
+
+            folder_id = int(match_data.group(1))
+            depth = int(len(match_data.group(2)) / SPACES_PER_LEVEL)
 
             if depth > current_depth:
                 parents_stack.append(last_id)
             elif depth < current_depth:
-                diff = current_depth - depth
-                parents_stack = parents_stack[:-diff]
+                del parents_stack[-(current_depth - depth):]
 
-            parent_id = parents_stack[-1]
             current_depth = depth
             last_id = folder_id
-            folder_list.append(MTPObject(folder_id, folder_name, parent_id))
-
-        return folder_list
+            yield MTPObject(folder_id, match_data.group(3), parents_stack[-1])
 
+    # Yields the files as mtp-files lists them. Each file's block starts with its ID and ends with its parent ID, so a
+    # file is complete once its parent ID has been read.
     def get_filelisting(self):
-        output = self.executor.execute_output('mtp-files').split('\n')
-
-        # Get rid of the frontmatter
-        while not FILE_ID_REGEX.match(output[0]):
-            del output[0]
-
-        file_list = []
-        current_file = MTPObject(None, None)
-        for line in output:
-            if FILE_ID_REGEX.match(line):
-                current_file.id = int(FILE_ID_REGEX.search(line).group(1))
-            elif FILE_NAME_REGEX.match(line):
-                current_file.name = FILE_NAME_REGEX.search(line).group(1)
-            elif FILE_SIZE_REGEX.match(line):
-                current_file.size = int(FILE_SIZE_REGEX.search(line).group(1))
-            elif PARENT_ID_REGEX.match(line):
-                current_file.parent_id = int(PARENT_ID_REGEX.search(line).group(1))
-                file_list.append(current_file)
-                current_file = MTPObject(None, None)
-
-        return file_list
+        current_file = None
+        for line in self.executor.execute_lines(['mtp-files']):
+            match_data = FILE_ID_REGEX.match(line)
+            if match_data is not None:
+                current_file = MTPObject(int(match_data.group(1)), None)
+                continue
+
+            # Anything before the first file is frontmatter.
+            if current_file is None:
+                continue
+
+            match_data = FILE_NAME_REGEX.match(line)
+            if match_data is not None:
+                current_file.name = match_data.group(1)
+                continue
+
+            match_data = FILE_SIZE_REGEX.match(line)
+            if match_data is not None:
+                current_file.size = int(match_data.group(1))
+                continue
+
+            match_data = PARENT_ID_REGEX.match(line)
+            if match_data is not None:
+                current_file.parent_id = int(match_data.group(1))
+                yield current_file
+                current_file = None
 
     def get_file_to_file(self, id, dest_file):
         self.executor.execute(['mtp-getfile', str(id), dest_file])
@@ -105,12 +96,10 @@ class MTPDriver:
     def delete_object(self, id):
         self.executor.execute(['mtp-delfile', '-n', str(id)])
 
-    def __parse_folder_line(self, line):
-        data = {}
-        match_data = FOLDER_LINE_REGEX.search(line)
-
-        data[ID_KEY] = int(match_data.group(1))
-        data[DEPTH_KEY] = int(len(match_data.group(2)) / SPACES_PER_LEVEL)
-        data[NAME_KEY] = match_data.group(3)
+    # mtp-tools can only list every file on the device at once.
+    def can_list_folders(self):
+        return False
 
-        return data
+    # Each command opens the device on its own, so there's nothing to release.
+    def close(self):
+        return
@@ -1,4 +1,7 @@
-class MTPObject:
+# Listings can hold tens of thousands of these, so they don't carry a __dict__.
+class MTPObject(object):
+    __slots__ = ('id', 'name', 'parent_id', 'size')
+
     def __init__(self, id, name, parent_id=None, size=None):
         self.id = id
         self.name = name
@@ -6,7 +9,7 @@ class MTPObject:
         self.size = size
 
     def __str__(self):
-        return str(self.__dict__)
+        return str(dict((slot, getattr(self, slot)) for slot in self.__slots__))
 
     def __eq__(self, other):
         try:
@@ -16,3 +19,9 @@ class MTPObject:
                    self.size == other.size
         except AttributeError:
             return False
+
+    def __ne__(self, other):
+        return not self == other
+
+    # Objects are filled in as a listing is parsed, so they can't be hashed.
+    __hash__ = None
@@ -0,0 +1,74 @@
+import logging
+import os
+
+SYSFS_USB_DEVICES = '/sys/bus/usb/devices'
+
+# Interfaces that may belong to an MTP device: the Still Image class (used by PTP and MTP), or any interface that names
+# itself MTP, like Android phones do with their vendor specific interface.
+STILL_IMAGE_CLASS = '06'
+MTP_INTERFACE_NAME = 'MTP'
+
+INTERFACE_SEPARATOR = ':'
+
+
+# Decides whether it's worth probing for MTP devices, by looking at the USB devices in sysfs, which only takes a few
+# reads. The interfaces are only examined when the USB topology changes. If probing finds no device, nothing is probed
+# again until the topology changes. Without sysfs (on OS X, for example), probing is always worth it.
+class MTPPresence:
+    def __init__(self, sysfs_root=SYSFS_USB_DEVICES):
+        self.sysfs_root = sysfs_root
+        self.topology = None
+        self.candidates = []
+        self.not_connected = False
+
+    def may_be_connected(self):
+        topology = self.__read_topology()
+        if topology is None:
+            return True
+
+        if topology != self.topology:
+            self.topology = topology
+            self.candidates = self.__find_candidates()
+            self.not_connected = False
+            logging.info('USB devices changed. mtp_candidates=%s', self.candidates)
+
+        return bool(self.candidates) and not self.not_connected
+
+    # Call this when probing didn't find a device, so that the same devices aren't probed again.
+    def mark_not_connected(self):
+        self.not_connected = True
+
+    # Each device, along with its device number, which changes whenever it's plugged in again. Returns None if sysfs
+    # isn't available.
+    def __read_topology(self):
+        try:
+            entries = os.listdir(self.sysfs_root)
+        except OSError:
+            return None
+
+        topology = []
+        for entry in sorted(entries):
+            if INTERFACE_SEPARATOR not in entry:
+                topology.append((entry, self.__read_attribute(entry, 'devnum')))
+
+        return tuple(topology)
+
+    def __find_candidates(self):
+        candidates = set()
+        for entry in os.listdir(self.sysfs_root):
+            if INTERFACE_SEPARATOR not in entry:
+                continue
+
+            interface_class = self.__read_attribute(entry, 'bInterfaceClass')
+            interface_name = self.__read_attribute(entry, 'interface')
+            if interface_class == STILL_IMAGE_CLASS or MTP_INTERFACE_NAME in (interface_name or ''):
+                candidates.add(entry.split(INTERFACE_SEPARATOR)[0])
+
+        return sorted(candidates)
+
+    def __read_attribute(self, entry, attribute):
+        try:
+            with open(os.path.join(self.sysfs_root, entry, attribute), 'r') as f:
+                return f.read().strip()
+        except IOError:
+            return None
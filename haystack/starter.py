@@ -1,13 +1,19 @@
 import logging
+import signal
 import sys
+import threading
 import time
-import sched
 
+from change_watcher import ChangeWatcher
 from config import Config
+from config import request_reload
+from device_workers import DeviceWorkers
 from mtp_device import MTPDevice
 from usb_device_manager import USBDeviceManager
 from usb_device import USBDevice
 from indexer import Indexer
+from indexer import RunSummary
+from indexing_pipeline import IndexingPipeline
 
 logging.basicConfig(filename='/var/log/haystack/app.log',
                     level=logging.INFO,
@@ -16,61 +22,169 @@ logging.basicConfig(filename='/var/log/haystack/app.log',
 
 
 class Starter:
-    def __init__(self, config=None, scheduler=None, mtp_device=None, usb_device_manager=None,
-                 usb_device=None, indexer=None):
+    def __init__(self, config=None, mtp_device=None, usb_device_manager=None, usb_device=None, indexer=None,
+                 watcher=None, pipeline=None, workers=None):
         if config is None:
             config = Config()
 
-        if scheduler is None:
-            scheduler = sched.scheduler(time.time, time.sleep)
+        # Made first, so that the indexer's worker pool starts before the devices open their connections and libmtp.
+        if indexer is None:
+            indexer = Indexer(config)
+
+        # Shared by every device, so that transfers running at the same time don't thrash the disk.
+        transfer_slots = threading.BoundedSemaphore(config.max_concurrent_transfers())
 
         if mtp_device is None:
-            mtp_device = MTPDevice()
+            mtp_device = MTPDevice(config, transfer_slots=transfer_slots)
 
         if usb_device_manager is None:
             usb_device_manager = USBDeviceManager()
 
         if usb_device is None:
-            usb_device = USBDevice()
+            usb_device = USBDevice(config, transfer_slots=transfer_slots)
 
-        if indexer is None:
-            indexer = Indexer()
+        if watcher is None:
+            watcher = ChangeWatcher(config)
+
+        if pipeline is None:
+            pipeline = IndexingPipeline(indexer)
+
+        if workers is None:
+            workers = DeviceWorkers()
 
         self.config = config
-        self.scheduler = scheduler
         self.mtp_device = mtp_device
         self.usb_device_manager = usb_device_manager
         self.usb_device = usb_device
         self.indexer = indexer
-
-    # Start function
+        self.watcher = watcher
+        self.pipeline = pipeline
+        self.workers = workers
+        self.running = False
+
+    # Runs until stopped. The next run starts right away if a run stopped because it reached its budget, or a device was
+    # mounted or unmounted during the run, and otherwise once something changes or the execution interval has passed.
+    # While runs keep finding nothing to index, the interval doubles, up to the configured maximum.
     def start(self):
         logging.info('Starting indexer.')
+        self.usb_device.remove_temp_files()
+        self.running = True
+        idle_delay = None
+        while self.running:
+            budget = self.config.indexer_run_budget()
+            started_at = time.time()
+            try:
+                summary = self.run_once(budget)
+            except Exception:
+                # Treat the run as if it found nothing, so that a device that keeps failing doesn't stop indexing.
+                logging.exception('An error occurred during a run.')
+                summary = RunSummary(0, 0, False)
+            duration = time.time() - started_at
+            devices_changed = self.watcher.devices_changed()
+
+            delay = self.config.indexer_delay()
+            if duration > delay:
+                logging.warn('Run overran its slot. duration=%.1f interval=%d', duration, delay)
+
+            if summary.budget_reached and summary.indexed > 0:
+                logging.info('Run reached its budget, starting the next run now. attempted=%d indexed=%d',
+                             summary.attempted, summary.indexed)
+                idle_delay = None
+                continue
+
+            if devices_changed:
+                logging.info('Devices changed during the run, starting the next run now.')
+                idle_delay = None
+                continue
+
+            if summary.attempted == 0:
+                if idle_delay is None:
+                    idle_delay = delay
+                else:
+                    idle_delay = min(idle_delay * 2, self.config.indexer_max_delay())
+                delay = idle_delay
+            else:
+                idle_delay = None
+
+            # Start the next run as soon as something changes, or after the delay at the latest.
+            logging.info('Waiting for changes before the next run. delay=%d', delay)
+            self.watcher.wait(delay)
+
+    # Transfers media from all devices, then indexes up to max_files staged files. When streaming transfers, each file
+    # is also handed to the indexing pipeline as soon as it's transferred, and the indexer run afterwards only picks up
+    # whatever is left in staging. Staged media is indexed even if a transfer fails, since one device that keeps failing
+    # shouldn't hold up media from the others.
+    def run_once(self, max_files=None):
+        # Changes from before the run are covered by it. Anything mounted from here on is caught by devices_changed()
+        # once the run finishes, even if the run already looked for devices.
+        self.watcher.mark()
+
+        on_transferred = None
+        if self.config.stream_transfers():
+            self.pipeline.start()
+            on_transferred = self.pipeline.submit
 
-        # Transfer Media from all devices.
-        # MTP - How does this behave if we connect two devices?
-        self.mtp_device.transfer_media()
+        try:
+            self.__transfer_media(on_transferred)
+        except Exception:
+            logging.exception('An error occurred while transferring media.')
+        finally:
+            streamed = self.pipeline.finish()
+
+        # Index staged media.
+        logging.info('Media transfer complete. Beginning indexing.')
+        try:
+            summary = self.indexer.run(max_files)
+        except Exception:
+            logging.exception('An error occurred while running the indexer.')
+            summary = RunSummary(0, 0, False)
+
+        return RunSummary(streamed.attempted + summary.attempted, streamed.indexed + summary.indexed,
+                          summary.budget_reached)
+
+    # Transfers media from the MTP device and every USB device at the same time.
+    def __transfer_media(self, on_transferred):
+        transfers = [('MTP', lambda: self.mtp_device.transfer_media(on_transferred))]
 
-        # USB
         mounts = self.config.usb_mount_points()
         ignore = self.config.usb_devices_to_ignore()
         devices = self.usb_device_manager.get_devices_to_index(mounts, ignore)
         logging.info('Found USB devices to index. devices=%s', devices)
+        self.usb_device.forget_missing([device_path for device_path, _ in devices])
         for device_path, device_name in devices:
-            self.usb_device.transfer_media(device_path, device_name)
+            transfers.append((device_name, self.__usb_transfer(device_path, device_name, on_transferred)))
+
+        self.workers.run(transfers)
+
+    def __usb_transfer(self, device_path, device_name, on_transferred):
+        return lambda: self.usb_device.transfer_media(device_path, device_name, on_transferred)
+
+    # Stop function
+    def stop(self):
+        logging.info('Stopping indexer.')
+        self.running = False
+        self.indexer.close()
+        self.watcher.close()
+        self.mtp_device.close()
+        self.usb_device.close()
+
+
+def exit_on_signal(signum, frame):
+    logging.info('Received signal, exiting. signum=%d', signum)
+    sys.exit(0)
 
-        # Index staged media.
-        logging.info('Media transfer complete. Beginning indexing.')
-        try:
-            self.indexer.run()
-        except:
-            logging.exception('An error occurred while running the indexer.')
 
-        # Schedule the next run of the indexer.
-        logging.info('Indexer finished, scheduling next run.')
-        self.scheduler.enter(self.config.indexer_delay(), 0, self.start, argument=())
-        self.scheduler.run()
+def reload_config_on_signal(signum, frame):
+    logging.info('Received signal, reloading config. signum=%d', signum)
+    request_reload()
 
 
 if __name__ == '__main__':
-    Starter().start()
+    signal.signal(signal.SIGTERM, exit_on_signal)
+    signal.signal(signal.SIGHUP, reload_config_on_signal)
+
+    starter = Starter()
+    try:
+        starter.start()
+    finally:
+        starter.stop()
@@ -0,0 +1,31 @@
+import os
+import sqlite3
+
+IN_MEMORY = ':memory:'
+
+
+# Opens the SQLite database that haystack keeps its state in, creating whichever of the given tables and indexes don't
+# exist yet. The local index, the hash cache, the failure tracker, and the MTP and USB transfer records all keep their
+# tables in this one database, each on its own connection, so that none of them waits on another's lock. Connections
+# are made on the main thread, but can be used from the threads transferring from devices and indexing files. Text is
+# returned as str, the way paths and names were stored.
+#
+# The database is kept in write-ahead logging mode, so readers don't wait on writers, and commits only wait for the disk
+# at checkpoints. The last few commits can be lost if the machine loses power, but the database stays intact, and each
+# store recovers from a lost commit the same way it does from a crash: a transfer is repeated, or a file hashed again.
+def open_state_database(config, util, schema, path_to_database=None):
+    if path_to_database is None:
+        path_to_database = config.state_database_path()
+
+    if path_to_database != IN_MEMORY:
+        util.mkdirp(os.path.dirname(path_to_database))
+
+    connection = sqlite3.connect(path_to_database, check_same_thread=False)
+    connection.text_factory = str
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous=NORMAL')
+    with connection:
+        for statement in schema:
+            connection.execute(statement)
+
+    return connection
@@ -0,0 +1,62 @@
+import json
+import os
+import sys
+import time
+
+# A stand-in for `exiftool -stay_open True -@ -` used by the exiftool session tests. Every filename that is requested
+# gets a canned metadata dict, except for a few magic names that make the process misbehave.
+#   hang.jpg  - never respond
+#   crash.jpg - exit without responding
+#   pid.jpg   - respond with this process's pid
+#   slow.jpg  - respond after half a second
+
+
+def metadata(filename):
+    name = os.path.basename(filename)
+    if name == 'hang.jpg':
+        time.sleep(60)
+    elif name == 'slow.jpg':
+        time.sleep(0.5)
+    elif name == 'crash.jpg':
+        sys.exit(1)
+    elif name == 'missing.jpg':
+        return None
+
+    data = {'SourceFile': filename, 'EXIF:DateTimeOriginal': '2015:06:23 21:52:13', 'EXIF:Orientation': 6}
+    if name == 'pid.jpg':
+        data['PID'] = os.getpid()
+
+    return data
+
+
+def respond(args):
+    files = [a for a in args if not a.startswith('-')]
+    if '-j' in args:
+        results = [m for m in (metadata(f) for f in files) if m is not None]
+        sys.stdout.write(json.dumps(results) + '\n' if results else '')
+    else:
+        sys.stdout.write('    1 image files updated\n')
+
+    sys.stdout.write('{ready}\n')
+    sys.stdout.flush()
+
+
+def main():
+    args = []
+    while True:
+        line = sys.stdin.readline()
+        if not line:
+            return
+
+        line = line.rstrip('\n')
+        if line == '-execute':
+            respond(args)
+            args = []
+        elif line == 'False' and args[-1:] == ['-stay_open']:
+            return
+        else:
+            args.append(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,10 @@
+import shutil
+import tempfile
+import unittest
+
+
+# A test case with a temporary directory, self.temp_dir, that's removed after each test, even if setUp fails partway.
+class TempDirTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
@@ -0,0 +1,139 @@
+import logging
+import os
+import shutil
+import threading
+import time
+import unittest
+
+from mock import MagicMock
+from mock import patch
+
+from change_watcher import ChangeWatcher
+from change_watcher import Inotify
+from config import Config
+from test.temp_dir_test_case import TempDirTestCase
+from util import Util
+
+logging.disable(logging.CRITICAL)
+
+
+class TestChangeWatcher(TempDirTestCase):
+    def setUp(self):
+        super(TestChangeWatcher, self).setUp()
+        self.staging_root = os.path.join(self.temp_dir, 'staging')
+        self.mount_point = os.path.join(self.temp_dir, 'media')
+        os.mkdir(self.staging_root)
+        os.mkdir(self.mount_point)
+
+        self.mock_config = MagicMock(spec=Config)
+        self.mock_config.staging_root.return_value = self.staging_root
+        self.mock_config.usb_mount_points.return_value = [self.mount_point, os.path.join(self.temp_dir, 'missing')]
+
+        self.test_model = ChangeWatcher(self.mock_config, MagicMock(spec=Util), Inotify())
+        self.test_model.mark()
+
+    def tearDown(self):
+        self.test_model.close()
+
+    def __write_file(self, path):
+        with open(path, 'wb') as f:
+            f.write('data')
+
+    def __later(self, action):
+        timer = threading.Timer(0.1, action)
+        timer.start()
+        self.addCleanup(timer.cancel)
+
+    def test_it_should_time_out_when_nothing_changes(self):
+        self.assertFalse(self.test_model.wait(0.2))
+
+    def test_it_should_wake_up_when_a_file_is_staged(self):
+        self.__later(lambda: self.__write_file(os.path.join(self.staging_root, 'file.jpg')))
+        start = time.time()
+        self.assertTrue(self.test_model.wait(30))
+        self.assertLess(time.time() - start, 1)
+
+    def test_it_should_wake_up_when_a_file_is_staged_in_a_device_directory(self):
+        os.mkdir(os.path.join(self.staging_root, 'device-1'))
+        self.test_model.mark()
+
+        self.__later(lambda: self.__write_file(os.path.join(self.staging_root, 'device-1', 'file.jpg')))
+        self.assertTrue(self.test_model.wait(30))
+
+    def test_it_should_watch_directories_created_while_waiting(self):
+        os.mkdir(os.path.join(self.staging_root, 'device-1'))
+        self.assertTrue(self.test_model.wait(30))
+
+        self.__later(lambda: self.__write_file(os.path.join(self.staging_root, 'device-1', 'file.jpg')))
+        self.assertTrue(self.test_model.wait(30))
+
+    def test_it_should_wake_up_when_a_device_is_mounted(self):
+        self.__later(lambda: os.mkdir(os.path.join(self.mount_point, 'device')))
+        self.assertTrue(self.test_model.wait(30))
+
+    def test_it_should_ignore_changes_inside_mounted_devices(self):
+        os.mkdir(os.path.join(self.mount_point, 'device'))
+        self.test_model.mark()
+
+        self.__write_file(os.path.join(self.mount_point, 'device', 'file.jpg'))
+        self.assertFalse(self.test_model.wait(0.2))
+
+    def test_it_should_report_devices_that_appear_after_it_was_marked(self):
+        os.mkdir(os.path.join(self.mount_point, 'device'))
+        self.assertTrue(self.test_model.devices_changed())
+        self.assertFalse(self.test_model.devices_changed())
+
+    def test_it_should_forget_staged_files_when_checking_for_devices(self):
+        self.__write_file(os.path.join(self.staging_root, 'file.jpg'))
+        self.assertFalse(self.test_model.devices_changed())
+        self.assertFalse(self.test_model.wait(0.2))
+
+    def test_it_should_report_changes_to_the_mount_table_when_checking_for_devices(self):
+        mountinfo = self.test_model.mountinfo
+        with patch('select.select', return_value=([], [], [mountinfo])):
+            self.assertTrue(self.test_model.devices_changed())
+
+    def test_it_should_forget_changes_from_before_it_was_marked(self):
+        self.__write_file(os.path.join(self.staging_root, 'file.jpg'))
+        self.test_model.mark()
+        self.assertFalse(self.test_model.wait(0.2))
+
+    def test_it_should_watch_staging_again_if_it_is_recreated(self):
+        shutil.rmtree(self.staging_root)
+        self.test_model.mark()
+
+        os.mkdir(self.staging_root)
+        self.test_model.mark()
+        self.__later(lambda: self.__write_file(os.path.join(self.staging_root, 'file.jpg')))
+        self.assertTrue(self.test_model.wait(30))
+
+    def test_it_should_wake_up_when_something_is_mounted(self):
+        mountinfo = self.test_model.mountinfo
+        with patch('select.select', side_effect=[([], [], [mountinfo]), ([], [], [])]):
+            start = time.time()
+            self.assertTrue(self.test_model.wait(30))
+            self.assertLess(time.time() - start, 1)
+
+    def test_it_should_watch_for_changes_without_the_mount_table(self):
+        test_model = ChangeWatcher(self.mock_config, MagicMock(spec=Util), Inotify(),
+                                   os.path.join(self.temp_dir, 'missing'))
+        self.addCleanup(test_model.close)
+        test_model.mark()
+        self.assertIsNone(test_model.mountinfo)
+
+        self.__later(lambda: self.__write_file(os.path.join(self.staging_root, 'file.jpg')))
+        self.assertTrue(test_model.wait(30))
+
+    @patch('time.sleep')
+    def test_it_should_sleep_for_the_whole_timeout_without_inotify(self, mock_sleep):
+        with patch('change_watcher.Inotify', side_effect=OSError('not supported')):
+            watcher = ChangeWatcher(self.mock_config, MagicMock(spec=Util))
+
+        watcher.mark()
+        self.assertFalse(watcher.devices_changed())
+        self.assertFalse(watcher.wait(60))
+        mock_sleep.assert_called_once_with(60)
+
+
+if __name__ == '__main__':
+    unittest.main()
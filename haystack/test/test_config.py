@@ -1,12 +1,16 @@
+import config
+import io
 import unittest
 
 from config import Config
 from ConfigParser import ConfigParser
 from mock import MagicMock
+from mock import Mock
+from mock import patch
 
 
 def mock_config(*args):
-    return {('Timing', 'ExecutionIntervalInSeconds'): '1200',
+    return {('Indexer', 'HashAlgorithm'): 'blake2b',
             ('MTP', 'PathsToIndex'): '/dir1,/dir2',
             ('MTP', 'Ignore'): 'serial',
             ('USB', 'PathsToIndex'): '/dir3,/dir4',
@@ -17,143 +21,306 @@ def mock_config(*args):
             ('PathsToFiles', 'PicturePath'): 'pictures',
             ('PathsToFiles', 'VideoPath'): 'videos',
             ('PathsToFiles', 'ThumbnailSize'): '128',
+            ('PathsToFiles', 'StateDatabasePath'): 'state.db',
             ('Index', 'Firebase'): 'test-firebase-name',
             ('Index', 'Secret'): 'test-firebase-secret'}[args]
 
 
 def mock_config_getint(*args):
-    return {('PathsToFiles', 'ThumbnailSize'): 128}[args]
+    return {('PathsToFiles', 'ThumbnailSize'): 128,
+            ('Timing', 'ExecutionIntervalInSeconds'): 1200,
+            ('Timing', 'MaxExecutionIntervalInSeconds'): 2400,
+            ('Indexer', 'Workers'): 4,
+            ('Indexer', 'MaxFilesPerRun'): 500,
+            ('Indexer', 'MaxConcurrentTransfers'): 2,
+            ('Indexer', 'TreeHashChunkSizeInMB'): 16,
+            ('Indexer', 'HashThreads'): 0,
+            ('Indexer', 'MaxIndexAttempts'): 6,
+            ('Indexer', 'FailureBackoffInSeconds'): 120}[args]
+
+
+def mock_config_getboolean(*args):
+    return {('Indexer', 'StreamTransfers'): True,
+            ('Indexer', 'TreeHash'): True,
+            ('MTP', 'UseLibMTP'): True,
+            ('Index', 'SyncToFirebase'): True}[args]
+
+
+def mock_config_has_option(*args):
+    for values in [mock_config, mock_config_getint, mock_config_getboolean]:
+        try:
+            values(*args)
+            return True
+        except KeyError:
+            pass
+
+    return False
+
+
+# A config file from before any optional keys existed.
+OLDEST_CONFIG_FILE = u"""
+[Timing]
+ExecutionIntervalInSeconds = 60
+
+[MTP]
+PathsToIndex = DCIM
+Ignore =
+
+[USB]
+PathsToIndex = haystack-queue
+MountPoints = /media
+Ignore = BOOTCAMP
+
+[PathsToFiles]
+HaystackRoot = /haystack
+ThumbnailPath = thumbnails/%Y/%M/%D
+PicturePath = pictures/%Y/%M/%D
+VideoPath = videos/%Y/%M/%D
+ThumbnailSize = 128
+
+[Index]
+Firebase = haystack-index-dev
+Secret = ???
+"""
+
+
+def config_parser(contents):
+    parser = ConfigParser()
+    parser.readfp(io.StringIO(contents))
+    # Config reads the config file into every parser it creates, so keep these from picking up a real one.
+    parser.read = Mock()
+    return parser
 
 
 class TestConfig(unittest.TestCase):
     def setUp(self):
         self.mock_config_parser = MagicMock(spec=ConfigParser)
         self.mock_config_parser.get.side_effect = mock_config
-        self.mock_config_parser.getint.side_effect = mock_config_getint
-        self.test_model = Config(self.mock_config_parser)
+        self.mock_config_getint = self.mock_config_parser.getint
+        self.mock_config_getint.side_effect = mock_config_getint
+        self.mock_config_parser.getboolean.side_effect = mock_config_getboolean
+        self.mock_config_parser.has_option.side_effect = mock_config_has_option
+        self.mock_new_parser = Mock(return_value=self.mock_config_parser)
+        self.reload_generation = config.reload_generation
+        self.test_model = Config(self.mock_new_parser)
+
+    # Reloads requested by a test would otherwise reload every Config in the tests that follow.
+    def tearDown(self):
+        config.reload_generation = self.reload_generation
+
+    def __config_file_changes(self, mock_stat, mock_time):
+        mock_stat.return_value = Mock(st_mtime=2)
+        mock_time.return_value += config.RELOAD_CHECK_INTERVAL_IN_SECONDS
 
     def test_it_should_load_the_right_config_file(self):
         self.mock_config_parser.read.assert_called_with('config.properties')
 
-    def test_indexer_delay_should_refresh_the_config(self):
+    def test_it_should_not_reread_the_config_file_if_it_has_not_changed(self):
+        self.test_model.indexer_delay()
+        self.test_model.haystack_root()
+        self.mock_config_parser.read.assert_called_once_with('config.properties')
+
+    @patch('time.time')
+    @patch('os.stat')
+    def test_it_should_reread_the_config_file_when_it_changes(self, mock_stat, mock_time):
+        mock_stat.return_value = Mock(st_mtime=1)
+        mock_time.return_value = 1000
+        self.test_model = Config(self.mock_new_parser)
+
+        self.__config_file_changes(mock_stat, mock_time)
+        self.mock_config_getint.side_effect = lambda *args: 60 if args[1] == 'ExecutionIntervalInSeconds' else \
+            mock_config_getint(*args)
+
+        self.assertEqual(self.test_model.indexer_delay(), 60)
+        self.assertEqual(self.mock_config_parser.read.call_count, 3)
+
+    @patch('time.time')
+    @patch('os.stat')
+    def test_it_should_only_check_the_config_file_for_changes_once_per_interval(self, mock_stat, mock_time):
+        mock_stat.return_value = Mock(st_mtime=1)
+        mock_time.return_value = 1000
+        self.test_model = Config(self.mock_new_parser)
+
+        mock_stat.return_value = Mock(st_mtime=2)
+        self.test_model.indexer_delay()
+        self.assertEqual(self.mock_config_parser.read.call_count, 2)
+
+    def test_it_should_reread_the_config_file_when_a_reload_is_requested(self):
+        config.request_reload()
         self.test_model.indexer_delay()
         self.assertEqual(self.mock_config_parser.read.call_count, 2)
 
+    def test_it_should_read_the_config_file_into_a_new_parser_when_it_reloads(self):
+        config.request_reload()
+        self.test_model.indexer_delay()
+        self.assertEqual(self.mock_new_parser.call_count, 2)
+
+    def test_it_should_forget_keys_that_were_removed_from_the_config_file(self):
+        self.mock_new_parser.side_effect = [
+            config_parser(OLDEST_CONFIG_FILE.replace(u'[Timing]', u'[Timing]\nMaxExecutionIntervalInSeconds = 600')),
+            config_parser(OLDEST_CONFIG_FILE)]
+        self.test_model = Config(self.mock_new_parser)
+        self.assertEqual(self.test_model.indexer_max_delay(), 600)
+
+        config.request_reload()
+        self.assertEqual(self.test_model.indexer_max_delay(), 60)
+
+    def test_it_should_behave_as_it_used_to_with_a_config_file_that_has_none_of_the_newer_keys(self):
+        self.mock_new_parser.return_value = config_parser(OLDEST_CONFIG_FILE)
+        snapshot = Config(self.mock_new_parser).snapshot()
+
+        self.assertEqual(snapshot.indexer_max_delay, 60)
+        self.assertEqual(snapshot.indexer_run_budget, 500)
+        self.assertEqual(snapshot.indexer_workers, 1)
+        self.assertFalse(snapshot.stream_transfers)
+        self.assertEqual(snapshot.max_concurrent_transfers, 1)
+        self.assertEqual(snapshot.hash_algorithm, 'md5')
+        self.assertFalse(snapshot.tree_hash)
+        self.assertEqual(snapshot.max_index_attempts, 6)
+        self.assertFalse(snapshot.mtp_use_libmtp)
+        self.assertEqual(snapshot.state_database_path, '/haystack/state.db')
+        self.assertTrue(snapshot.firebase_sync_enabled)
+
+    def test_it_should_return_the_same_snapshot_until_the_config_changes(self):
+        self.assertIs(self.test_model.snapshot(), self.test_model.snapshot())
+
+    def test_it_should_not_allow_snapshots_to_be_modified(self):
+        with self.assertRaises(AttributeError):
+            self.test_model.snapshot().indexer_delay = 1
+
+    def test_it_should_reject_a_relative_haystack_root(self):
+        self.mock_config_parser.get.side_effect = lambda *args: 'haystack' if args[1] == 'HaystackRoot' else \
+            mock_config(*args)
+        with self.assertRaises(RuntimeError):
+            Config(self.mock_new_parser)
+
+    def test_it_should_reject_a_non_positive_number_of_workers(self):
+        self.mock_config_getint.side_effect = lambda *args: 0 if args[1] == 'Workers' else mock_config_getint(*args)
+        with self.assertRaises(RuntimeError):
+            Config(self.mock_new_parser)
+
+    def test_it_should_reject_a_negative_number_of_hash_threads(self):
+        self.mock_config_getint.side_effect = lambda *args: -1 if args[1] == 'HashThreads' else \
+            mock_config_getint(*args)
+        with self.assertRaises(RuntimeError):
+            Config(self.mock_new_parser)
+
+    def test_it_should_reject_a_maximum_interval_shorter_than_the_interval(self):
+        self.mock_config_getint.side_effect = lambda *args: 10 if args[1] == 'MaxExecutionIntervalInSeconds' else \
+            mock_config_getint(*args)
+        with self.assertRaises(RuntimeError):
+            Config(self.mock_new_parser)
+
+    def test_it_should_keep_the_previous_values_if_a_reload_is_invalid(self):
+        self.mock_config_getint.side_effect = lambda *args: 0 if args[1] == 'Workers' else mock_config_getint(*args)
+        config.request_reload()
+        self.assertEqual(self.test_model.indexer_workers(), 4)
+
     def test_indexer_delay_should_return_the_right_config_value(self):
         actual_delay = self.test_model.indexer_delay()
         self.assertEqual(actual_delay, 1200)
 
-    def test_mtp_media_directories_should_refresh_the_config(self):
-        self.test_model.mtp_media_directories()
-        self.assertEqual(self.mock_config_parser.read.call_count, 2)
+    def test_indexer_max_delay_should_return_the_right_config_value(self):
+        self.assertEqual(self.test_model.indexer_max_delay(), 2400)
+
+    def test_indexer_run_budget_should_return_the_right_config_value(self):
+        self.assertEqual(self.test_model.indexer_run_budget(), 500)
+
+    def test_indexer_workers_should_return_the_right_config_value(self):
+        self.assertEqual(self.test_model.indexer_workers(), 4)
+
+    def test_max_concurrent_transfers_should_return_the_right_config_value(self):
+        self.assertEqual(self.test_model.max_concurrent_transfers(), 2)
+
+    def test_hash_algorithm_should_return_the_right_config_value(self):
+        self.assertEqual(self.test_model.hash_algorithm(), 'blake2b')
+
+    def test_tree_hash_should_return_the_right_config_value(self):
+        self.assertTrue(self.test_model.tree_hash())
+
+    def test_tree_hash_chunk_size_in_mb_should_return_the_right_config_value(self):
+        self.assertEqual(self.test_model.tree_hash_chunk_size_in_mb(), 16)
+
+    def test_hash_threads_should_return_the_right_config_value(self):
+        self.assertEqual(self.test_model.hash_threads(), 0)
+
+    def test_max_index_attempts_should_return_the_right_config_value(self):
+        self.assertEqual(self.test_model.max_index_attempts(), 6)
+
+    def test_failure_backoff_should_return_the_right_config_value(self):
+        self.assertEqual(self.test_model.failure_backoff(), 120)
+
+    def test_stream_transfers_should_return_the_right_config_value(self):
+        self.assertTrue(self.test_model.stream_transfers())
 
     def test_mtp_media_directories_should_return_the_right_list(self):
         actual_value = self.test_model.mtp_media_directories()
         self.assertEqual(actual_value, ['/dir1', '/dir2'])
 
-    def test_mtp_devices_to_ignore_should_refresh_the_config(self):
-        self.test_model.mtp_devices_to_ignore()
-        self.assertEqual(self.mock_config_parser.read.call_count, 2)
-
     def test_mtp_devices_to_ignore_should_return_the_right_list(self):
         actual_value = self.test_model.mtp_devices_to_ignore()
         self.assertEqual(actual_value, ['serial'])
 
-    def test_usb_media_directories_should_refresh_the_config(self):
-        self.test_model.usb_media_directories()
-        self.assertEqual(self.mock_config_parser.read.call_count, 2)
+    def test_mtp_use_libmtp_should_return_the_right_config_value(self):
+        self.assertTrue(self.test_model.mtp_use_libmtp())
 
     def test_usb_media_directories_should_return_the_right_list(self):
         actual_value = self.test_model.usb_media_directories()
         self.assertEqual(actual_value, ['/dir3', '/dir4'])
 
-    def test_usb_mount_points_should_refresh_the_config(self):
-        self.test_model.usb_mount_points()
-        self.assertEqual(self.mock_config_parser.read.call_count, 2)
-
     def test_usb_mount_points_should_return_the_right_list(self):
         actual_value = self.test_model.usb_mount_points()
         self.assertEqual(actual_value, ['/Volumes'])
 
-    def test_usb_devices_to_ignore_should_refresh_the_config(self):
-        self.test_model.usb_devices_to_ignore()
-        self.assertEqual(self.mock_config_parser.read.call_count, 2)
-
     def test_usb_devices_to_ignore_should_return_the_right_list(self):
         actual_value = self.test_model.usb_devices_to_ignore()
         self.assertEqual(actual_value, ['Macintosh HD'])
 
-    def test_haystack_root_should_refresh_the_config(self):
-        self.test_model.haystack_root()
-        self.assertEqual(self.mock_config_parser.read.call_count, 2)
-
     def test_haystack_root_should_return_the_right_directory(self):
         actual_value = self.test_model.haystack_root()
         self.assertEqual(actual_value, '/root')
 
-    def test_staging_root_should_refresh_the_config(self):
-        self.test_model.staging_root()
-        self.assertEqual(self.mock_config_parser.read.call_count, 2)
-
     def test_staging_root_should_return_the_right_directory(self):
         actual_value = self.test_model.staging_root()
         self.assertEqual(actual_value, '/root/staging')
 
-    def test_staging_directory_should_refresh_the_config(self):
-        self.test_model.staging_directory('device-id')
-        self.assertEqual(self.mock_config_parser.read.call_count, 2)
-
     def test_staging_directory_should_return_the_right_directory(self):
         actual_value = self.test_model.staging_directory('device-id')
         self.assertEqual(actual_value, '/root/staging/device-id')
 
-    def test_thumbnail_path_pattern_should_refresh_the_config(self):
-        self.test_model.thumbnail_path_pattern()
-        self.assertEqual(self.mock_config_parser.read.call_count, 2)
+    def test_quarantine_directory_should_return_the_right_directory(self):
+        self.assertEqual(self.test_model.quarantine_directory('device-id'), '/root/quarantine/device-id')
 
     def test_thumbnail_path_pattern_should_return_the_right_directory(self):
         actual_value = self.test_model.thumbnail_path_pattern()
         self.assertEqual(actual_value, '/root/thumbnails')
 
-    def test_picture_path_pattern_should_refresh_the_config(self):
-        self.test_model.picture_path_pattern()
-        self.assertEqual(self.mock_config_parser.read.call_count, 2)
-
     def test_picture_path_pattern_should_return_the_right_directory(self):
         actual_value = self.test_model.picture_path_pattern()
         self.assertEqual(actual_value, '/root/pictures')
 
-    def test_video_path_pattern_should_refresh_the_config(self):
-        self.test_model.video_path_pattern()
-        self.assertEqual(self.mock_config_parser.read.call_count, 2)
-
     def test_video_path_pattern_should_return_the_right_directory(self):
         actual_value = self.test_model.video_path_pattern()
         self.assertEqual(actual_value, '/root/videos')
 
-    def test_thumbnail_size_should_refresh_the_config(self):
-        self.test_model.thumbnail_size()
-        self.assertEqual(self.mock_config_parser.read.call_count, 2)
-
     def test_thumbnail_size_should_return_the_right_directory(self):
         actual_value = self.test_model.thumbnail_size()
         self.assertEqual(actual_value, 128)
 
-    def test_firebase_name_should_refresh_the_config(self):
-        self.test_model.firebase_name()
-        self.assertEqual(self.mock_config_parser.read.call_count, 2)
+    def test_state_database_path_should_return_the_right_path(self):
+        self.assertEqual(self.test_model.state_database_path(), '/root/state.db')
 
     def test_firebase_name_should_return_the_right_value(self):
         actual_value = self.test_model.firebase_name()
         self.assertEqual(actual_value, 'test-firebase-name')
 
-    def test_firebase_secret_should_refresh_the_config(self):
-        self.test_model.firebase_secret()
-        self.assertEqual(self.mock_config_parser.read.call_count, 2)
-
     def test_firebase_secret_should_return_the_right_value(self):
         actual_value = self.test_model.firebase_secret()
         self.assertEqual(actual_value, 'test-firebase-secret')
 
+    def test_firebase_sync_enabled_should_return_the_right_value(self):
+        self.assertTrue(self.test_model.firebase_sync_enabled())
+
+
 if __name__ == '__main__':
     unittest.main()
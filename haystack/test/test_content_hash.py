@@ -0,0 +1,123 @@
+import content_hash
+import hashlib
+import os
+import unittest
+
+from config import Config
+from content_hash import ContentHasher
+from content_hash import UnreadableFileError
+from content_hash import create_content_hasher
+from content_hash import create_content_hasher_for_label
+from content_hash import get_hash_label
+from test.temp_dir_test_case import TempDirTestCase
+from mock import Mock
+from mock import patch
+
+CHUNK_SIZE = 1048576
+FILE_CONTENTS = os.urandom(3 * CHUNK_SIZE + 1000)
+
+
+def tree_hash(contents):
+    root = hashlib.md5()
+    for offset in range(0, len(contents), CHUNK_SIZE):
+        root.update(hashlib.md5(contents[offset:offset + CHUNK_SIZE]).digest())
+    return root.hexdigest()
+
+
+class TestContentHasher(TempDirTestCase):
+    def setUp(self):
+        super(TestContentHasher, self).setUp()
+        self.path_to_file = os.path.join(self.temp_dir, 'file.mts')
+        with open(self.path_to_file, 'wb') as f:
+            f.write(FILE_CONTENTS)
+
+        self.mock_config = Mock(spec=Config)
+        self.mock_config.hash_algorithm.return_value = 'md5'
+        self.mock_config.tree_hash.return_value = True
+        self.mock_config.tree_hash_chunk_size_in_mb.return_value = 16
+        self.mock_config.hash_threads.return_value = 4
+
+    def test_it_should_hash_files_with_plain_md5_by_default(self):
+        self.assertEqual(ContentHasher().hash_file(self.path_to_file), hashlib.md5(FILE_CONTENTS).hexdigest())
+
+    def test_it_should_hash_files_as_a_tree_of_chunks_on_several_threads(self):
+        test_model = ContentHasher(tree_chunk_size_in_mb=1, threads=4)
+        self.assertEqual(test_model.hash_file(self.path_to_file), 'md5-tree1m-' + tree_hash(FILE_CONTENTS))
+
+    def test_it_should_get_the_same_tree_hash_on_one_thread(self):
+        test_model = ContentHasher(tree_chunk_size_in_mb=1, threads=1)
+        self.assertEqual(test_model.hash_file(self.path_to_file), 'md5-tree1m-' + tree_hash(FILE_CONTENTS))
+
+    def test_it_should_get_the_same_tree_hash_while_a_file_is_read_in_pieces(self):
+        content_hash = ContentHasher(tree_chunk_size_in_mb=1).new()
+        for offset in range(0, len(FILE_CONTENTS), 300000):
+            content_hash.update(memoryview(FILE_CONTENTS)[offset:offset + 300000])
+
+        self.assertEqual(content_hash.hexdigest(), 'md5-tree1m-' + tree_hash(FILE_CONTENTS))
+
+    def test_it_should_tree_hash_empty_files(self):
+        content_hash = ContentHasher(tree_chunk_size_in_mb=1).new()
+        self.assertEqual(content_hash.hexdigest(), 'md5-tree1m-' + hashlib.md5().hexdigest())
+
+    @unittest.skipIf(content_hash.blake2b is None, 'BLAKE2b is not available')
+    def test_it_should_label_blake2b_hashes(self):
+        actual_hash = ContentHasher('blake2b').hash_file(self.path_to_file)
+        self.assertEqual(actual_hash, 'blake2b-' + content_hash.blake2b(FILE_CONTENTS, digest_size=32).hexdigest())
+
+    @unittest.skipIf(content_hash.xxhash is None, 'xxhash is not installed')
+    def test_it_should_label_xxh64_hashes(self):
+        actual_hash = ContentHasher('xxh64').hash_file(self.path_to_file)
+        self.assertEqual(actual_hash, 'xxh64-' + content_hash.xxhash.xxh64(FILE_CONTENTS).hexdigest())
+
+    def test_it_should_raise_an_unreadable_file_error_if_the_file_cannot_be_read(self):
+        with self.assertRaises(UnreadableFileError):
+            ContentHasher().hash_file(os.path.join(self.temp_dir, 'missing.mts'))
+
+    def test_it_should_find_the_label_of_a_hash(self):
+        self.assertEqual(get_hash_label(hashlib.md5().hexdigest()), '')
+        self.assertEqual(get_hash_label('md5-tree16m-' + hashlib.md5().hexdigest()), 'md5-tree16m-')
+        self.assertEqual(get_hash_label('blake2b-abc'), 'blake2b-')
+
+    def test_it_should_create_a_hasher_that_computes_hashes_with_a_given_label(self):
+        for algorithm, tree_chunk_size_in_mb in [('md5', None), ('md5', 16), ('blake2b', None), ('xxh64', 1)]:
+            if not content_hash.available_algorithms()[algorithm]:
+                continue
+
+            label = ContentHasher(algorithm, tree_chunk_size_in_mb).prefix
+            test_model = create_content_hasher_for_label(label)
+            self.assertEqual((test_model.algorithm, test_model.prefix), (algorithm, label))
+
+    def test_it_should_raise_an_error_for_unknown_hash_labels(self):
+        with self.assertRaises(RuntimeError):
+            create_content_hasher_for_label('crc32-')
+
+    def test_it_should_raise_an_error_for_unknown_algorithms(self):
+        with self.assertRaises(RuntimeError):
+            ContentHasher('crc32')
+
+    @patch('content_hash.xxhash', None)
+    def test_it_should_raise_an_error_for_algorithms_that_are_not_installed(self):
+        with self.assertRaises(RuntimeError):
+            ContentHasher('xxh64')
+
+    def test_it_should_create_a_hasher_from_the_config(self):
+        test_model = create_content_hasher(self.mock_config)
+        self.assertEqual(test_model.tree_chunk_size, 16 * CHUNK_SIZE)
+        self.assertEqual(test_model.threads, 4)
+        self.assertEqual(test_model.prefix, 'md5-tree16m-')
+
+    def test_it_should_not_tree_hash_unless_configured_to(self):
+        self.mock_config.tree_hash.return_value = False
+        test_model = create_content_hasher(self.mock_config)
+        self.assertIsNone(test_model.tree_chunk_size)
+        self.assertEqual(test_model.prefix, '')
+
+    @patch('multiprocessing.cpu_count')
+    def test_it_should_use_a_thread_for_every_core_if_no_number_is_configured(self, mock_cpu_count):
+        mock_cpu_count.return_value = 8
+        self.mock_config.hash_threads.return_value = 0
+        self.assertEqual(create_content_hasher(self.mock_config).threads, 8)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+import errno
+import hashlib
+import os
+import unittest
+
+from mock import ANY
+from mock import MagicMock
+from mock import patch
+
+from copy_engine import BUFFER_SIZE
+from copy_engine import CopyEngine
+from copy_engine import load_libc
+from test.temp_dir_test_case import TempDirTestCase
+
+FILE_CONTENTS = 'not really a jpeg' * 1000
+MTIME = 1434217122
+
+
+class TestCopyEngine(TempDirTestCase):
+    def setUp(self):
+        super(TestCopyEngine, self).setUp()
+        self.src = os.path.join(self.temp_dir, 'src.jpg')
+        self.dest = os.path.join(self.temp_dir, 'dest.jpg')
+        self.__write_file(self.src, FILE_CONTENTS)
+
+        self.libc = load_libc()
+        self.test_model = CopyEngine(self.libc)
+
+    def __write_file(self, path, contents):
+        with open(path, 'wb') as f:
+            f.write(contents)
+        os.utime(path, (MTIME, MTIME))
+
+    def __read_file(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def test_it_should_copy_files(self):
+        self.test_model.copy(self.src, self.dest)
+        self.assertEqual(self.__read_file(self.dest), FILE_CONTENTS)
+
+    def test_it_should_keep_the_modification_time(self):
+        self.test_model.copy(self.src, self.dest)
+        self.assertEqual(os.stat(self.dest).st_mtime, MTIME)
+
+    def test_it_should_copy_empty_files(self):
+        self.__write_file(self.src, '')
+        self.test_model.copy(self.src, self.dest)
+        self.assertEqual(self.__read_file(self.dest), '')
+
+    def test_it_should_copy_files_larger_than_its_buffer(self):
+        contents = os.urandom(BUFFER_SIZE + 12345)
+        self.__write_file(self.src, contents)
+        md5 = hashlib.md5()
+
+        self.test_model.copy(self.src, self.dest, md5)
+        self.assertEqual(self.__read_file(self.dest), contents)
+        self.assertEqual(md5.hexdigest(), hashlib.md5(contents).hexdigest())
+
+    @unittest.skipUnless(hasattr(load_libc(), 'copy_file_range'), 'copy_file_range is not available')
+    def test_it_should_copy_in_the_kernel_when_possible(self):
+        mock_libc = MagicMock()
+        mock_libc.copy_file_range.side_effect = self.libc.copy_file_range
+
+        CopyEngine(mock_libc).copy(self.src, self.dest)
+        self.assertGreater(mock_libc.copy_file_range.call_count, 0)
+        mock_libc.sendfile.assert_not_called()
+        self.assertEqual(self.__read_file(self.dest), FILE_CONTENTS)
+
+    @unittest.skipUnless(hasattr(load_libc(), 'copy_file_range'), 'copy_file_range is not available')
+    def test_it_should_checksum_the_copy_when_it_copies_in_the_kernel(self):
+        mock_libc = MagicMock()
+        mock_libc.copy_file_range.side_effect = self.libc.copy_file_range
+        md5 = hashlib.md5()
+
+        CopyEngine(mock_libc).copy(self.src, self.dest, md5)
+        self.assertGreater(mock_libc.copy_file_range.call_count, 0)
+        mock_libc.sendfile.assert_not_called()
+        self.assertEqual(self.__read_file(self.dest), FILE_CONTENTS)
+        self.assertEqual(md5.hexdigest(), hashlib.md5(FILE_CONTENTS).hexdigest())
+
+    def test_it_should_checksum_the_bytes_it_copies_through_a_buffer(self):
+        md5 = hashlib.md5()
+        CopyEngine(None).copy(self.src, self.dest, md5)
+        self.assertEqual(self.__read_file(self.dest), FILE_CONTENTS)
+        self.assertEqual(md5.hexdigest(), hashlib.md5(FILE_CONTENTS).hexdigest())
+
+    def test_it_should_raise_an_error_if_the_kernel_copies_too_little(self):
+        mock_libc = MagicMock()
+        mock_libc.copy_file_range.side_effect = [100, 0]
+
+        with self.assertRaises(RuntimeError):
+            CopyEngine(mock_libc).copy(self.src, self.dest)
+
+    def test_it_should_raise_an_error_if_the_source_is_shorter_than_expected(self):
+        with patch('os.fstat', return_value=MagicMock(st_size=len(FILE_CONTENTS) + 1)):
+            with self.assertRaises(RuntimeError):
+                CopyEngine(None).copy(self.src, self.dest)
+
+    @patch('ctypes.get_errno')
+    def test_it_should_fall_back_to_a_buffer_if_the_kernel_cannot_copy(self, mock_get_errno):
+        # Like the kernel refusing to copy between two filesystems.
+        mock_get_errno.return_value = errno.EXDEV
+        mock_libc = MagicMock()
+        mock_libc.copy_file_range.return_value = -1
+        mock_libc.sendfile.return_value = -1
+
+        CopyEngine(mock_libc).copy(self.src, self.dest)
+        mock_libc.copy_file_range.assert_called_once_with(ANY, None, ANY, None, ANY, 0)
+        mock_libc.sendfile.assert_called_once_with(ANY, ANY, None, ANY)
+        self.assertEqual(self.__read_file(self.dest), FILE_CONTENTS)
+
+    @patch('ctypes.get_errno')
+    def test_it_should_raise_kernel_copy_errors_once_it_has_started_copying(self, mock_get_errno):
+        mock_get_errno.return_value = errno.EIO
+        mock_libc = MagicMock()
+        mock_libc.copy_file_range.side_effect = [100, -1]
+
+        with self.assertRaises(OSError):
+            CopyEngine(mock_libc).copy(self.src, self.dest)
+
+    def test_it_should_copy_through_a_buffer_without_libc(self):
+        with patch('copy_engine.load_libc', side_effect=OSError('libc is missing!')):
+            test_model = CopyEngine()
+
+        test_model.copy(self.src, self.dest)
+        self.assertEqual(self.__read_file(self.dest), FILE_CONTENTS)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import logging
+import signal
+import threading
+import unittest
+
+from device_workers import DeviceWorkers
+
+logging.disable(logging.CRITICAL)
+
+
+class TestDeviceWorkers(unittest.TestCase):
+    def setUp(self):
+        self.test_model = DeviceWorkers()
+
+    def test_it_should_run_every_transfer(self):
+        transferred = []
+        self.test_model.run([('MTP', lambda: transferred.append('MTP')),
+                             ('dev1', lambda: transferred.append('dev1'))])
+        self.assertItemsEqual(transferred, ['MTP', 'dev1'])
+
+    def test_it_should_run_transfers_at_the_same_time(self):
+        # Each transfer waits for the other to start, so this only finishes if they run together.
+        started = [threading.Event(), threading.Event()]
+
+        def transfer(mine, other):
+            started[mine].set()
+            if not started[other].wait(5):
+                raise RuntimeError('The other transfer never started!')
+
+        self.test_model.run([('dev1', lambda: transfer(0, 1)), ('dev2', lambda: transfer(1, 0))])
+
+    def test_it_should_finish_every_transfer_before_raising_a_failure(self):
+        transferred = []
+
+        def fail():
+            raise RuntimeError('Unable to download file from MTP device!')
+
+        with self.assertRaises(RuntimeError):
+            self.test_model.run([('MTP', fail), ('dev1', lambda: transferred.append('dev1'))])
+        self.assertEqual(transferred, ['dev1'])
+
+    def test_it_should_do_nothing_without_devices(self):
+        self.test_model.run([])
+
+    def test_it_should_handle_signals_while_a_transfer_is_running(self):
+        release = threading.Event()
+        finished = []
+
+        def transfer():
+            release.wait(10)
+            finished.append(True)
+
+        def interrupt(signum, frame):
+            raise SystemExit(0)
+
+        previous_handler = signal.signal(signal.SIGALRM, interrupt)
+        try:
+            signal.setitimer(signal.ITIMER_REAL, 0.1)
+            with self.assertRaises(SystemExit):
+                self.test_model.run([('dev1', transfer)])
+            self.assertEqual(finished, [])
+        finally:
+            release.set()
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, previous_handler)
+
+
+if __name__ == '__main__':
+    unittest.main()
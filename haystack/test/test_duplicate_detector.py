@@ -0,0 +1,119 @@
+import hashlib
+import os
+import unittest
+
+from config import Config
+from duplicate_detector import DuplicateDetector
+from duplicate_detector import get_sample_hash
+from duplicate_detector import SAMPLE_SIZE
+from local_index import LocalIndex
+from mock import MagicMock
+from mock import patch
+from state_database import IN_MEMORY
+from test.temp_dir_test_case import TempDirTestCase
+
+MEDIA_CONTENTS = 'a' * SAMPLE_SIZE + 'b' * SAMPLE_SIZE + 'c' * SAMPLE_SIZE
+MEDIA_HASH = hashlib.md5(MEDIA_CONTENTS).hexdigest()
+
+
+class TestDuplicateDetector(TempDirTestCase):
+    def setUp(self):
+        super(TestDuplicateDetector, self).setUp()
+
+        self.mock_config = MagicMock(spec=Config)
+        self.mock_config.haystack_root.return_value = self.temp_dir
+        self.mock_config.firebase_sync_enabled.return_value = False
+        self.mock_config.hash_threads.return_value = 1
+
+        self.index = LocalIndex(self.mock_config, path_to_database=IN_MEMORY)
+
+        os.mkdir(os.path.join(self.temp_dir, 'pictures'))
+        self.path_to_media = 'pictures/' + MEDIA_HASH + '.jpg'
+        self.__write(self.path_to_media, MEDIA_CONTENTS)
+        self.index.index_media(self.path_to_media, None, 1449176000, 'device', MEDIA_HASH, 'JPG')
+
+        self.test_model = DuplicateDetector(self.mock_config, self.index)
+
+    def tearDown(self):
+        self.index.close()
+
+    def __write(self, path, contents):
+        path = os.path.join(self.temp_dir, path)
+        with open(path, 'wb') as f:
+            f.write(contents)
+        return path
+
+    def test_it_should_rule_out_files_with_a_new_size(self):
+        path_to_file = self.__write('new.jpg', MEDIA_CONTENTS + 'd')
+        with patch('duplicate_detector.get_sample_hash') as mock_get_sample_hash:
+            self.assertFalse(self.test_model.may_be_duplicate(path_to_file))
+        mock_get_sample_hash.assert_not_called()
+
+    def test_it_should_rule_out_files_with_the_same_size_but_a_different_start_or_end(self):
+        path_to_file = self.__write('new.jpg', 'd' + MEDIA_CONTENTS[1:])
+        self.assertFalse(self.test_model.may_be_duplicate(path_to_file))
+
+    def test_it_should_find_files_that_may_be_duplicates(self):
+        path_to_file = self.__write('new.jpg', MEDIA_CONTENTS)
+        self.assertTrue(self.test_model.may_be_duplicate(path_to_file))
+
+    def test_it_should_find_duplicates_of_media_indexed_with_another_hash_algorithm(self):
+        path_to_file = self.__write('new.jpg', MEDIA_CONTENTS)
+        self.assertTrue(self.test_model.matches_other_hash_algorithms(path_to_file, 'blake2b-' + 'f' * 64))
+
+    def test_it_should_not_match_files_with_different_contents_to_media_indexed_with_another_hash_algorithm(self):
+        path_to_file = self.__write('new.jpg', 'd' + MEDIA_CONTENTS[1:])
+        self.assertFalse(self.test_model.matches_other_hash_algorithms(path_to_file, 'md5-tree1m-' + 'f' * 32))
+
+    def test_it_should_only_hash_files_again_for_media_of_the_same_size_indexed_with_another_hash_algorithm(self):
+        path_to_file = self.__write('new.jpg', MEDIA_CONTENTS)
+        with patch('duplicate_detector.create_content_hasher_for_label') as mock_create_content_hasher:
+            self.assertFalse(self.test_model.matches_other_hash_algorithms(path_to_file, 'f' * 32))
+            path_to_file = self.__write('new.jpg', MEDIA_CONTENTS + 'd')
+            self.assertFalse(self.test_model.matches_other_hash_algorithms(path_to_file, 'blake2b-' + 'f' * 64))
+        mock_create_content_hasher.assert_not_called()
+
+    def test_it_should_skip_media_indexed_with_a_hash_algorithm_that_is_not_available(self):
+        self.__write('pictures/other.jpg', MEDIA_CONTENTS)
+        self.index.index_media('pictures/other.jpg', None, 1449176000, 'device', 'nosuchalgo-' + 'f' * 64, 'JPG')
+        path_to_file = self.__write('new.jpg', 'd' + MEDIA_CONTENTS[1:])
+        with patch('logging.warn') as mock_warn:
+            self.assertFalse(self.test_model.matches_other_hash_algorithms(path_to_file, 'blake2b-' + 'f' * 64))
+            self.assertFalse(self.test_model.matches_other_hash_algorithms(path_to_file, 'blake2b-' + 'f' * 64))
+        self.assertEqual(mock_warn.call_count, 1)
+
+    def test_it_should_only_sample_the_start_and_end_of_files(self):
+        path_to_file = self.__write('new.jpg', 'a' * SAMPLE_SIZE + 'd' * SAMPLE_SIZE + 'c' * SAMPLE_SIZE)
+        self.assertTrue(self.test_model.may_be_duplicate(path_to_file))
+
+    def test_it_should_sample_all_of_small_files(self):
+        path_to_file = self.__write('small.jpg', 'small')
+        self.assertEqual(get_sample_hash(path_to_file, 5), hashlib.md5('small').hexdigest())
+
+    def test_it_should_remember_the_samples_of_indexed_media(self):
+        path_to_file = self.__write('new.jpg', MEDIA_CONTENTS)
+        self.test_model.may_be_duplicate(path_to_file)
+        os.remove(os.path.join(self.temp_dir, self.path_to_media))
+        self.assertTrue(self.test_model.may_be_duplicate(path_to_file))
+        self.assertEqual(self.index.find_media_with_size(len(MEDIA_CONTENTS))[0][2],
+                         get_sample_hash(path_to_file, len(MEDIA_CONTENTS)))
+
+    def test_it_should_find_media_that_is_indexed_after_it_starts(self):
+        self.__write('pictures/new.jpg', 'new media')
+        self.index.index_media('pictures/new.jpg', None, 1449176000, 'device', 'new-hash', 'JPG')
+        self.assertTrue(self.test_model.may_be_duplicate(self.__write('new.jpg', 'new media')))
+
+    def test_it_should_assume_files_may_be_duplicates_if_indexed_media_cannot_be_read(self):
+        os.remove(os.path.join(self.temp_dir, self.path_to_media))
+        self.assertTrue(self.test_model.may_be_duplicate(self.__write('new.jpg', MEDIA_CONTENTS)))
+
+    def test_it_should_assume_files_may_be_duplicates_if_they_cannot_be_read(self):
+        self.assertTrue(self.test_model.may_be_duplicate(os.path.join(self.temp_dir, 'missing.jpg')))
+
+    def test_it_should_skip_indexed_media_that_is_missing(self):
+        self.index.index_media('pictures/missing.jpg', None, 1449176000, 'device', 'missing-hash', 'JPG')
+        self.assertTrue(self.test_model.may_be_duplicate(self.__write('new.jpg', MEDIA_CONTENTS)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,31 @@
+import logging
+import subprocess
+import unittest
+
+from executor import Executor
+
+logging.disable(logging.CRITICAL)
+
+
+class TestExecutor(unittest.TestCase):
+    def setUp(self):
+        self.test_model = Executor()
+
+    def test_it_should_stream_a_commands_output_line_by_line(self):
+        lines = self.test_model.execute_lines(['printf', 'first\\nsecond\\r\\nthird'])
+        self.assertEqual(list(lines), ['first', 'second', 'third'])
+
+    def test_it_should_raise_an_error_if_the_command_fails(self):
+        lines = self.test_model.execute_lines(['sh', '-c', 'echo partial; exit 3'])
+        self.assertEqual(next(lines), 'partial')
+        with self.assertRaises(subprocess.CalledProcessError):
+            next(lines)
+
+    def test_it_should_stop_the_command_if_the_output_is_abandoned(self):
+        lines = self.test_model.execute_lines(['yes'])
+        self.assertEqual(next(lines), 'y')
+        lines.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
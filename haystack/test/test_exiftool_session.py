@@ -0,0 +1,96 @@
+import signal
+import sys
+import unittest
+
+from exiftool_session import ExifToolSession
+
+FAKE_EXIFTOOL_COMMAND = [sys.executable, 'test/resources/fake-exiftool.py']
+
+
+class TestExifToolSession(unittest.TestCase):
+    def setUp(self):
+        self.test_model = ExifToolSession(FAKE_EXIFTOOL_COMMAND, timeout=1)
+
+    def tearDown(self):
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, signal.SIG_DFL)
+        self.test_model.close()
+
+    # Sends a SIGALRM, handled by handler, while the request is waiting on exiftool.
+    def __signal_during_request(self, handler):
+        signal.signal(signal.SIGALRM, handler)
+        signal.setitimer(signal.ITIMER_REAL, 0.2)
+
+    def test_it_should_not_start_exiftool_until_it_is_needed(self):
+        self.assertFalse(self.test_model.is_running())
+
+    def test_it_should_return_metadata_for_a_file(self):
+        metadata = self.test_model.get_metadata('/path/to/file.jpg')
+        self.assertEqual(metadata['EXIF:DateTimeOriginal'], '2015:06:23 21:52:13')
+
+    def test_it_should_return_metadata_for_a_batch_of_files(self):
+        metadata = self.test_model.get_metadata_batch(['/path/to/file1.jpg', '/path/to/file2.jpg'])
+        self.assertEqual([m['SourceFile'] for m in metadata], ['/path/to/file1.jpg', '/path/to/file2.jpg'])
+
+    def test_it_should_leave_unreadable_files_out_of_tag_batches(self):
+        metadata = self.test_model.get_tags_batch(['EXIF:DateTimeOriginal'], ['/path/to/missing.jpg', '/path/to/a.jpg'])
+        self.assertEqual([m['SourceFile'] for m in metadata], ['/path/to/a.jpg'])
+
+    def test_it_should_reuse_the_same_process_for_multiple_requests(self):
+        first_pid = self.test_model.get_metadata('/path/to/pid.jpg')['PID']
+        second_pid = self.test_model.get_metadata('/path/to/pid.jpg')['PID']
+        self.assertEqual(first_pid, second_pid)
+
+    def test_it_should_raise_an_error_if_the_file_has_no_metadata(self):
+        with self.assertRaises(RuntimeError):
+            self.test_model.get_metadata('/path/to/missing.jpg')
+
+    def test_it_should_raise_an_error_if_a_request_times_out(self):
+        with self.assertRaises(RuntimeError):
+            self.test_model.get_metadata('/path/to/hang.jpg')
+        self.assertFalse(self.test_model.is_running())
+
+    def test_it_should_raise_an_error_if_exiftool_crashes(self):
+        with self.assertRaises(RuntimeError):
+            self.test_model.get_metadata('/path/to/crash.jpg')
+
+    def test_it_should_restart_exiftool_after_a_crash(self):
+        with self.assertRaises(RuntimeError):
+            self.test_model.get_metadata('/path/to/crash.jpg')
+
+        metadata = self.test_model.get_metadata('/path/to/file.jpg')
+        self.assertEqual(metadata['SourceFile'], '/path/to/file.jpg')
+
+    def test_it_should_restart_exiftool_if_it_died_between_requests(self):
+        self.test_model.get_metadata('/path/to/file.jpg')
+        self.test_model.process.kill()
+        self.test_model.process.wait()
+
+        metadata = self.test_model.get_metadata('/path/to/file.jpg')
+        self.assertEqual(metadata['SourceFile'], '/path/to/file.jpg')
+
+    def test_it_should_keep_waiting_for_a_response_after_a_signal(self):
+        self.__signal_during_request(lambda signum, frame: None)
+        metadata = self.test_model.get_metadata('/path/to/slow.jpg')
+        self.assertEqual(metadata['SourceFile'], '/path/to/slow.jpg')
+
+    def test_it_should_not_return_the_response_to_an_interrupted_request_to_the_next_one(self):
+        def interrupt(signum, frame):
+            raise KeyboardInterrupt()
+
+        self.__signal_during_request(interrupt)
+        with self.assertRaises(KeyboardInterrupt):
+            self.test_model.get_metadata('/path/to/slow.jpg')
+
+        self.assertFalse(self.test_model.is_running())
+        metadata = self.test_model.get_metadata('/path/to/second.jpg')
+        self.assertEqual(metadata['SourceFile'], '/path/to/second.jpg')
+
+    def test_it_should_stop_exiftool_when_closed(self):
+        self.test_model.get_metadata('/path/to/file.jpg')
+        self.test_model.close()
+        self.assertFalse(self.test_model.is_running())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,138 @@
+import json
+import logging
+import os
+import unittest
+
+from config import Config
+from failure_tracker import FailureTracker
+from failure_tracker import MAX_BACKOFF_IN_SECONDS
+from mock import MagicMock
+from mock import patch
+from state_database import IN_MEMORY
+from test.temp_dir_test_case import TempDirTestCase
+from util import Util
+
+logging.disable(logging.CRITICAL)
+
+NOW = 1449176000
+
+
+class TestFailureTracker(TempDirTestCase):
+    def setUp(self):
+        super(TestFailureTracker, self).setUp()
+        self.staging_dir = os.path.join(self.temp_dir, 'staging', 'device-id')
+        self.quarantine_dir = os.path.join(self.temp_dir, 'quarantine', 'device-id')
+        os.makedirs(self.staging_dir)
+
+        self.path_to_file = os.path.join(self.staging_dir, 'file.jpg')
+        with open(self.path_to_file, 'wb') as f:
+            f.write('not really a jpeg')
+
+        self.mock_config = MagicMock(spec=Config)
+        self.mock_config.max_index_attempts.return_value = 3
+        self.mock_config.failure_backoff.return_value = 60
+        self.mock_config.quarantine_directory.return_value = self.quarantine_dir
+
+        self.mock_util = MagicMock(spec=Util)
+        self.mock_util.mkdirp.side_effect = lambda path: os.path.isdir(path) or os.makedirs(path)
+        self.mock_util.get_uuid.return_value = 'some-uuid'
+
+        self.time_patcher = patch('time.time', return_value=NOW)
+        self.mock_time = self.time_patcher.start()
+
+        self.test_model = FailureTracker(self.mock_config, self.mock_util, IN_MEMORY)
+
+    def tearDown(self):
+        self.time_patcher.stop()
+        self.test_model.close()
+
+    def __fail(self, times=1):
+        for _ in range(times):
+            self.test_model.record_failure('device-id', self.path_to_file, RuntimeError('missing tag'))
+
+    def test_it_should_attempt_files_that_have_not_failed(self):
+        self.assertTrue(self.test_model.may_attempt(self.path_to_file))
+
+    def test_it_should_record_why_and_how_many_times_a_file_failed(self):
+        self.__fail(2)
+        failure = self.test_model.find_failure(self.path_to_file)
+        self.assertEqual(failure.reason, 'missing tag')
+        self.assertEqual(failure.attempts, 2)
+        self.assertEqual(failure.first_failed, NOW)
+
+    def test_it_should_not_attempt_files_until_their_backoff_has_passed(self):
+        self.__fail()
+        self.assertFalse(self.test_model.may_attempt(self.path_to_file))
+        self.mock_time.return_value = NOW + 60
+        self.assertTrue(self.test_model.may_attempt(self.path_to_file))
+
+    def test_it_should_double_the_backoff_after_every_failure(self):
+        self.__fail(2)
+        self.assertEqual(self.test_model.find_failure(self.path_to_file).retry_after, NOW + 120)
+
+    def test_it_should_limit_the_backoff(self):
+        self.mock_config.max_index_attempts.return_value = 100
+        self.__fail(20)
+        self.assertEqual(self.test_model.find_failure(self.path_to_file).retry_after, NOW + MAX_BACKOFF_IN_SECONDS)
+
+    def test_it_should_start_over_when_a_file_changes(self):
+        self.__fail(2)
+        with open(self.path_to_file, 'ab') as f:
+            f.write('!')
+
+        self.assertTrue(self.test_model.may_attempt(self.path_to_file))
+        self.__fail()
+        self.assertEqual(self.test_model.find_failure(self.path_to_file).attempts, 1)
+
+    def test_it_should_quarantine_files_that_fail_too_many_times(self):
+        self.__fail(3)
+        self.assertFalse(os.path.exists(self.path_to_file))
+        self.assertTrue(os.path.exists(os.path.join(self.quarantine_dir, 'file.jpg')))
+        self.assertIsNone(self.test_model.find_failure(self.path_to_file))
+        self.mock_config.quarantine_directory.assert_called_with('device-id')
+
+    def test_it_should_write_a_report_next_to_quarantined_files(self):
+        self.__fail(3)
+        with open(os.path.join(self.quarantine_dir, 'file.jpg.failure.json'), 'r') as f:
+            report = json.load(f)
+
+        self.assertEqual(report['path_to_file'], self.path_to_file)
+        self.assertEqual(report['device_id'], 'device-id')
+        self.assertEqual(report['reason'], 'missing tag')
+        self.assertEqual(report['attempts'], 3)
+
+    def test_it_should_not_overwrite_quarantined_files_with_the_same_name(self):
+        os.makedirs(self.quarantine_dir)
+        with open(os.path.join(self.quarantine_dir, 'file.jpg'), 'wb') as f:
+            f.write('another file')
+
+        self.__fail(3)
+        self.assertTrue(os.path.exists(os.path.join(self.quarantine_dir, 'some-uuid-file.jpg')))
+
+    def test_it_should_keep_backing_off_if_a_file_cannot_be_quarantined(self):
+        self.__fail(2)
+        with patch('os.rename', side_effect=OSError('read-only filesystem')):
+            self.__fail()
+
+        self.assertTrue(os.path.exists(self.path_to_file))
+        self.assertEqual(self.test_model.find_failure(self.path_to_file).attempts, 3)
+        self.assertFalse(self.test_model.may_attempt(self.path_to_file))
+
+    def test_it_should_not_record_failures_of_missing_files(self):
+        self.test_model.record_failure('device-id', os.path.join(self.staging_dir, 'missing.jpg'), 'gone')
+        self.assertIsNone(self.test_model.find_failure(os.path.join(self.staging_dir, 'missing.jpg')))
+
+    def test_it_should_forget_failures_of_files_no_longer_in_staging(self):
+        self.__fail()
+        self.test_model.forget_missing('device-id', [self.path_to_file])
+        self.assertIsNotNone(self.test_model.find_failure(self.path_to_file))
+
+        self.test_model.forget_missing('other-device-id', [])
+        self.assertIsNotNone(self.test_model.find_failure(self.path_to_file))
+
+        self.test_model.forget_missing('device-id', [])
+        self.assertIsNone(self.test_model.find_failure(self.path_to_file))
+
+
+if __name__ == '__main__':
+    unittest.main()
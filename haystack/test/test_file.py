@@ -91,6 +91,16 @@ class TestFile(unittest.TestCase):
         self.assertEqual(test_file.date_taken_tag(), 'H264:DateTimeOriginal')
         self.assertEqual(test_file.rotation_tag(), 'Composite:Rotation')
 
+    def test_it_should_read_jpg_metadata_natively(self):
+        self.assertEqual(File('/path/to/file.JPG').native_metadata_reader(), 'jpeg')
+        self.assertEqual(File('/path/to/file.jpeg').native_metadata_reader(), 'jpeg')
+
+    def test_it_should_read_mp4_metadata_natively(self):
+        self.assertEqual(File('/path/to/file.MP4').native_metadata_reader(), 'mp4')
+
+    def test_it_should_not_read_mts_metadata_natively(self):
+        self.assertIsNone(File('/path/to/file.mts').native_metadata_reader())
+
 
 if __name__ == '__main__':
     unittest.main()
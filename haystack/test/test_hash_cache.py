@@ -0,0 +1,131 @@
+import hash_cache
+import hashlib
+import os
+import sqlite3
+import time
+import unittest
+
+from config import Config
+from content_hash import ContentHasher
+from hash_cache import HashCache
+from hash_cache import MAX_AGE_IN_SECONDS
+from hash_cache import TOUCH_INTERVAL_IN_SECONDS
+from mock import MagicMock
+from mock import patch
+from state_database import IN_MEMORY
+from test.temp_dir_test_case import TempDirTestCase
+from util import Util
+
+FILE_CONTENTS = 'not really a video'
+FILE_HASH = hashlib.md5(FILE_CONTENTS).hexdigest()
+
+
+class TestHashCache(TempDirTestCase):
+    def setUp(self):
+        super(TestHashCache, self).setUp()
+        self.path_to_file = os.path.join(self.temp_dir, 'file.mts')
+        with open(self.path_to_file, 'wb') as f:
+            f.write(FILE_CONTENTS)
+
+        self.mock_config = MagicMock(spec=Config)
+        self.mock_util = MagicMock(spec=Util)
+        self.content_hasher = ContentHasher()
+        self.test_model = HashCache(self.mock_config, self.content_hasher, self.mock_util, IN_MEMORY)
+
+    def tearDown(self):
+        self.test_model.close()
+
+    def __last_used(self):
+        return self.test_model.connection.execute('SELECT last_used FROM hashes').fetchone()[0]
+
+    def test_it_should_hash_files_it_has_not_seen(self):
+        self.assertIsNone(self.test_model.find_hash(self.path_to_file))
+        self.assertEqual(self.test_model.hash_file(self.path_to_file), FILE_HASH)
+
+    def test_it_should_not_read_files_again_while_they_are_unchanged(self):
+        self.test_model.hash_file(self.path_to_file)
+        with patch.object(self.content_hasher, 'hash_file') as mock_hash_file:
+            self.assertEqual(self.test_model.hash_file(self.path_to_file), FILE_HASH)
+            self.assertEqual(self.test_model.find_hash(self.path_to_file), FILE_HASH)
+        mock_hash_file.assert_not_called()
+
+    def test_it_should_hash_files_again_when_they_change(self):
+        self.test_model.hash_file(self.path_to_file)
+        with open(self.path_to_file, 'ab') as f:
+            f.write('!')
+
+        self.assertIsNone(self.test_model.find_hash(self.path_to_file))
+        self.assertEqual(self.test_model.hash_file(self.path_to_file), hashlib.md5(FILE_CONTENTS + '!').hexdigest())
+
+    def test_it_should_hash_files_again_when_only_their_modification_time_changes(self):
+        self.test_model.hash_file(self.path_to_file)
+        os.utime(self.path_to_file, (1449176000, 1449176000))
+        self.assertIsNone(self.test_model.find_hash(self.path_to_file))
+
+    def test_it_should_remember_hashes_computed_elsewhere(self):
+        self.test_model.remember(self.path_to_file, 'some-hash')
+        self.assertEqual(self.test_model.find_hash(self.path_to_file), 'some-hash')
+
+    def test_it_should_not_remember_hashes_of_missing_files(self):
+        self.test_model.remember(os.path.join(self.temp_dir, 'missing.mts'), 'some-hash')
+        self.assertIsNone(self.test_model.find_hash(os.path.join(self.temp_dir, 'missing.mts')))
+
+    def test_it_should_forget_the_hashes_of_files(self):
+        self.test_model.hash_file(self.path_to_file)
+        self.test_model.label = 'md5-tree16m-'
+        self.test_model.remember(self.path_to_file, 'some-hash')
+
+        self.test_model.forget(self.path_to_file)
+        self.assertIsNone(self.test_model.find_hash(self.path_to_file))
+        self.test_model.label = self.content_hasher.prefix
+        self.assertIsNone(self.test_model.find_hash(self.path_to_file))
+
+    def test_it_should_ignore_missing_files_when_forgetting(self):
+        self.test_model.forget(os.path.join(self.temp_dir, 'missing.mts'))
+
+    def test_it_should_keep_hashes_from_different_algorithms_apart(self):
+        self.test_model.hash_file(self.path_to_file)
+        self.test_model.label = 'md5-tree16m-'
+        self.assertIsNone(self.test_model.find_hash(self.path_to_file))
+
+    def test_it_should_not_record_every_use_of_a_hash(self):
+        now = time.time()
+        with patch('time.time', return_value=now):
+            self.test_model.hash_file(self.path_to_file)
+
+        with patch('time.time', return_value=now + TOUCH_INTERVAL_IN_SECONDS):
+            self.test_model.find_hash(self.path_to_file)
+
+        self.assertEqual(self.__last_used(), int(now))
+
+    def test_it_should_record_the_use_of_a_hash_that_has_not_been_used_in_a_day(self):
+        now = time.time()
+        with patch('time.time', return_value=now):
+            self.test_model.hash_file(self.path_to_file)
+
+        with patch('time.time', return_value=now + TOUCH_INTERVAL_IN_SECONDS + 1):
+            self.test_model.find_hash(self.path_to_file)
+
+        self.assertEqual(self.__last_used(), int(now + TOUCH_INTERVAL_IN_SECONDS + 1))
+
+    def test_it_should_evict_hashes_that_have_not_been_used_in_a_long_time(self):
+        path_to_database = os.path.join(self.temp_dir, 'state.db')
+        self.mock_config.state_database_path.return_value = path_to_database
+        now = time.time()
+        with patch('time.time', return_value=now - MAX_AGE_IN_SECONDS - 1):
+            test_model = HashCache(self.mock_config, self.content_hasher, self.mock_util)
+            test_model.hash_file(self.path_to_file)
+            test_model.close()
+
+        HashCache(self.mock_config, self.content_hasher, self.mock_util).close()
+        connection = sqlite3.connect(path_to_database)
+        self.assertEqual(connection.execute('SELECT COUNT(*) FROM hashes').fetchone(), (0,))
+        connection.close()
+        self.mock_util.mkdirp.assert_called_with(self.temp_dir)
+
+    def test_it_should_use_the_whole_modification_time(self):
+        self.assertEqual(hash_cache.get_mtime_ns(MagicMock(st_mtime=1449176000.123456)), 1449176000123456000)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,3 +1,4 @@
+import index
 import unittest
 
 from config import Config
@@ -73,6 +74,42 @@ class TestIndex(unittest.TestCase):
 
         self.mock_ref.post.assert_called_once_with('/media', expected_data, params=expected_params)
 
+    def test_it_should_use_a_firebase_url_if_one_is_given(self):
+        self.test_model = Index(self.mock_config, 'http://localhost:8080')
+        self.mock_firebase.FirebaseApplication.assert_called_once_with('http://localhost:8080', None)
+
+    def test_it_should_key_batches_of_media_by_push_id_in_a_single_patch(self):
+        self.__init_test()
+        one = {'hash': 'hash-1', 'dateIndexed': 1449176000, 'pathToMedia': 'one.jpg'}
+        two = {'hash': 'hash-2', 'dateIndexed': 1449176001, 'pathToMedia': 'two.jpg'}
+        self.test_model.index_media_batch([one, two])
+
+        expected_data = {
+            index.generate_push_id(1449176000, 'hash-1'): one,
+            index.generate_push_id(1449176001, 'hash-2'): two
+        }
+
+        self.mock_ref.patch.assert_called_once_with('/media', expected_data, params={'auth': MOCK_AUTH_TOKEN})
+
+    def test_it_should_generate_push_ids_like_firebase(self):
+        self.assertEqual(index.generate_push_id(0, 'hash-1')[:8], '--------')
+        self.assertEqual(len(index.generate_push_id(1449176000, 'hash-1')), 20)
+        self.assertTrue(all(c in index.PUSH_CHARS for c in index.generate_push_id(1449176000, 'hash-1')))
+
+    def test_it_should_generate_the_same_push_id_for_the_same_media(self):
+        self.assertEqual(index.generate_push_id(1449176000, 'hash-1'), index.generate_push_id(1449176000, 'hash-1'))
+        self.assertNotEqual(index.generate_push_id(1449176000, 'hash-1'), index.generate_push_id(1449176000, 'hash-2'))
+
+    def test_it_should_generate_push_ids_that_sort_by_date_indexed(self):
+        self.assertLess(index.generate_push_id(1449176000, 'hash-2'), index.generate_push_id(1449176001, 'hash-1'))
+        self.assertLess(index.generate_push_id(1449176000, 'hash-1'), index.generate_push_id(1449180000, 'hash-1'))
+
+    def test_it_should_raise_an_error_if_firebase_rejects_a_batch(self):
+        self.mock_ref.patch.return_value = {'error': 'Permission denied.'}
+        self.__init_test()
+        with self.assertRaises(RuntimeError):
+            self.test_model.index_media_batch([{'hash': 'hash-1', 'dateIndexed': 1449176000}])
+
     def test_it_should_use_the_right_values_when_checking_for_duplicates(self):
         self.__init_test()
         self.test_model.is_duplicate('dont-care')
@@ -0,0 +1,151 @@
+import BaseHTTPServer
+import json
+import threading
+import time
+import unittest
+
+from config import Config
+from index import Index
+from index_flusher import IndexFlusher
+from local_index import LocalIndex
+from mock import Mock
+
+WAIT_TIMEOUT_IN_SECONDS = 5
+
+
+# A local stand-in for the Firebase REST API. PATCH bodies are recorded, and the first `failures` requests get a 500.
+class FakeFirebaseHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_PATCH(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        server = self.server
+        if server.failures > 0:
+            server.failures -= 1
+            self.send_response(500)
+            self.end_headers()
+            return
+
+        server.requests.append((self.path, body))
+        for key, value in body.items():
+            server.media[key] = value
+
+        response = json.dumps(body)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, *args):
+        return
+
+
+class TestIndexFlusher(unittest.TestCase):
+    def setUp(self):
+        self.server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), FakeFirebaseHandler)
+        self.server.failures = 0
+        self.server.requests = []
+        self.server.media = {}
+        self.server_thread = threading.Thread(target=self.server.serve_forever)
+        self.server_thread.daemon = True
+        self.server_thread.start()
+
+        self.mock_config = Mock(spec=Config)
+        self.mock_config.firebase_sync_enabled.return_value = False
+        self.mock_config.firebase_secret.return_value = 'fake-auth-token'
+        self.mock_config.haystack_root.return_value = '/root'
+
+        # python-firebase only accepts https URLs, so point it at the stand-in after it's been created.
+        self.index = Index(self.mock_config, 'https://localhost')
+        self.index.fb_ref.dsn = 'http://127.0.0.1:{0}'.format(self.server.server_address[1])
+
+    def tearDown(self):
+        self.local_index.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __init_test(self, flush_interval=60):
+        self.local_index = LocalIndex(self.mock_config, self.index, path_to_database=':memory:',
+                                      flusher=Mock(spec=IndexFlusher))
+        self.test_model = IndexFlusher(self.local_index, flush_interval=flush_interval, min_backoff=0.05)
+        self.local_index.flusher = self.test_model
+        self.test_model.start()
+
+    def __add_media(self, hash):
+        self.local_index.index_media('pictures/' + hash + '.jpg', None, 1346060000, 'USB', hash, 'JPG')
+
+    def __was_flushed(self, hash):
+        return any(media['hash'] == hash for media in self.server.media.values())
+
+    def __wait_for(self, condition):
+        deadline = time.time() + WAIT_TIMEOUT_IN_SECONDS
+        while not condition() and time.time() < deadline:
+            time.sleep(0.01)
+
+        self.assertTrue(condition())
+
+    def test_it_should_send_new_media_downstream_without_waiting_for_the_flush_interval(self):
+        self.__init_test()
+        self.__add_media('hash-1')
+        self.__wait_for(lambda: self.__was_flushed('hash-1'))
+
+    def test_it_should_send_media_to_the_media_node_with_the_auth_token(self):
+        self.__init_test()
+        self.__add_media('hash-1')
+        self.__wait_for(lambda: self.server.requests)
+        self.assertEqual(self.server.requests[0][0], '/media/.json?auth=fake-auth-token')
+
+    def test_it_should_retry_after_a_failure(self):
+        self.server.failures = 2
+        self.__init_test()
+        self.__add_media('hash-1')
+        self.__wait_for(lambda: self.__was_flushed('hash-1') and self.test_model.backoff is None)
+
+    def test_it_should_back_off_exponentially_while_firebase_is_failing(self):
+        self.server.failures = 1000
+        self.__init_test()
+        self.__add_media('hash-1')
+        self.__wait_for(lambda: self.test_model.backoff is not None and self.test_model.backoff >= 0.2)
+
+    def test_it_should_flush_media_that_was_left_over_from_a_previous_run(self):
+        self.local_index = LocalIndex(self.mock_config, self.index, path_to_database=':memory:',
+                                      flusher=Mock(spec=IndexFlusher))
+        self.__add_media('left-over')
+        self.test_model = IndexFlusher(self.local_index, flush_interval=0.05)
+        self.local_index.flusher = self.test_model
+        self.test_model.start()
+        self.__wait_for(lambda: self.__was_flushed('left-over'))
+
+    def test_it_should_flush_pending_media_when_stopped(self):
+        self.server.failures = 1
+        self.__init_test()
+        self.__add_media('hash-1')
+        self.__wait_for(lambda: self.test_model.backoff is not None)
+        self.test_model.stop()
+        self.assertTrue(self.__was_flushed('hash-1'))
+
+    def test_it_should_flush_pending_media_when_stopped_during_a_failing_flush(self):
+        self.server.failures = 1
+        self.__init_test()
+        sync_downstream = self.local_index.sync_downstream
+
+        def stop_then_sync():
+            self.test_model.stopped.set()
+            sync_downstream()
+
+        self.local_index.sync_downstream = stop_then_sync
+        thread = self.test_model.thread
+        self.__add_media('hash-1')
+        thread.join(WAIT_TIMEOUT_IN_SECONDS)
+        self.assertFalse(thread.is_alive())
+        self.assertTrue(self.__was_flushed('hash-1'))
+
+    def test_it_should_flush_again_after_being_restarted(self):
+        self.__init_test()
+        self.test_model.stop()
+        self.test_model.start()
+        self.__add_media('hash-1')
+        self.__wait_for(lambda: self.__was_flushed('hash-1'))
+
+
+if __name__ == '__main__':
+    unittest.main()
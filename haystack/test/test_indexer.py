@@ -1,9 +1,28 @@
+import hashlib
+import logging
+import multiprocessing
+import multiprocessing.dummy
+import os
+import pickle
+import sys
 import unittest
 
 from config import Config
+from content_hash import UnreadableFileError
+from duplicate_detector import DuplicateDetector
+from failure_tracker import FailureTracker
 from file import File
-from index import Index
+from hash_cache import HashCache
+from indexer import hash_and_date_staged_file
 from indexer import Indexer
+from indexer import init_indexer_worker
+from indexer import LogRecordCollector
+from indexer import RunSummary
+from indexer import worker_log_records
+from local_index import LocalIndex
+from media_placer import MediaPlacer
+from media_placer import Placement
+from metadata_helper import DateTakenError
 from metadata_helper import MetadataHelper
 from mock import ANY
 from mock import MagicMock
@@ -11,12 +30,14 @@ from mock import Mock
 from mock import mock_open
 from mock import patch
 from preprocessor import Preprocessor
+from test.temp_dir_test_case import TempDirTestCase
 from thumbnail_generator import ThumbnailGenerator
 from util import Util
 from video_converter import VideoConverter
 
 LISTDIR_MAPPING = {}
 ISDIR_MAPPING = {}
+FAKE_FILE_HASH = hashlib.md5('fake-file-contents').hexdigest()
 
 
 def mock_listdir(*args):
@@ -37,6 +58,10 @@ def mock_staging_dir(*args):
     return '/root/staging/{0}'.format(args[0])
 
 
+def mock_get_dates_taken(paths_to_files):
+    return dict((p, 1449176000) for p in paths_to_files)
+
+
 class TestIndexer(unittest.TestCase):
     def __reset_listdir_mapping(self):
         LISTDIR_MAPPING[('/root/staging',)] = ['device-serial-1']
@@ -60,10 +85,7 @@ class TestIndexer(unittest.TestCase):
         self.mock_isdir = self.mock_isdir_patcher.start()
         self.mock_isdir.side_effect = mock_isdir
 
-        self.mock_copy_patcher = patch('shutil.copy')
-        self.mock_copy = self.mock_copy_patcher.start()
-
-        self.mock_open_patcher = patch('indexer.open')
+        self.mock_open_patcher = patch('content_hash.open')
         self.mock_open = self.mock_open_patcher.start()
 
         # http://stackoverflow.com/questions/24779893/customizing-unittest-mock-mock-open-for-iteration
@@ -79,11 +101,16 @@ class TestIndexer(unittest.TestCase):
         self.mock_config.picture_path_pattern.return_value = '/root/pictures/%Y/%M/%D'
         self.mock_config.video_path_pattern.return_value = '/root/videos/%Y/%M/%D'
         self.mock_config.staging_directory.side_effect = mock_staging_dir
+        self.mock_config.indexer_workers.return_value = 1
+        self.mock_config.hash_algorithm.return_value = 'md5'
+        self.mock_config.tree_hash.return_value = False
+        self.mock_config.hash_threads.return_value = 1
 
         self.mock_metadata_helper = Mock(spec=MetadataHelper)
         self.mock_metadata_helper.get_date_taken.return_value = 1449176000
+        self.mock_metadata_helper.get_dates_taken.side_effect = mock_get_dates_taken
 
-        self.mock_index = Mock(spec=Index)
+        self.mock_index = Mock(spec=LocalIndex)
         self.mock_index.is_duplicate.return_value = False
 
         self.mock_thumbnail_generator = Mock(spec=ThumbnailGenerator)
@@ -94,9 +121,29 @@ class TestIndexer(unittest.TestCase):
 
         self.mock_preprocessor = MagicMock(spec=Preprocessor)
 
+        self.mock_placement = Mock(spec=Placement)
+        self.mock_placement.file_hash = '6c8abb37a65a74b526d456927a19549d'
+        self.mock_placement.moved_staged_file = False
+
+        self.mock_media_placer = Mock(spec=MediaPlacer)
+        self.mock_media_placer.stage.return_value = self.mock_placement
+
+        self.mock_duplicate_detector = Mock(spec=DuplicateDetector)
+        self.mock_duplicate_detector.may_be_duplicate.return_value = False
+        self.mock_duplicate_detector.matches_other_hash_algorithms.return_value = False
+
+        self.mock_hash_cache = Mock(spec=HashCache)
+        self.mock_hash_cache.find_hash.return_value = None
+        self.mock_hash_cache.hash_file.return_value = FAKE_FILE_HASH
+
+        self.mock_failure_tracker = Mock(spec=FailureTracker)
+        self.mock_failure_tracker.may_attempt.return_value = True
+
         self.test_model = Indexer(self.mock_config, self.mock_index, self.mock_metadata_helper,
                                   self.mock_thumbnail_generator, self.mock_util, self.mock_video_converter,
-                                  self.mock_preprocessor)
+                                  self.mock_preprocessor, media_placer=self.mock_media_placer,
+                                  duplicate_detector=self.mock_duplicate_detector, hash_cache=self.mock_hash_cache,
+                                  failure_tracker=self.mock_failure_tracker)
 
     def __run_mp4_test(self):
         LISTDIR_MAPPING[('/root/staging/device-serial-1',)] = ['file.mp4']
@@ -109,7 +156,6 @@ class TestIndexer(unittest.TestCase):
     def tearDown(self):
         self.mock_listdir_patcher.stop()
         self.mock_isdir_patcher.stop()
-        self.mock_copy_patcher.stop()
         self.mock_open_patcher.stop()
         self.mock_remove_patcher.stop()
 
@@ -142,14 +188,41 @@ class TestIndexer(unittest.TestCase):
         self.test_model.run()
         self.mock_util.mkdirp.assert_called_once_with('/root/pictures/2015/12/3')
 
-    def test_it_should_copy_media_from_the_staging_location_to_the_final_location(self):
+    def test_it_should_stage_media_for_placement_in_the_final_directory(self):
+        self.test_model.run()
+        self.mock_media_placer.stage.assert_called_once_with('/root/staging/device-serial-1/file.jpg',
+                                                             '/root/pictures/2015/12/3', None)
+
+    def test_it_should_place_media_at_the_final_location(self):
+        self.test_model.run()
+        self.mock_placement.commit.assert_called_once_with(
+            '/root/pictures/2015/12/3/6c8abb37a65a74b526d456927a19549d.jpg')
+
+    def test_it_should_not_remove_staged_media_that_was_moved_into_place(self):
+        self.mock_placement.moved_staged_file = True
+        self.test_model.run()
+        self.mock_remove.assert_not_called()
+
+    def test_it_should_undo_the_placement_if_media_cannot_be_indexed(self):
+        self.mock_index.index_media.side_effect = RuntimeError('index is locked')
+        self.test_model.run()
+        self.mock_placement.discard.assert_called_once_with()
+        self.mock_remove.assert_not_called()
+
+    def test_it_should_undo_the_placement_if_media_cannot_be_placed(self):
+        self.mock_placement.commit.side_effect = OSError('disk is full')
+        self.test_model.run()
+        self.mock_placement.discard.assert_called_once_with()
+        self.mock_index.index_media.assert_not_called()
+
+    def test_it_should_not_record_a_failure_if_the_placement_cannot_be_undone(self):
+        self.mock_index.index_media.side_effect = RuntimeError('index is locked')
+        self.mock_placement.discard.side_effect = OSError('disk is read-only')
         self.test_model.run()
-        self.mock_copy.assert_called_once_with('/root/staging/device-serial-1/file.jpg',
-                                               '/root/pictures/2015/12/3/6c8abb37a65a74b526d456927a19549d.jpg')
+        self.mock_failure_tracker.record_failure.assert_not_called()
 
     # The indexed paths are relative to the root because that is where the file server will run from.
     # It would be _bad_ to have a file server running at '/', instead of somewhere lower.
-    @unittest.skip("disabling advanced functionality")
     def test_it_should_index_media_with_the_right_final_path(self):
         expected_path_to_file = 'pictures/2015/12/3/6c8abb37a65a74b526d456927a19549d.jpg'
         self.test_model.run()
@@ -161,31 +234,340 @@ class TestIndexer(unittest.TestCase):
         self.test_model.run()
         self.mock_index.index_media.assert_called_once_with(ANY, expected_path_to_thumbnail, ANY, ANY, ANY, ANY)
 
-    @unittest.skip("disabling advanced functionality")
     def test_it_should_index_media_with_the_right_date_taken(self):
         self.test_model.run()
         self.mock_index.index_media.assert_called_once_with(ANY, ANY, 1449176000, ANY, ANY, ANY)
 
-    @unittest.skip("disabling advanced functionality")
     def test_it_should_index_media_with_the_right_device_id(self):
         self.test_model.run()
         self.mock_index.index_media.assert_called_once_with(ANY, ANY, ANY, 'device-serial-1', ANY, ANY)
 
-    @unittest.skip("disabling advanced functionality")
     def test_it_should_index_media_with_the_right_hash(self):
         self.test_model.run()
         self.mock_index.index_media.assert_called_once_with(ANY, ANY, ANY, ANY, '6c8abb37a65a74b526d456927a19549d', ANY)
 
-    @unittest.skip("disabling advanced functionality")
     def test_it_should_index_media_with_the_right_media_type(self):
         self.test_model.run()
         self.mock_index.index_media.assert_called_once_with(ANY, ANY, ANY, ANY, ANY, 'JPG')
 
+    def test_it_should_prefetch_dates_taken_for_all_media_in_the_staging_directory(self):
+        LISTDIR_MAPPING[('/root/staging/device-serial-1',)] = ['file.jpg', 'file.mp4', '.fuse_hiddenxxxx']
+        self.test_model.run()
+        self.mock_metadata_helper.get_dates_taken.assert_called_once_with(['/root/staging/device-serial-1/file.jpg',
+                                                                           '/root/staging/device-serial-1/file.mp4'])
+        self.mock_metadata_helper.get_date_taken.assert_not_called()
+
+    def test_it_should_prefetch_dates_taken_in_chunks(self):
+        LISTDIR_MAPPING[('/root/staging/device-serial-1',)] = ['file{0}.jpg'.format(i) for i in range(250)]
+        self.test_model.run()
+        self.assertEqual(self.mock_metadata_helper.get_dates_taken.call_count, 3)
+
+    def test_it_should_not_move_a_file_whose_prefetched_date_is_an_error(self):
+        self.mock_metadata_helper.get_dates_taken.side_effect = \
+            lambda paths: dict((p, RuntimeError('missing tag')) for p in paths)
+        self.test_model.run()
+        self.mock_placement.commit.assert_not_called()
+        self.mock_remove.assert_not_called()
+
+    def test_it_should_read_dates_one_at_a_time_if_the_prefetch_fails(self):
+        self.mock_metadata_helper.get_dates_taken.side_effect = RuntimeError
+        self.test_model.run()
+        self.mock_metadata_helper.get_date_taken.assert_called_once_with('/root/staging/device-serial-1/file.jpg')
+        self.mock_remove.assert_called_once_with('/root/staging/device-serial-1/file.jpg')
+
+    def test_it_should_summarize_what_it_indexed(self):
+        LISTDIR_MAPPING[('/root/staging/device-serial-1',)] = ['bad.jpg', 'file.jpg', 'file.mp4']
+        self.mock_metadata_helper.get_dates_taken.side_effect = \
+            lambda paths: dict((p, RuntimeError('missing tag') if 'bad' in p else 1449176000) for p in paths)
+        self.assertEqual(self.test_model.run(), RunSummary(3, 2, False))
+
+    def test_it_should_count_duplicates_as_indexed(self):
+        self.mock_index.is_duplicate.return_value = True
+        self.assertEqual(self.test_model.run(), RunSummary(1, 1, False))
+
+    def test_it_should_stop_after_the_maximum_number_of_files(self):
+        LISTDIR_MAPPING[('/root/staging',)] = ['device-serial-1', 'device-serial-2']
+        LISTDIR_MAPPING[('/root/staging/device-serial-1',)] = ['file1.jpg', 'file2.jpg']
+        LISTDIR_MAPPING[('/root/staging/device-serial-2',)] = ['file3.jpg']
+        ISDIR_MAPPING[('/root/staging/device-serial-2',)] = True
+
+        self.assertEqual(self.test_model.run(1), RunSummary(1, 1, True))
+        self.mock_media_placer.stage.assert_called_once_with('/root/staging/device-serial-1/file1.jpg', ANY, None)
+
+    def test_it_should_carry_the_maximum_number_of_files_across_devices(self):
+        LISTDIR_MAPPING[('/root/staging',)] = ['device-serial-1', 'device-serial-2']
+        LISTDIR_MAPPING[('/root/staging/device-serial-1',)] = ['file1.jpg', 'file2.jpg']
+        LISTDIR_MAPPING[('/root/staging/device-serial-2',)] = ['file3.jpg', 'file4.jpg']
+        ISDIR_MAPPING[('/root/staging/device-serial-2',)] = True
+
+        self.assertEqual(self.test_model.run(3), RunSummary(3, 3, True))
+        self.mock_media_placer.stage.assert_called_with('/root/staging/device-serial-2/file3.jpg', ANY, None)
+
+    def test_it_should_not_report_reaching_the_maximum_with_fewer_files(self):
+        self.assertEqual(self.test_model.run(2), RunSummary(1, 1, False))
+
+    def test_it_should_index_the_given_staged_files(self):
+        paths = ['/root/staging/device-serial-1/a.jpg', '/root/staging/device-serial-1/b.jpg']
+        self.assertEqual(self.test_model.index_files('device-serial-1', paths), 2)
+        self.mock_metadata_helper.get_dates_taken.assert_called_once_with(paths)
+        self.assertEqual(self.mock_index.index_media.call_count, 2)
+
+    def test_it_should_check_the_index_for_duplicates(self):
+        self.test_model.run()
+        self.mock_index.is_duplicate.assert_called_once_with('6c8abb37a65a74b526d456927a19549d')
+
+    def test_it_should_delete_duplicates_without_copying_or_indexing_them(self):
+        self.mock_index.is_duplicate.return_value = True
+        self.test_model.run()
+        self.mock_remove.assert_called_once_with('/root/staging/device-serial-1/file.jpg')
+        self.mock_placement.commit.assert_not_called()
+        self.mock_index.index_media.assert_not_called()
+
+    def test_it_should_not_hash_files_up_front_that_cannot_be_duplicates(self):
+        self.test_model.run()
+        self.mock_duplicate_detector.may_be_duplicate.assert_called_once_with('/root/staging/device-serial-1/file.jpg')
+        self.mock_media_placer.stage.assert_called_once_with('/root/staging/device-serial-1/file.jpg', ANY, None)
+
+    def test_it_should_hash_files_up_front_that_may_be_duplicates(self):
+        self.mock_duplicate_detector.may_be_duplicate.return_value = True
+        self.test_model.run()
+        self.mock_index.is_duplicate.assert_any_call(FAKE_FILE_HASH)
+        self.mock_media_placer.stage.assert_called_once_with('/root/staging/device-serial-1/file.jpg', ANY,
+                                                             FAKE_FILE_HASH)
+
+    def test_it_should_delete_likely_duplicates_without_staging_them(self):
+        self.mock_duplicate_detector.may_be_duplicate.return_value = True
+        self.mock_index.is_duplicate.return_value = True
+        self.test_model.run()
+        self.mock_remove.assert_called_once_with('/root/staging/device-serial-1/file.jpg')
+        self.mock_media_placer.stage.assert_not_called()
+
+    def test_it_should_use_cached_hashes_of_staged_files(self):
+        self.mock_hash_cache.find_hash.return_value = 'cached-hash'
+        self.test_model.run()
+        self.mock_hash_cache.find_hash.assert_called_once_with('/root/staging/device-serial-1/file.jpg')
+        self.mock_duplicate_detector.may_be_duplicate.assert_not_called()
+        self.mock_media_placer.stage.assert_called_once_with('/root/staging/device-serial-1/file.jpg', ANY,
+                                                             'cached-hash')
+
+    def test_it_should_hash_files_that_may_be_duplicates_through_the_hash_cache(self):
+        self.mock_duplicate_detector.may_be_duplicate.return_value = True
+        self.test_model.run()
+        self.mock_hash_cache.hash_file.assert_called_once_with('/root/staging/device-serial-1/file.jpg')
+
+    def test_it_should_remember_the_hashes_of_staged_files(self):
+        self.test_model.run()
+        self.mock_hash_cache.remember.assert_called_once_with('/root/staging/device-serial-1/file.jpg',
+                                                              '6c8abb37a65a74b526d456927a19549d')
+
+    def test_it_should_forget_the_hashes_of_files_it_removes(self):
+        self.test_model.run()
+        self.mock_hash_cache.forget.assert_called_once_with('/root/staging/device-serial-1/file.jpg')
+        self.mock_remove.assert_called_once_with('/root/staging/device-serial-1/file.jpg')
+
+    def test_it_should_forget_the_hashes_of_staged_files_that_were_moved_into_place(self):
+        self.mock_placement.moved_staged_file = True
+        self.test_model.run()
+        self.mock_hash_cache.forget.assert_called_once_with(
+            '/root/pictures/2015/12/3/6c8abb37a65a74b526d456927a19549d.jpg')
+
+    def test_it_should_remove_files_that_match_media_indexed_with_another_hash_algorithm(self):
+        self.mock_duplicate_detector.matches_other_hash_algorithms.return_value = True
+        self.test_model.run()
+        self.mock_duplicate_detector.matches_other_hash_algorithms.assert_called_once_with(
+            '/root/staging/device-serial-1/file.jpg', '6c8abb37a65a74b526d456927a19549d')
+        self.mock_index.index_media.assert_not_called()
+        self.mock_remove.assert_called_once_with('/root/staging/device-serial-1/file.jpg')
+
+    def test_it_should_only_look_for_duplicates_once_if_the_hash_is_known_before_placing_the_file(self):
+        self.mock_duplicate_detector.may_be_duplicate.return_value = True
+        self.test_model.run()
+        self.mock_index.is_duplicate.assert_called_once_with(FAKE_FILE_HASH)
+        self.mock_duplicate_detector.matches_other_hash_algorithms.assert_called_once_with(
+            '/root/staging/device-serial-1/file.jpg', FAKE_FILE_HASH)
+
+    def test_it_should_forget_the_hashes_of_duplicates_it_removes(self):
+        self.mock_index.is_duplicate.return_value = True
+        self.test_model.run()
+        self.mock_hash_cache.forget.assert_called_once_with('/root/staging/device-serial-1/file.jpg')
+
+    def test_it_should_record_files_that_fail_to_index(self):
+        self.mock_metadata_helper.get_dates_taken.side_effect = \
+            lambda paths: dict((p, DateTakenError('missing tag')) for p in paths)
+        self.test_model.run()
+        self.mock_failure_tracker.record_failure.assert_called_once_with(
+            'device-serial-1', '/root/staging/device-serial-1/file.jpg', ANY)
+        self.assertEqual(str(self.mock_failure_tracker.record_failure.call_args[0][2]), 'missing tag')
+
+    def test_it_should_record_files_that_cannot_be_read(self):
+        self.mock_duplicate_detector.may_be_duplicate.return_value = True
+        self.mock_hash_cache.hash_file.side_effect = UnreadableFileError(5, 'Input/output error', 'file.jpg')
+        self.test_model.run()
+        self.mock_failure_tracker.record_failure.assert_called_once_with(
+            'device-serial-1', '/root/staging/device-serial-1/file.jpg', ANY)
+
+    def test_it_should_not_count_failures_to_place_media_against_the_file(self):
+        self.mock_media_placer.stage.side_effect = OSError('destination is not mounted')
+        self.test_model.run()
+        self.mock_failure_tracker.record_failure.assert_not_called()
+
+    def test_it_should_not_count_failures_to_write_to_the_index_against_the_file(self):
+        self.mock_index.index_media.side_effect = IOError('disk I/O error')
+        self.test_model.run()
+        self.mock_failure_tracker.record_failure.assert_not_called()
+
+    def test_it_should_not_count_exiftool_failures_against_the_file(self):
+        self.mock_metadata_helper.get_dates_taken.side_effect = RuntimeError('exiftool request timed out!')
+        self.mock_metadata_helper.get_date_taken.side_effect = RuntimeError('exiftool request timed out!')
+        self.test_model.run()
+        self.mock_failure_tracker.record_failure.assert_not_called()
+
+    def test_it_should_not_record_files_that_are_indexed(self):
+        self.test_model.run()
+        self.mock_failure_tracker.record_failure.assert_not_called()
+
+    def test_it_should_skip_files_that_failed_recently_without_counting_them(self):
+        LISTDIR_MAPPING[('/root/staging/device-serial-1',)] = ['bad.jpg', 'file.jpg']
+        self.mock_failure_tracker.may_attempt.side_effect = lambda path: 'bad' not in path
+
+        self.assertEqual(self.test_model.run(1), RunSummary(1, 1, True))
+        self.mock_metadata_helper.get_dates_taken.assert_called_once_with(['/root/staging/device-serial-1/file.jpg'])
+        self.mock_failure_tracker.forget_missing.assert_called_once_with(
+            'device-serial-1', ['/root/staging/device-serial-1/bad.jpg', '/root/staging/device-serial-1/file.jpg'])
+
+    def __init_parallel_test(self):
+        self.pool = multiprocessing.dummy.Pool(2, initializer=init_indexer_worker)
+        self.test_model = Indexer(self.mock_config, self.mock_index, self.mock_metadata_helper,
+                                  self.mock_thumbnail_generator, self.mock_util, self.mock_video_converter,
+                                  self.mock_preprocessor, pool=self.pool,
+                                  media_placer=self.mock_media_placer, duplicate_detector=self.mock_duplicate_detector,
+                                  hash_cache=self.mock_hash_cache, failure_tracker=self.mock_failure_tracker)
+
+    def test_it_should_not_use_a_worker_pool_with_one_worker(self):
+        self.assertIsNone(self.test_model.pool)
+
+    @patch('indexer.multiprocessing.Pool')
+    def test_it_should_start_a_worker_pool_with_the_configured_number_of_workers(self, mock_pool_class):
+        self.mock_config.indexer_workers.return_value = 4
+        Indexer(self.mock_config, self.mock_index, self.mock_metadata_helper, self.mock_thumbnail_generator,
+                self.mock_util, self.mock_video_converter, self.mock_preprocessor, media_placer=self.mock_media_placer,
+                duplicate_detector=self.mock_duplicate_detector, hash_cache=self.mock_hash_cache,
+                failure_tracker=self.mock_failure_tracker)
+        mock_pool_class.assert_called_once_with(4, initializer=init_indexer_worker, initargs=(ANY,))
+
+    def test_it_should_copy_and_index_media_when_running_in_parallel(self):
+        self.__init_parallel_test()
+        LISTDIR_MAPPING[('/root/staging/device-serial-1',)] = ['file.jpg', 'file.mp4']
+        self.test_model.run()
+        self.test_model.close()
+
+        self.assertEqual(self.mock_placement.commit.call_count, 2)
+        self.mock_index.index_media.assert_any_call('pictures/2015/12/3/6c8abb37a65a74b526d456927a19549d.jpg', ANY,
+                                                    1449176000, 'device-serial-1',
+                                                    '6c8abb37a65a74b526d456927a19549d', 'JPG')
+        self.assertEqual(self.mock_remove.call_count, 2)
+
+    def test_it_should_hash_files_in_worker_processes(self):
+        self.__init_parallel_test()
+        self.test_model.run()
+        self.test_model.close()
+
+        self.mock_media_placer.stage.assert_called_once_with('/root/staging/device-serial-1/file.jpg', ANY,
+                                                             FAKE_FILE_HASH)
+        self.mock_hash_cache.remember.assert_any_call('/root/staging/device-serial-1/file.jpg', FAKE_FILE_HASH)
+        # The hash was already looked up before placing the file, so it isn't looked up again.
+        self.mock_index.is_duplicate.assert_called_once_with(FAKE_FILE_HASH)
+
+    def test_it_should_look_up_hashes_from_worker_processes_without_sampling_files(self):
+        self.__init_parallel_test()
+        self.mock_index.is_duplicate.return_value = True
+        self.test_model.run()
+        self.test_model.close()
+
+        self.mock_index.is_duplicate.assert_called_once_with(FAKE_FILE_HASH)
+        self.mock_duplicate_detector.may_be_duplicate.assert_not_called()
+        self.mock_media_placer.stage.assert_not_called()
+        self.mock_remove.assert_called_once_with('/root/staging/device-serial-1/file.jpg')
+
+    # Even if the file fails to index, so that it isn't hashed again when it's retried.
+    def test_it_should_remember_hashes_from_worker_processes(self):
+        self.__init_parallel_test()
+        self.mock_duplicate_detector.may_be_duplicate.return_value = True
+        self.mock_metadata_helper.get_dates_taken.side_effect = \
+            lambda paths: dict((p, RuntimeError('missing tag')) for p in paths)
+        self.test_model.run()
+        self.test_model.close()
+
+        self.mock_hash_cache.remember.assert_called_once_with('/root/staging/device-serial-1/file.jpg',
+                                                              FAKE_FILE_HASH)
+
+    def test_it_should_not_hash_files_with_cached_hashes_in_worker_processes(self):
+        self.__init_parallel_test()
+        self.mock_hash_cache.find_hash.return_value = 'cached-hash'
+        self.mock_duplicate_detector.may_be_duplicate.return_value = True
+        self.test_model.run()
+        self.test_model.close()
+
+        # Only the hash of the staged file is remembered, not one from a worker.
+        self.mock_hash_cache.remember.assert_called_once_with('/root/staging/device-serial-1/file.jpg',
+                                                              '6c8abb37a65a74b526d456927a19549d')
+        self.mock_media_placer.stage.assert_called_once_with('/root/staging/device-serial-1/file.jpg', ANY,
+                                                             'cached-hash')
+
+    def test_it_should_not_hash_files_without_a_date_in_worker_processes(self):
+        self.__init_parallel_test()
+        LISTDIR_MAPPING[('/root/staging/device-serial-1',)] = ['bad.jpg', 'file.jpg']
+        self.mock_metadata_helper.get_dates_taken.side_effect = \
+            lambda paths: dict((p, DateTakenError('missing tag') if 'bad' in p else 1449176000) for p in paths)
+        with patch('indexer.hash_and_date_staged_file', side_effect=hash_and_date_staged_file) as mock_task:
+            self.test_model.run()
+        self.test_model.close()
+
+        mock_task.assert_called_once_with(('/root/staging/device-serial-1/file.jpg', 1449176000, True))
+        self.mock_failure_tracker.record_failure.assert_called_once_with(
+            'device-serial-1', '/root/staging/device-serial-1/bad.jpg', ANY)
+        self.mock_remove.assert_called_once_with('/root/staging/device-serial-1/file.jpg')
+
+    def test_it_should_keep_errors_isolated_to_a_single_file_when_running_in_parallel(self):
+        self.__init_parallel_test()
+        LISTDIR_MAPPING[('/root/staging/device-serial-1',)] = ['bad.jpg', 'file.jpg']
+        self.mock_metadata_helper.get_dates_taken.side_effect = \
+            lambda paths: dict((p, RuntimeError('missing tag') if 'bad' in p else 1449176000) for p in paths)
+        self.test_model.run()
+        self.test_model.close()
+
+        self.mock_remove.assert_called_once_with('/root/staging/device-serial-1/file.jpg')
+
+    def test_it_should_close_the_worker_pool_when_closed(self):
+        mock_pool = MagicMock()
+        self.test_model = Indexer(self.mock_config, self.mock_index, self.mock_metadata_helper,
+                                  self.mock_thumbnail_generator, self.mock_util, self.mock_video_converter,
+                                  self.mock_preprocessor, pool=mock_pool,
+                                  media_placer=self.mock_media_placer, duplicate_detector=self.mock_duplicate_detector,
+                                  hash_cache=self.mock_hash_cache, failure_tracker=self.mock_failure_tracker)
+        self.test_model.close()
+        mock_pool.terminate.assert_called_once_with()
+
+    def test_it_should_close_the_index_when_closed(self):
+        self.test_model.close()
+        self.mock_index.close.assert_called_once_with()
+
+    def test_it_should_close_the_hash_cache_when_closed(self):
+        self.test_model.close()
+        self.mock_hash_cache.close.assert_called_once_with()
+
+    def test_it_should_close_the_failure_tracker_when_closed(self):
+        self.test_model.close()
+        self.mock_failure_tracker.close.assert_called_once_with()
+
+    def test_it_should_close_the_metadata_helper_when_closed(self):
+        self.test_model.close()
+        self.mock_metadata_helper.close.assert_called_once_with()
+
     def test_it_should_delete_staged_media_after_indexing(self):
         self.test_model.run()
         self.mock_remove.assert_called_once_with('/root/staging/device-serial-1/file.jpg')
 
-    @unittest.skip("disabling advanced functionality")
     def test_it_should_not_delete_staged_media_if_an_error_occurred_during_indexing(self):
         self.mock_index.index_media.side_effect = RuntimeError
         self.test_model.run()
@@ -213,12 +595,13 @@ class TestIndexer(unittest.TestCase):
         self.__run_mp4_test()
         self.mock_util.mkdirp.assert_called_once_with('/root/videos/2015/12/3')
 
-    def test_it_should_copy_media_from_the_staging_location_to_the_final_location_for_mp4_videos(self):
+    def test_it_should_place_media_at_the_final_location_for_mp4_videos(self):
         self.__run_mp4_test()
-        self.mock_copy.assert_called_once_with('/root/staging/device-serial-1/file.mp4',
-                                               '/root/videos/2015/12/3/6c8abb37a65a74b526d456927a19549d.mp4')
+        self.mock_media_placer.stage.assert_called_once_with('/root/staging/device-serial-1/file.mp4',
+                                                             '/root/videos/2015/12/3', None)
+        self.mock_placement.commit.assert_called_once_with(
+            '/root/videos/2015/12/3/6c8abb37a65a74b526d456927a19549d.mp4')
 
-    @unittest.skip("disabling advanced functionality")
     def test_it_should_index_media_with_the_right_final_path_for_mp4_videos(self):
         expected_path_to_file = 'videos/2015/12/3/6c8abb37a65a74b526d456927a19549d.mp4'
         self.__run_mp4_test()
@@ -230,22 +613,18 @@ class TestIndexer(unittest.TestCase):
         self.__run_mp4_test()
         self.mock_index.index_media.assert_called_once_with(ANY, expected_path_to_thumbnail, ANY, ANY, ANY, ANY)
 
-    @unittest.skip("disabling advanced functionality")
     def test_it_should_index_media_with_the_right_date_taken_for_mp4_videos(self):
         self.__run_mp4_test()
         self.mock_index.index_media.assert_called_once_with(ANY, ANY, 1449176000, ANY, ANY, ANY)
 
-    @unittest.skip("disabling advanced functionality")
     def test_it_should_index_media_with_the_right_device_id_for_mp4_videos(self):
         self.__run_mp4_test()
         self.mock_index.index_media.assert_called_once_with(ANY, ANY, ANY, 'device-serial-1', ANY, ANY)
 
-    @unittest.skip("disabling advanced functionality")
     def test_it_should_index_media_with_the_right_hash_for_mp4_videos(self):
         self.__run_mp4_test()
         self.mock_index.index_media.assert_called_once_with(ANY, ANY, ANY, ANY, '6c8abb37a65a74b526d456927a19549d', ANY)
 
-    @unittest.skip("disabling advanced functionality")
     def test_it_should_index_media_with_the_right_media_type_for_mp4_videos(self):
         self.__run_mp4_test()
         self.mock_index.index_media.assert_called_once_with(ANY, ANY, ANY, ANY, ANY, 'MP4')
@@ -293,7 +672,7 @@ class TestIndexer(unittest.TestCase):
     @unittest.skip("disabling advanced functionality")
     def test_it_should_not_copy_media_from_the_staging_location_to_the_final_location_for_mts_videos(self):
         self.__run_mts_test()
-        self.mock_copy.assert_not_called()
+        self.mock_placement.commit.assert_not_called()
 
     @unittest.skip("disabling advanced functionality")
     def test_it_should_index_media_with_the_right_final_path_for_mts_videos(self):
@@ -331,5 +710,57 @@ class TestIndexer(unittest.TestCase):
         self.__run_mts_test()
         self.mock_remove.assert_called_once_with('/root/staging/device-serial-1/file.mts')
 
+
+class TestIndexerWorkers(TempDirTestCase):
+    def setUp(self):
+        super(TestIndexerWorkers, self).setUp()
+        self.path_to_file = os.path.join(self.temp_dir, 'file.jpg')
+        with open(self.path_to_file, 'wb') as f:
+            f.write('fake-file-contents')
+
+    def test_it_should_hash_and_date_files_in_worker_processes(self):
+        pool = multiprocessing.Pool(1, initializer=init_indexer_worker)
+        try:
+            results = list(pool.imap(hash_and_date_staged_file, [(self.path_to_file, 1449176000, True)]))
+        finally:
+            pool.terminate()
+            pool.join()
+
+        self.assertEqual(results, [(FAKE_FILE_HASH, 1449176000, [])])
+
+    @patch('indexer.worker_metadata_helper')
+    def test_it_should_keep_date_errors_from_the_file_apart_from_other_errors_in_worker_processes(self, mock_helper):
+        mock_helper.get_date_taken.side_effect = [DateTakenError('missing tag'), IOError('exiftool exited')]
+        self.assertIsInstance(hash_and_date_staged_file((self.path_to_file, None, False))[1], DateTakenError)
+        self.assertNotIsInstance(hash_and_date_staged_file((self.path_to_file, None, False))[1], DateTakenError)
+
+    @patch('indexer.worker_content_hasher')
+    @patch('indexer.worker_metadata_helper')
+    def test_it_should_not_hash_files_without_a_date_in_worker_processes(self, mock_helper, mock_hasher):
+        mock_helper.get_date_taken.side_effect = DateTakenError('missing tag')
+        self.assertIsNone(hash_and_date_staged_file((self.path_to_file, None, True))[0])
+        mock_hasher.hash_file.assert_not_called()
+
+    def test_it_should_not_hash_files_in_worker_processes_that_are_already_hashed(self):
+        init_indexer_worker()
+        self.assertEqual(hash_and_date_staged_file((self.path_to_file, 1449176000, False)), (None, 1449176000, []))
+
+    def test_it_should_collect_log_records_that_can_be_sent_to_the_parent_process(self):
+        collector = LogRecordCollector()
+        try:
+            raise RuntimeError('boom')
+        except RuntimeError:
+            record = logging.LogRecord('root', logging.ERROR, __file__, 1, 'Failed. path_to_file=%s',
+                                       ('file.jpg',), sys.exc_info())
+
+        del worker_log_records[:]
+        collector.emit(record)
+
+        replayed = logging.makeLogRecord(pickle.loads(pickle.dumps(worker_log_records[0])))
+        del worker_log_records[:]
+        self.assertEqual(replayed.getMessage(), 'Failed. path_to_file=file.jpg')
+        self.assertIn('RuntimeError: boom', replayed.exc_text)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,115 @@
+import logging
+import signal
+import threading
+import unittest
+
+from indexer import Indexer
+from indexer import RunSummary
+from indexing_pipeline import IndexingPipeline
+from mock import call
+from mock import MagicMock
+
+logging.disable(logging.CRITICAL)
+
+
+class TestIndexingPipeline(unittest.TestCase):
+    def setUp(self):
+        self.mock_indexer = MagicMock(spec=Indexer)
+        self.mock_indexer.index_files.side_effect = lambda device_dir, paths: len(paths)
+
+        self.test_model = IndexingPipeline(self.mock_indexer)
+
+    def test_it_should_index_submitted_files(self):
+        self.test_model.start()
+        self.test_model.submit('device-1', '/staging/device-1/a.jpg')
+        self.test_model.finish()
+        self.mock_indexer.index_files.assert_called_once_with('device-1', ['/staging/device-1/a.jpg'])
+
+    def test_it_should_index_files_while_more_are_being_submitted(self):
+        indexed = threading.Event()
+        self.mock_indexer.index_files.side_effect = lambda device_dir, paths: indexed.set() or len(paths)
+
+        self.test_model.start()
+        self.test_model.submit('device-1', '/staging/device-1/a.jpg')
+        self.assertTrue(indexed.wait(5))
+        self.test_model.finish()
+
+    def test_it_should_batch_files_that_are_waiting_by_device(self):
+        # Hold up the first batch, so everything else is waiting in the queue when it finishes.
+        started = threading.Event()
+        release = threading.Event()
+        self.mock_indexer.index_files.side_effect = \
+            lambda device_dir, paths: started.set() or release.wait(5) and len(paths)
+
+        self.test_model.start()
+        self.test_model.submit('device-1', '/staging/device-1/a.jpg')
+        started.wait(5)
+        for path in ['/staging/device-1/b.jpg', '/staging/USB/c.jpg', '/staging/device-1/d.jpg']:
+            self.test_model.submit(path.split('/')[2], path)
+        release.set()
+        self.test_model.finish()
+
+        self.assertEqual(self.mock_indexer.index_files.call_args_list[1:],
+                         [call('device-1', ['/staging/device-1/b.jpg', '/staging/device-1/d.jpg']),
+                          call('USB', ['/staging/USB/c.jpg'])])
+
+    def test_it_should_summarize_what_it_indexed(self):
+        self.mock_indexer.index_files.side_effect = lambda device_dir, paths: 0 if 'bad' in paths[0] else len(paths)
+
+        self.test_model.start()
+        self.test_model.submit('device-1', '/staging/device-1/bad.jpg')
+        self.test_model.finish()
+        self.test_model.start()
+        self.test_model.submit('device-1', '/staging/device-1/a.jpg')
+        self.test_model.submit('device-1', '/staging/device-1/b.jpg')
+        self.assertEqual(self.test_model.finish(), RunSummary(2, 2, False))
+
+    def test_it_should_keep_going_if_indexing_fails(self):
+        self.mock_indexer.index_files.side_effect = [RuntimeError, 1]
+
+        self.test_model.start()
+        self.test_model.submit('device-1', '/staging/device-1/a.jpg')
+        self.test_model.finish()
+        self.test_model.start()
+        self.test_model.submit('device-1', '/staging/device-1/b.jpg')
+        self.assertEqual(self.test_model.finish(), RunSummary(1, 1, False))
+
+    def test_it_should_do_nothing_when_finished_without_being_started(self):
+        self.assertEqual(self.test_model.finish(), RunSummary(0, 0, False))
+        self.mock_indexer.index_files.assert_not_called()
+
+    def test_it_should_handle_signals_while_waiting_for_files_to_be_indexed(self):
+        self.__assert_finish_handles_signals(IndexingPipeline(self.mock_indexer), 1)
+
+    def test_it_should_handle_signals_while_waiting_for_room_in_the_queue(self):
+        self.__assert_finish_handles_signals(IndexingPipeline(self.mock_indexer, queue_size=1), 2)
+
+    def __assert_finish_handles_signals(self, test_model, files):
+        started = threading.Event()
+        release = threading.Event()
+        indexed = []
+        self.mock_indexer.index_files.side_effect = \
+            lambda device_dir, paths: started.set() or release.wait(10) or indexed.extend(paths) or len(paths)
+
+        def interrupt(signum, frame):
+            raise SystemExit(0)
+
+        previous_handler = signal.signal(signal.SIGALRM, interrupt)
+        try:
+            test_model.start()
+            for i in range(files):
+                test_model.submit('device-1', '/staging/device-1/{0}.jpg'.format(i))
+            started.wait(5)
+
+            signal.setitimer(signal.ITIMER_REAL, 0.1)
+            with self.assertRaises(SystemExit):
+                test_model.finish()
+            self.assertEqual(indexed, [])
+        finally:
+            release.set()
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, previous_handler)
+
+
+if __name__ == '__main__':
+    unittest.main()
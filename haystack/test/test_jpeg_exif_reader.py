@@ -0,0 +1,88 @@
+import os
+import struct
+import unittest
+
+from jpeg_exif_reader import JpegExifReader
+from test.temp_dir_test_case import TempDirTestCase
+
+DATE_TIME_ORIGINAL = '2015:06:23 21:52:13'
+
+
+def tiff(endian, orientation=None, date_time_original=None):
+    # IFD0 starts right after the 8 byte header, the Exif IFD and its data follow IFD0.
+    ifd0_entries = []
+    if orientation is not None:
+        ifd0_entries.append(struct.pack(endian + 'HHIHH', 0x0112, 3, 1, orientation, 0))
+
+    exif_ifd = ''
+    if date_time_original is not None:
+        ifd0_size = 2 + (len(ifd0_entries) + 1) * 12 + 4
+        exif_ifd_offset = 8 + ifd0_size
+        ifd0_entries.append(struct.pack(endian + 'HHII', 0x8769, 4, 1, exif_ifd_offset))
+
+        value = date_time_original + '\x00'
+        value_offset = exif_ifd_offset + 2 + 12 + 4
+        exif_ifd = (struct.pack(endian + 'H', 1) +
+                    struct.pack(endian + 'HHII', 0x9003, 2, len(value), value_offset) +
+                    struct.pack(endian + 'I', 0) + value)
+
+    byte_order = 'II' if endian == '<' else 'MM'
+    ifd0 = struct.pack(endian + 'H', len(ifd0_entries)) + ''.join(ifd0_entries) + struct.pack(endian + 'I', 0)
+    return byte_order + struct.pack(endian + 'HI', 42, 8) + ifd0 + exif_ifd
+
+
+def segment(marker, payload):
+    return '\xff' + chr(marker) + struct.pack('>H', len(payload) + 2) + payload
+
+
+def jpeg(*segments):
+    return '\xff\xd8' + ''.join(segments) + segment(0xDA, '\x00' * 10) + 'image-data' + '\xff\xd9'
+
+
+class TestJpegExifReader(TempDirTestCase):
+    def setUp(self):
+        super(TestJpegExifReader, self).setUp()
+        self.test_model = JpegExifReader()
+
+    def __read(self, contents):
+        path_to_file = os.path.join(self.temp_dir, 'file.jpg')
+        with open(path_to_file, 'wb') as f:
+            f.write(contents)
+
+        return self.test_model.read_metadata(path_to_file)
+
+    def test_it_should_read_the_date_taken_and_orientation_from_little_endian_exif(self):
+        metadata = self.__read(jpeg(segment(0xE1, 'Exif\x00\x00' + tiff('<', 6, DATE_TIME_ORIGINAL))))
+        self.assertEqual(metadata, {'EXIF:DateTimeOriginal': DATE_TIME_ORIGINAL, 'EXIF:Orientation': 6})
+
+    def test_it_should_read_the_date_taken_and_orientation_from_big_endian_exif(self):
+        metadata = self.__read(jpeg(segment(0xE1, 'Exif\x00\x00' + tiff('>', 3, DATE_TIME_ORIGINAL))))
+        self.assertEqual(metadata, {'EXIF:DateTimeOriginal': DATE_TIME_ORIGINAL, 'EXIF:Orientation': 3})
+
+    def test_it_should_skip_segments_in_front_of_the_exif_segment(self):
+        jfif = segment(0xE0, 'JFIF\x00' + '\x00' * 9)
+        xmp = segment(0xE1, 'http://ns.adobe.com/xap/1.0/\x00<x:xmpmeta/>')
+        metadata = self.__read(jpeg(jfif, xmp, segment(0xE1, 'Exif\x00\x00' + tiff('<', 1, DATE_TIME_ORIGINAL))))
+        self.assertEqual(metadata['EXIF:DateTimeOriginal'], DATE_TIME_ORIGINAL)
+
+    def test_it_should_only_return_the_tags_that_exist(self):
+        metadata = self.__read(jpeg(segment(0xE1, 'Exif\x00\x00' + tiff('<', orientation=8))))
+        self.assertEqual(metadata, {'EXIF:Orientation': 8})
+
+    def test_it_should_return_nothing_if_there_is_no_exif_segment(self):
+        metadata = self.__read(jpeg(segment(0xE0, 'JFIF\x00' + '\x00' * 9)))
+        self.assertEqual(metadata, {})
+
+    def test_it_should_return_nothing_if_the_file_isnt_a_jpeg(self):
+        self.assertEqual(self.__read('not a jpeg at all'), {})
+
+    def test_it_should_return_nothing_if_the_exif_segment_is_corrupt(self):
+        metadata = self.__read(jpeg(segment(0xE1, 'Exif\x00\x00II*\x00\xff\xff\x00\x00')))
+        self.assertEqual(metadata, {})
+
+    def test_it_should_return_nothing_if_the_file_doesnt_exist(self):
+        self.assertEqual(self.test_model.read_metadata(os.path.join(self.temp_dir, 'missing.jpg')), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
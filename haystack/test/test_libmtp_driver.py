@@ -0,0 +1,226 @@
+import ctypes
+import logging
+import unittest
+
+from config import Config
+from libmtp_driver import create_mtp_driver
+from libmtp_driver import LIBMTP_ERROR_NO_DEVICE_ATTACHED
+from libmtp_driver import LIBMTP_FILES_AND_FOLDERS_ROOT
+from libmtp_driver import LIBMTP_FILETYPE_FOLDER
+from libmtp_driver import LibMTPDriver
+from libmtp_driver import LibMTPFile
+from libmtp_driver import LibMTPFolder
+from libmtp_driver import LibMTPRawDevice
+from mock import MagicMock
+from mock import patch
+from mtp_driver import MTPDriver
+from mtp_object import MTPObject
+
+logging.disable(logging.CRITICAL)
+
+DEVICE = 1234
+LIBMTP_FILETYPE_JPEG = 16
+
+
+# Builds the structures libmtp would return, and keeps them alive for as long as the test needs them.
+class FakeLibMTP:
+    def __init__(self):
+        self.objects = []
+        self.raw_device_count = 1
+
+        self.mock = MagicMock()
+        self.mock.LIBMTP_Detect_Raw_Devices.side_effect = self.detect_raw_devices
+        self.mock.LIBMTP_Open_Raw_Device_Uncached.return_value = DEVICE
+        self.mock.LIBMTP_Get_Manufacturername.return_value = self.string('motorola')
+        self.mock.LIBMTP_Get_Modelname.return_value = self.string('XT1031')
+        self.mock.LIBMTP_Get_Serialnumber.return_value = self.string('TA965195GE')
+        self.mock.LIBMTP_Get_File_To_File.return_value = 0
+        self.mock.LIBMTP_Delete_Object.return_value = 0
+
+    def detect_raw_devices(self, devices, count):
+        if self.raw_device_count == 0:
+            return LIBMTP_ERROR_NO_DEVICE_ATTACHED
+
+        raw_devices = (LibMTPRawDevice * self.raw_device_count)()
+        self.objects.append(raw_devices)
+        devices._obj.contents = raw_devices[0]
+        count._obj.value = self.raw_device_count
+        return 0
+
+    def string(self, value):
+        buf = ctypes.create_string_buffer(value)
+        self.objects.append(buf)
+        return ctypes.addressof(buf)
+
+    def folder(self, folder_id, name, parent_id=0, child=None, sibling=None):
+        folder = LibMTPFolder(folder_id, parent_id, 0, name)
+        if child is not None:
+            folder.child = ctypes.pointer(child)
+        if sibling is not None:
+            folder.sibling = ctypes.pointer(sibling)
+        self.objects.append(folder)
+        return folder
+
+    def files(self, *files):
+        head = None
+        for entry in reversed(files):
+            item_id, filename, parent_id, filesize = entry[:4]
+            filetype = entry[4] if len(entry) > 4 else LIBMTP_FILETYPE_JPEG
+            f = LibMTPFile(item_id, parent_id, 0, filename, filesize, 0, filetype)
+            if head is not None:
+                f.next = head
+            self.objects.append(f)
+            head = ctypes.pointer(f)
+
+        return head if head is not None else ctypes.POINTER(LibMTPFile)()
+
+
+class TestLibMTPDriver(unittest.TestCase):
+    def setUp(self):
+        self.fake_libmtp = FakeLibMTP()
+        self.mock_libmtp = self.fake_libmtp.mock
+        self.mock_libc = MagicMock()
+
+        self.test_model = LibMTPDriver(self.mock_libmtp, self.mock_libc)
+
+    def test_it_should_know_if_no_devices_are_connected(self):
+        self.fake_libmtp.raw_device_count = 0
+        self.assertFalse(self.test_model.detect_device())
+        self.mock_libmtp.LIBMTP_Open_Raw_Device_Uncached.assert_not_called()
+
+    def test_it_should_describe_a_connected_device(self):
+        self.assertEqual(self.test_model.detect_device(),
+                         {'manufacturer': 'motorola', 'model': 'XT1031', 'serial': 'TA965195GE'})
+
+    @patch('libmtp_driver.logging')
+    def test_it_should_open_the_first_device_and_report_the_others(self, mock_logging):
+        self.fake_libmtp.raw_device_count = 3
+        self.assertEqual(self.test_model.detect_device()['serial'], 'TA965195GE')
+        self.mock_libmtp.LIBMTP_Open_Raw_Device_Uncached.assert_called_once()
+        self.assertEqual(mock_logging.warn.call_count, 2)
+
+    def test_it_should_raise_an_error_if_the_device_cannot_be_opened(self):
+        self.mock_libmtp.LIBMTP_Open_Raw_Device_Uncached.return_value = None
+        with self.assertRaises(RuntimeError):
+            self.test_model.detect_device()
+
+    def test_it_should_raise_an_error_if_detection_fails(self):
+        self.mock_libmtp.LIBMTP_Detect_Raw_Devices.side_effect = None
+        self.mock_libmtp.LIBMTP_Detect_Raw_Devices.return_value = 7
+        with self.assertRaises(RuntimeError):
+            self.test_model.detect_device()
+
+    def test_it_should_open_the_device_once_for_every_command(self):
+        self.mock_libmtp.LIBMTP_Get_Folder_List.return_value = ctypes.POINTER(LibMTPFolder)()
+        self.mock_libmtp.LIBMTP_Get_Filelisting_With_Callback.return_value = self.fake_libmtp.files()
+
+        self.test_model.detect_device()
+        self.test_model.get_folder_list()
+        self.test_model.get_filelisting()
+        self.test_model.get_file_to_file(42, '/root/staging/id/file.jpg')
+        self.test_model.delete_object(42)
+
+        self.assertEqual(self.mock_libmtp.LIBMTP_Open_Raw_Device_Uncached.call_count, 1)
+        self.mock_libmtp.LIBMTP_Get_File_To_File.assert_called_once_with(DEVICE, 42, '/root/staging/id/file.jpg',
+                                                                         None, None)
+        self.mock_libmtp.LIBMTP_Delete_Object.assert_called_once_with(DEVICE, 42)
+
+    def test_it_should_describe_the_devices_folders_in_mtp_folders_order(self):
+        camera = self.fake_libmtp.folder(28, 'Camera', 9)
+        thumbnails = self.fake_libmtp.folder(65, '.thumbnails', 9)
+        camera.sibling = ctypes.pointer(thumbnails)
+        pictures = self.fake_libmtp.folder(6, 'Pictures')
+        dcim = self.fake_libmtp.folder(9, 'DCIM', child=camera, sibling=pictures)
+        self.mock_libmtp.LIBMTP_Get_Folder_List.return_value = ctypes.pointer(dcim)
+
+        self.test_model.detect_device()
+        self.assertEqual(self.test_model.get_folder_list(), [MTPObject(9, 'DCIM'),
+                                                             MTPObject(28, 'Camera', 9),
+                                                             MTPObject(65, '.thumbnails', 9),
+                                                             MTPObject(6, 'Pictures')])
+        self.assertEqual(self.mock_libmtp.LIBMTP_destroy_folder_t.call_count, 1)
+
+    def test_it_should_describe_the_devices_files(self):
+        self.mock_libmtp.LIBMTP_Get_Filelisting_With_Callback.return_value = self.fake_libmtp.files(
+            (43, 'IMG_20150613_115842622.jpg', 28, 1286823),
+            (7725, 'VID_20151211_153724770.mp4', 28, 140120613))
+
+        self.test_model.detect_device()
+        self.assertEqual(self.test_model.get_filelisting(),
+                         [MTPObject(43, 'IMG_20150613_115842622.jpg', 28, 1286823),
+                          MTPObject(7725, 'VID_20151211_153724770.mp4', 28, 140120613)])
+        self.assertEqual(self.mock_libmtp.LIBMTP_destroy_file_t.call_count, 2)
+
+    def test_it_should_be_able_to_list_single_folders(self):
+        self.assertTrue(self.test_model.can_list_folders())
+
+    def test_it_should_list_the_children_of_a_folder(self):
+        self.mock_libmtp.LIBMTP_Get_Files_And_Folders.return_value = self.fake_libmtp.files(
+            (28, 'Camera', 9, 0, LIBMTP_FILETYPE_FOLDER),
+            (43, 'IMG_20150613_115842622.jpg', 9, 1286823))
+
+        self.test_model.detect_device()
+        folders, files = self.test_model.list_folder(9)
+
+        self.mock_libmtp.LIBMTP_Get_Files_And_Folders.assert_called_once_with(DEVICE, 0, 9)
+        self.assertEqual(folders, [MTPObject(28, 'Camera', 9)])
+        self.assertEqual(files, [MTPObject(43, 'IMG_20150613_115842622.jpg', 9, 1286823)])
+        self.assertEqual(self.mock_libmtp.LIBMTP_destroy_file_t.call_count, 2)
+
+    def test_it_should_list_the_root_folder(self):
+        self.mock_libmtp.LIBMTP_Get_Files_And_Folders.return_value = self.fake_libmtp.files(
+            (9, 'DCIM', LIBMTP_FILES_AND_FOLDERS_ROOT, 0, LIBMTP_FILETYPE_FOLDER))
+
+        self.test_model.detect_device()
+        folders, files = self.test_model.list_folder()
+
+        self.mock_libmtp.LIBMTP_Get_Files_And_Folders.assert_called_once_with(DEVICE, 0, LIBMTP_FILES_AND_FOLDERS_ROOT)
+        self.assertEqual(folders, [MTPObject(9, 'DCIM')])
+        self.assertEqual(files, [])
+
+    def test_it_should_list_empty_folders(self):
+        self.mock_libmtp.LIBMTP_Get_Files_And_Folders.return_value = self.fake_libmtp.files()
+        self.test_model.detect_device()
+        self.assertEqual(self.test_model.list_folder(9), ([], []))
+
+    def test_it_should_raise_an_error_if_a_download_fails(self):
+        self.mock_libmtp.LIBMTP_Get_File_To_File.return_value = 1
+        self.test_model.detect_device()
+        with self.assertRaises(RuntimeError):
+            self.test_model.get_file_to_file(42, '/root/staging/id/file.jpg')
+
+    def test_it_should_raise_an_error_if_a_delete_fails(self):
+        self.mock_libmtp.LIBMTP_Delete_Object.return_value = 1
+        self.test_model.detect_device()
+        with self.assertRaises(RuntimeError):
+            self.test_model.delete_object(42)
+
+    def test_it_should_raise_an_error_if_no_device_is_open(self):
+        with self.assertRaises(RuntimeError):
+            self.test_model.get_filelisting()
+
+    def test_it_should_release_the_device_when_closed(self):
+        self.test_model.detect_device()
+        self.test_model.close()
+        self.mock_libmtp.LIBMTP_Release_Device.assert_called_once_with(DEVICE)
+
+    def test_it_should_release_the_previous_device_when_detecting_again(self):
+        self.test_model.detect_device()
+        self.test_model.detect_device()
+        self.mock_libmtp.LIBMTP_Release_Device.assert_called_once_with(DEVICE)
+
+    def test_it_should_use_the_mtp_tools_driver_if_libmtp_is_disabled(self):
+        mock_config = MagicMock(spec=Config)
+        mock_config.mtp_use_libmtp.return_value = False
+        self.assertIsInstance(create_mtp_driver(mock_config), MTPDriver)
+
+    @patch('libmtp_driver.load_libmtp')
+    def test_it_should_use_the_mtp_tools_driver_if_libmtp_cannot_be_loaded(self, mock_load_libmtp):
+        mock_load_libmtp.side_effect = OSError('libmtp is not installed!')
+        mock_config = MagicMock(spec=Config)
+        mock_config.mtp_use_libmtp.return_value = True
+        self.assertIsInstance(create_mtp_driver(mock_config), MTPDriver)
+
+
+if __name__ == '__main__':
+    unittest.main()
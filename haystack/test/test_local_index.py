@@ -0,0 +1,238 @@
+import logging
+import os
+import sqlite3
+import unittest
+
+from config import Config
+from index import Index
+from index_flusher import IndexFlusher
+from local_index import LocalIndex
+from mock import Mock
+from mock import patch
+from test.temp_dir_test_case import TempDirTestCase
+
+logging.disable(logging.CRITICAL)
+
+MOCK_INDEX_TIME = 1449092137
+
+# The media table before sizes were recorded.
+OLD_SCHEMA = '''CREATE TABLE media (
+                  id INTEGER PRIMARY KEY,
+                  path_to_media TEXT NOT NULL,
+                  path_to_thumbnail TEXT,
+                  date_taken INTEGER NOT NULL,
+                  date_indexed INTEGER NOT NULL,
+                  source_device_id TEXT NOT NULL,
+                  hash TEXT NOT NULL,
+                  type TEXT NOT NULL,
+                  synced INTEGER NOT NULL DEFAULT 0)'''
+
+
+class TestLocalIndex(TempDirTestCase):
+    def setUp(self):
+        super(TestLocalIndex, self).setUp()
+        self.time_patcher = patch('local_index.time')
+        self.mock_time = self.time_patcher.start()
+        self.mock_time.time.return_value = MOCK_INDEX_TIME
+
+        os.mkdir(os.path.join(self.temp_dir, 'pictures'))
+
+        self.mock_config = Mock(spec=Config)
+        self.mock_config.firebase_sync_enabled.return_value = False
+        self.mock_config.haystack_root.return_value = self.temp_dir
+
+        self.mock_downstream_index = Mock(spec=Index)
+        self.mock_flusher = Mock(spec=IndexFlusher)
+
+    def tearDown(self):
+        self.time_patcher.stop()
+
+    def __init_test(self, downstream_index=None):
+        self.test_model = LocalIndex(self.mock_config, downstream_index, path_to_database=':memory:',
+                                     flusher=self.mock_flusher if downstream_index else None)
+
+    def __add_media(self, hash='098f6bcd4621d373cade4e832627b4f6', taken=1346060000, device_id='USB', type='JPG'):
+        self.test_model.index_media('pictures/' + hash + '.jpg', None, taken, device_id, hash, type)
+
+    def test_it_should_not_sync_to_firebase_unless_enabled(self):
+        self.__init_test()
+        self.assertIsNone(self.test_model.downstream_index)
+
+    @patch('local_index.IndexFlusher')
+    @patch('local_index.Index')
+    def test_it_should_sync_to_firebase_in_the_background_when_enabled(self, mock_index_class, mock_flusher_class):
+        self.mock_config.firebase_sync_enabled.return_value = True
+        self.__init_test()
+        mock_index_class.assert_called_once_with(self.mock_config)
+        mock_flusher_class.assert_called_once_with(self.test_model)
+        mock_flusher_class.return_value.start.assert_called_once_with()
+
+    def test_it_should_start_the_flusher(self):
+        self.__init_test(self.mock_downstream_index)
+        self.mock_flusher.start.assert_called_once_with()
+
+    def test_it_should_notify_the_flusher_when_media_is_indexed(self):
+        self.__init_test(self.mock_downstream_index)
+        self.__add_media()
+        self.mock_flusher.notify.assert_called_once_with()
+        self.mock_downstream_index.index_media_batch.assert_not_called()
+
+    def test_it_should_stop_the_flusher_when_closed(self):
+        self.__init_test(self.mock_downstream_index)
+        self.test_model.close()
+        self.mock_flusher.stop.assert_called_once_with()
+
+    def test_it_should_use_the_right_values_when_adding_new_media(self):
+        self.__init_test()
+        self.test_model.index_media('pictures/media.jpg', 'thumbnails/media.jpg', 1346060000, 'USB',
+                                    '098f6bcd4621d373cade4e832627b4f6', 'JPG')
+
+        expected_data = {
+            'pathToMedia': 'pictures/media.jpg',
+            'pathToThumbnail': 'thumbnails/media.jpg',
+            'dateTaken': 1346060000,
+            'dateIndexed': MOCK_INDEX_TIME,
+            'sourceDeviceId': 'USB',
+            'hash': '098f6bcd4621d373cade4e832627b4f6',
+            'type': 'JPG'
+        }
+
+        self.assertEqual(self.test_model.find_media(), [expected_data])
+
+    def test_it_should_return_true_if_the_hash_already_exists(self):
+        self.__init_test()
+        self.__add_media(hash='already-indexed')
+        self.assertTrue(self.test_model.is_duplicate('already-indexed'))
+
+    def test_it_should_return_false_if_the_hash_doesnt_exist(self):
+        self.__init_test()
+        self.__add_media(hash='already-indexed')
+        self.assertFalse(self.test_model.is_duplicate('doesnt-exist'))
+
+    def test_it_should_find_media_by_date_taken(self):
+        self.__init_test()
+        self.__add_media(hash='early', taken=100)
+        self.__add_media(hash='middle', taken=200)
+        self.__add_media(hash='late', taken=300)
+
+        results = self.test_model.find_media(taken_after=200, taken_before=300)
+        self.assertEqual([r['hash'] for r in results], ['middle'])
+
+    def test_it_should_find_media_by_device_and_type(self):
+        self.__init_test()
+        self.__add_media(hash='usb-jpg', device_id='USB', type='JPG')
+        self.__add_media(hash='usb-mp4', device_id='USB', type='MP4')
+        self.__add_media(hash='phone-jpg', device_id='serial', type='JPG')
+
+        results = self.test_model.find_media(device_id='USB', type='JPG')
+        self.assertEqual([r['hash'] for r in results], ['usb-jpg'])
+
+    def test_it_should_find_media_by_size(self):
+        self.__init_test()
+        with open(os.path.join(self.temp_dir, 'pictures', 'media.jpg'), 'wb') as f:
+            f.write('not really a jpeg')
+        self.test_model.index_media('pictures/media.jpg', None, 1346060000, 'USB', 'some-hash', 'JPG')
+        self.__add_media(hash='missing')
+
+        self.assertEqual(self.test_model.find_media_with_size(17), [(1, 'pictures/media.jpg', None)])
+        self.assertEqual(self.test_model.find_media_with_size(18), [])
+
+    def test_it_should_record_samples_of_media(self):
+        self.__init_test()
+        with open(os.path.join(self.temp_dir, 'pictures', 'media.jpg'), 'wb') as f:
+            f.write('not really a jpeg')
+        self.test_model.index_media('pictures/media.jpg', None, 1346060000, 'USB', 'some-hash', 'JPG')
+
+        self.test_model.record_sample_hash(1, 'sample-hash')
+        self.assertEqual(self.test_model.find_media_with_size(17), [(1, 'pictures/media.jpg', 'sample-hash')])
+
+    def test_it_should_record_the_sizes_of_media_in_older_databases(self):
+        path_to_database = os.path.join(self.temp_dir, 'index.db')
+        connection = sqlite3.connect(path_to_database)
+        with connection:
+            connection.execute(OLD_SCHEMA)
+            connection.execute('INSERT INTO media VALUES (1, \'pictures/media.jpg\', NULL, 1, 1, \'USB\', ' +
+                               '\'some-hash\', \'JPG\', 1)')
+        connection.close()
+        with open(os.path.join(self.temp_dir, 'pictures', 'media.jpg'), 'wb') as f:
+            f.write('not really a jpeg')
+
+        self.test_model = LocalIndex(self.mock_config, path_to_database=path_to_database)
+        self.assertEqual(self.test_model.find_media_with_size(17), [(1, 'pictures/media.jpg', None)])
+        self.assertTrue(self.test_model.is_duplicate('some-hash'))
+        self.test_model.close()
+
+    def test_it_should_find_the_hash_labels_of_media_by_size(self):
+        self.__init_test()
+        with open(os.path.join(self.temp_dir, 'pictures', 'media.jpg'), 'wb') as f:
+            f.write('not really a jpeg')
+        for hash in ['098f6bcd4621d373cade4e832627b4f6', 'blake2b-' + 'f' * 64, 'md5-tree16m-' + 'f' * 32]:
+            self.test_model.index_media('pictures/media.jpg', None, 1346060000, 'USB', hash, 'JPG')
+
+        self.assertItemsEqual(self.test_model.find_hash_labels_with_size(17), ['', 'blake2b-', 'md5-tree16m-'])
+        self.assertEqual(self.test_model.find_hash_labels_with_size(18), [])
+
+    def test_it_should_record_the_hash_labels_of_media_in_older_databases(self):
+        path_to_database = os.path.join(self.temp_dir, 'index.db')
+        connection = sqlite3.connect(path_to_database)
+        with connection:
+            connection.execute(OLD_SCHEMA)
+            connection.execute('INSERT INTO media VALUES (1, \'pictures/media.jpg\', NULL, 1, 1, \'USB\', ' +
+                               '\'md5-tree16m-hash\', \'JPG\', 1)')
+        connection.close()
+        with open(os.path.join(self.temp_dir, 'pictures', 'media.jpg'), 'wb') as f:
+            f.write('not really a jpeg')
+
+        self.test_model = LocalIndex(self.mock_config, path_to_database=path_to_database)
+        self.assertEqual(self.test_model.find_hash_labels_with_size(17), ['md5-tree16m-'])
+        self.test_model.close()
+
+    def test_it_should_sync_new_media_downstream_in_a_batch(self):
+        self.__init_test(self.mock_downstream_index)
+        self.__add_media(hash='first')
+        self.__add_media(hash='second')
+
+        self.test_model.sync_downstream()
+        media = self.mock_downstream_index.index_media_batch.call_args[0][0]
+        self.assertEqual([m['hash'] for m in media], ['first', 'second'])
+        self.assertEqual(media[0]['dateIndexed'], MOCK_INDEX_TIME)
+
+    @patch('local_index.SYNC_BATCH_SIZE', 2)
+    def test_it_should_split_large_syncs_into_multiple_batches(self):
+        self.__init_test(self.mock_downstream_index)
+        for i in range(5):
+            self.__add_media(hash=str(i))
+
+        self.test_model.sync_downstream()
+        self.assertEqual(self.mock_downstream_index.index_media_batch.call_count, 3)
+
+    def test_it_should_only_sync_media_downstream_once(self):
+        self.__init_test(self.mock_downstream_index)
+        self.__add_media()
+
+        self.test_model.sync_downstream()
+        self.test_model.sync_downstream()
+        self.assertEqual(self.mock_downstream_index.index_media_batch.call_count, 1)
+
+    def test_it_should_raise_errors_from_the_downstream_index(self):
+        self.__init_test(self.mock_downstream_index)
+        self.__add_media()
+
+        self.mock_downstream_index.index_media_batch.side_effect = IOError
+        with self.assertRaises(IOError):
+            self.test_model.sync_downstream()
+
+    def test_it_should_retry_media_that_failed_to_sync_downstream(self):
+        self.__init_test(self.mock_downstream_index)
+        self.__add_media()
+
+        self.mock_downstream_index.index_media_batch.side_effect = IOError
+        with self.assertRaises(IOError):
+            self.test_model.sync_downstream()
+        self.mock_downstream_index.index_media_batch.side_effect = None
+        self.test_model.sync_downstream()
+        self.assertEqual(self.mock_downstream_index.index_media_batch.call_count, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
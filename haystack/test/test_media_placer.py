@@ -0,0 +1,187 @@
+import os
+import unittest
+
+from mock import MagicMock
+from mock import Mock
+from mock import patch
+
+from content_hash import ContentHasher
+from copy_engine import CopyEngine
+from copy_engine import load_libc
+from media_placer import MediaPlacer
+from test.temp_dir_test_case import TempDirTestCase
+from util import Util
+
+FILE_CONTENTS = 'not really a jpeg'
+FILE_HASH = '08a83d6686281a5a292732435b21f83a'
+
+
+class TestMediaPlacer(TempDirTestCase):
+    def setUp(self):
+        super(TestMediaPlacer, self).setUp()
+        self.staging_dir = os.path.join(self.temp_dir, 'staging')
+        self.final_dir = os.path.join(self.temp_dir, 'final')
+        os.mkdir(self.staging_dir)
+        os.mkdir(self.final_dir)
+
+        self.path_to_staged_file = os.path.join(self.staging_dir, 'file.jpg')
+        self.path_to_final_file = os.path.join(self.final_dir, FILE_HASH + '.jpg')
+        with open(self.path_to_staged_file, 'wb') as f:
+            f.write(FILE_CONTENTS)
+
+        self.mock_util = MagicMock(spec=Util)
+        self.mock_util.get_uuid.return_value = 'some-uuid'
+
+        self.test_model = MediaPlacer(self.mock_util)
+
+    def __stage_across_filesystems(self):
+        def fake_stat(path):
+            return Mock(st_dev=2 if path.startswith(self.final_dir) else 1)
+
+        with patch('os.stat', side_effect=fake_stat):
+            return self.test_model.stage(self.path_to_staged_file, self.final_dir)
+
+    def test_it_should_hash_staged_media_on_the_same_filesystem(self):
+        placement = self.test_model.stage(self.path_to_staged_file, self.final_dir)
+        self.assertEqual(placement.file_hash, FILE_HASH)
+
+    def test_it_should_not_rehash_staged_media_when_the_hash_is_known(self):
+        placement = self.test_model.stage(self.path_to_staged_file, self.final_dir, 'known-hash')
+        self.assertEqual(placement.file_hash, 'known-hash')
+
+    def test_it_should_link_staged_media_into_place_on_the_same_filesystem(self):
+        placement = self.test_model.stage(self.path_to_staged_file, self.final_dir)
+        placement.commit(self.path_to_final_file)
+
+        self.assertTrue(os.path.samefile(self.path_to_staged_file, self.path_to_final_file))
+        self.assertFalse(placement.moved_staged_file)
+
+    def test_it_should_move_staged_media_into_place_if_it_cannot_be_linked(self):
+        placement = self.test_model.stage(self.path_to_staged_file, self.final_dir)
+        with patch('os.link', side_effect=OSError('links are not supported')):
+            placement.commit(self.path_to_final_file)
+
+        self.assertFalse(os.path.exists(self.path_to_staged_file))
+        self.assertTrue(os.path.exists(self.path_to_final_file))
+        self.assertTrue(placement.moved_staged_file)
+
+    def test_it_should_leave_existing_media_alone(self):
+        with open(self.path_to_final_file, 'wb') as f:
+            f.write('existing')
+
+        placement = self.test_model.stage(self.path_to_staged_file, self.final_dir)
+        placement.commit(self.path_to_final_file)
+
+        with open(self.path_to_final_file, 'rb') as f:
+            self.assertEqual(f.read(), 'existing')
+
+    def test_it_should_hash_staged_media_while_copying_it_across_filesystems(self):
+        placement = self.__stage_across_filesystems()
+        self.assertEqual(placement.file_hash, FILE_HASH)
+        self.assertEqual(os.listdir(self.final_dir), ['.some-uuid.part'])
+
+    @unittest.skipUnless(hasattr(load_libc(), 'copy_file_range'), 'copy_file_range is not available')
+    def test_it_should_copy_staged_media_in_the_kernel_across_filesystems(self):
+        libc = load_libc()
+        mock_libc = MagicMock()
+        mock_libc.copy_file_range.side_effect = libc.copy_file_range
+        self.test_model = MediaPlacer(self.mock_util, CopyEngine(mock_libc))
+
+        placement = self.__stage_across_filesystems()
+        self.assertGreater(mock_libc.copy_file_range.call_count, 0)
+        mock_libc.sendfile.assert_not_called()
+        self.assertEqual(placement.file_hash, FILE_HASH)
+
+    def test_it_should_rename_copied_media_into_place(self):
+        placement = self.__stage_across_filesystems()
+        placement.commit(self.path_to_final_file)
+
+        self.assertEqual(os.listdir(self.final_dir), [FILE_HASH + '.jpg'])
+        with open(self.path_to_final_file, 'rb') as f:
+            self.assertEqual(f.read(), FILE_CONTENTS)
+        self.assertTrue(os.path.exists(self.path_to_staged_file))
+        self.assertFalse(placement.moved_staged_file)
+
+    def test_it_should_remove_copied_media_when_discarded(self):
+        placement = self.__stage_across_filesystems()
+        placement.discard()
+        self.assertEqual(os.listdir(self.final_dir), [])
+
+    def test_it_should_not_replace_existing_media_with_copied_media(self):
+        with open(self.path_to_final_file, 'wb') as f:
+            f.write('existing')
+
+        placement = self.__stage_across_filesystems()
+        placement.commit(self.path_to_final_file)
+
+        self.assertEqual(os.listdir(self.final_dir), [FILE_HASH + '.jpg'])
+        with open(self.path_to_final_file, 'rb') as f:
+            self.assertEqual(f.read(), 'existing')
+
+    def test_it_should_remove_linked_media_when_discarded_after_committing(self):
+        placement = self.test_model.stage(self.path_to_staged_file, self.final_dir)
+        placement.commit(self.path_to_final_file)
+        placement.discard()
+
+        self.assertEqual(os.listdir(self.final_dir), [])
+        self.assertTrue(os.path.exists(self.path_to_staged_file))
+
+    def test_it_should_move_staged_media_back_when_discarded_after_committing(self):
+        placement = self.test_model.stage(self.path_to_staged_file, self.final_dir)
+        with patch('os.link', side_effect=OSError('links are not supported')):
+            placement.commit(self.path_to_final_file)
+        placement.discard()
+
+        self.assertEqual(os.listdir(self.final_dir), [])
+        with open(self.path_to_staged_file, 'rb') as f:
+            self.assertEqual(f.read(), FILE_CONTENTS)
+        self.assertFalse(placement.moved_staged_file)
+
+    def test_it_should_remove_copied_media_when_discarded_after_committing(self):
+        placement = self.__stage_across_filesystems()
+        placement.commit(self.path_to_final_file)
+        placement.discard()
+
+        self.assertEqual(os.listdir(self.final_dir), [])
+        self.assertTrue(os.path.exists(self.path_to_staged_file))
+
+    def test_it_should_leave_existing_media_alone_when_discarded(self):
+        with open(self.path_to_final_file, 'wb') as f:
+            f.write('existing')
+
+        placement = self.test_model.stage(self.path_to_staged_file, self.final_dir)
+        placement.commit(self.path_to_final_file)
+        placement.discard()
+
+        self.assertTrue(os.path.exists(self.path_to_final_file))
+        self.assertTrue(os.path.exists(self.path_to_staged_file))
+
+    def test_it_should_hash_staged_media_with_the_given_hasher(self):
+        self.test_model = MediaPlacer(self.mock_util, content_hasher=ContentHasher(tree_chunk_size_in_mb=1))
+        placement = self.test_model.stage(self.path_to_staged_file, self.final_dir)
+        self.assertTrue(placement.file_hash.startswith('md5-tree1m-'))
+
+    def test_it_should_get_the_same_hash_when_copying_across_filesystems(self):
+        self.test_model = MediaPlacer(self.mock_util, content_hasher=ContentHasher(tree_chunk_size_in_mb=1))
+        placement = self.test_model.stage(self.path_to_staged_file, self.final_dir)
+        self.assertEqual(self.__stage_across_filesystems().file_hash, placement.file_hash)
+
+    def test_it_should_remove_partial_copies_if_copying_fails(self):
+        mock_content_hasher = MagicMock(spec=ContentHasher)
+        mock_content_hasher.new.return_value.update.side_effect = IOError('disk full')
+        self.test_model = MediaPlacer(self.mock_util, content_hasher=mock_content_hasher)
+        with self.assertRaises(IOError):
+            self.__stage_across_filesystems()
+        self.assertEqual(os.listdir(self.final_dir), [])
+
+    def test_it_should_remove_partial_copies_if_stopped_while_copying(self):
+        mock_content_hasher = MagicMock(spec=ContentHasher)
+        mock_content_hasher.new.return_value.update.side_effect = SystemExit(0)
+        self.test_model = MediaPlacer(self.mock_util, content_hasher=mock_content_hasher)
+        with self.assertRaises(SystemExit):
+            self.__stage_across_filesystems()
+        self.assertEqual(os.listdir(self.final_dir), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,9 +1,11 @@
 import unittest
 
-from exiftool import ExifTool
+from exiftool_session import ExifToolSession
+from jpeg_exif_reader import JpegExifReader
+from mp4_box_reader import Mp4BoxReader
+from metadata_helper import DateTakenError
 from metadata_helper import MetadataHelper
 from mock import MagicMock
-from mock import patch
 
 TEST_FILE_MTS = '/path/to/file.mts'
 TEST_FILE_MP4 = '/path/to/file.mp4'
@@ -28,23 +30,32 @@ def mock_get_metadata(*args):
         return False
 
 
-class TestMetadataHelper(unittest.TestCase):
-    def setUp(self):
-        self.mock_exiftool_patcher = patch('metadata_helper.exiftool')
-        self.mock_exiftool = self.mock_exiftool_patcher.start()
+def mock_get_tags_batch(tags, filenames):
+    results = []
+    for filename in filenames:
+        metadata = mock_get_metadata(filename)
+        if metadata:
+            metadata = dict((k, v) for k, v in metadata.items() if k in tags)
+            metadata['SourceFile'] = filename
+            results.append(metadata)
+
+    return results
 
-        self.mock_exiftool_class = MagicMock(spec=ExifTool)
-        self.mock_exiftool.ExifTool.return_value = self.mock_exiftool_class
 
-        self.mock_exiftool_instance = MagicMock()
-        self.mock_exiftool_instance.get_metadata = mock_get_metadata
+class TestMetadataHelper(unittest.TestCase):
+    def setUp(self):
+        self.mock_exiftool_session = MagicMock(spec=ExifToolSession)
+        self.mock_exiftool_session.get_metadata.side_effect = mock_get_metadata
+        self.mock_exiftool_session.get_tags_batch.side_effect = mock_get_tags_batch
 
-        self.mock_exiftool_class.__enter__.return_value = self.mock_exiftool_instance
+        self.mock_jpeg_exif_reader = MagicMock(spec=JpegExifReader)
+        self.mock_jpeg_exif_reader.read_metadata.return_value = {}
 
-        self.test_model = MetadataHelper()
+        self.mock_mp4_box_reader = MagicMock(spec=Mp4BoxReader)
+        self.mock_mp4_box_reader.read_metadata.return_value = {}
 
-    def tearDown(self):
-        self.mock_exiftool_patcher.stop()
+        self.test_model = MetadataHelper(self.mock_exiftool_session, self.mock_jpeg_exif_reader,
+                                         self.mock_mp4_box_reader)
 
     def test_it_should_return_a_utc_timestamp_for_mts_files(self):
         time = self.test_model.get_date_taken(TEST_FILE_MTS)
@@ -74,10 +85,89 @@ class TestMetadataHelper(unittest.TestCase):
         with self.assertRaises(RuntimeError):
             time = self.test_model.get_date_taken(MISSING_EVERYTHING_JPG)
 
+    def test_it_should_raise_a_date_taken_error_if_a_file_is_missing_a_create_tag(self):
+        with self.assertRaises(DateTakenError):
+            self.test_model.get_date_taken(MISSING_EVERYTHING_JPG)
+
+    def test_it_should_raise_a_date_taken_error_if_the_date_taken_cannot_be_parsed(self):
+        self.mock_jpeg_exif_reader.read_metadata.return_value = {'EXIF:DateTimeOriginal': '0000:00:00 00:00:00'}
+        with self.assertRaises(DateTakenError):
+            self.test_model.get_date_taken(TEST_FILE_JPG)
+
     def test_it_should_raise_a_runtime_error_if_the_extension_isnt_recognized(self):
         with self.assertRaises(RuntimeError):
             time = self.test_model.get_date_taken('bogus.txt')
 
+    def test_it_should_read_the_date_taken_for_jpg_files_without_exiftool_if_possible(self):
+        self.mock_jpeg_exif_reader.read_metadata.return_value = {'EXIF:DateTimeOriginal': '2015:06:23 21:52:13'}
+        time = self.test_model.get_date_taken(TEST_FILE_JPG)
+        self.assertEqual(time, 1435117933)
+        self.mock_exiftool_session.get_metadata.assert_not_called()
+
+    def test_it_should_read_the_rotation_for_jpg_files_without_exiftool_if_possible(self):
+        self.mock_jpeg_exif_reader.read_metadata.return_value = {'EXIF:Orientation': 8}
+        rotation = self.test_model.get_rotation(TEST_FILE_JPG)
+        self.assertEqual(rotation, 8)
+        self.mock_exiftool_session.get_metadata.assert_not_called()
+
+    def test_it_should_fall_back_to_exiftool_if_the_jpg_reader_cant_find_the_tag(self):
+        self.mock_jpeg_exif_reader.read_metadata.return_value = {'EXIF:Orientation': 8}
+        time = self.test_model.get_date_taken(TEST_FILE_JPG)
+        self.assertEqual(time, 1435117933)
+        self.mock_exiftool_session.get_metadata.assert_called_once_with(TEST_FILE_JPG)
+
+    def test_it_should_read_the_date_taken_for_mp4_files_without_exiftool_if_possible(self):
+        self.mock_mp4_box_reader.read_metadata.return_value = {'QuickTime:CreateDate': '2015:10:13 00:26:44'}
+        time = self.test_model.get_date_taken(TEST_FILE_MP4)
+        self.assertEqual(time, 1444717604)
+        self.mock_exiftool_session.get_metadata.assert_not_called()
+
+    def test_it_should_fall_back_to_exiftool_if_the_mp4_reader_cant_find_the_create_date(self):
+        time = self.test_model.get_date_taken(TEST_FILE_MP4)
+        self.assertEqual(time, 1444717604)
+        self.mock_exiftool_session.get_metadata.assert_called_once_with(TEST_FILE_MP4)
+
+    def test_it_should_not_use_the_jpg_reader_for_videos(self):
+        self.test_model.get_date_taken(TEST_FILE_MTS)
+        self.mock_jpeg_exif_reader.read_metadata.assert_not_called()
+
+    def test_it_should_only_send_files_the_jpg_reader_cant_answer_to_exiftool_in_a_batch(self):
+        self.mock_jpeg_exif_reader.read_metadata.return_value = {'EXIF:DateTimeOriginal': '2015:06:23 21:52:13'}
+        times = self.test_model.get_dates_taken([TEST_FILE_JPG, TEST_FILE_MP4])
+        self.assertEqual(times, {TEST_FILE_JPG: 1435117933, TEST_FILE_MP4: 1444717604})
+        self.mock_exiftool_session.get_tags_batch.assert_called_once_with(set(['QuickTime:CreateDate']),
+                                                                          [TEST_FILE_MP4])
+
+    def test_it_should_not_call_exiftool_if_the_jpg_reader_answers_the_whole_batch(self):
+        self.mock_jpeg_exif_reader.read_metadata.return_value = {'EXIF:DateTimeOriginal': '2015:06:23 21:52:13'}
+        self.test_model.get_dates_taken([TEST_FILE_JPG])
+        self.mock_exiftool_session.get_tags_batch.assert_not_called()
+
+    def test_it_should_return_utc_timestamps_for_a_batch_of_files(self):
+        times = self.test_model.get_dates_taken([TEST_FILE_MTS, TEST_FILE_MP4, TEST_FILE_JPG])
+        self.assertEqual(times, {TEST_FILE_MTS: 1447729200, TEST_FILE_MP4: 1444717604, TEST_FILE_JPG: 1435117933})
+
+    def test_it_should_read_a_batch_of_dates_with_a_single_exiftool_request(self):
+        self.test_model.get_dates_taken([TEST_FILE_MTS, TEST_FILE_MP4, TEST_FILE_JPG])
+        self.assertEqual(self.mock_exiftool_session.get_tags_batch.call_count, 1)
+        self.mock_exiftool_session.get_metadata.assert_not_called()
+
+    def test_it_should_only_request_the_date_taken_tags_for_a_batch_of_files(self):
+        self.test_model.get_dates_taken([TEST_FILE_MP4, TEST_FILE_JPG])
+        tags, _ = self.mock_exiftool_session.get_tags_batch.call_args[0]
+        self.assertItemsEqual(tags, ['QuickTime:CreateDate', 'EXIF:DateTimeOriginal'])
+
+    def test_it_should_return_an_error_for_files_in_a_batch_that_are_missing_a_create_tag(self):
+        times = self.test_model.get_dates_taken([TEST_FILE_JPG, MISSING_EVERYTHING_JPG, '/path/to/unknown.jpg'])
+        self.assertEqual(times[TEST_FILE_JPG], 1435117933)
+        self.assertIsInstance(times[MISSING_EVERYTHING_JPG], RuntimeError)
+        self.assertIsInstance(times['/path/to/unknown.jpg'], RuntimeError)
+
+    def test_it_should_return_an_error_for_files_in_a_batch_with_unrecognized_extensions(self):
+        times = self.test_model.get_dates_taken(['bogus.txt'])
+        self.assertIsInstance(times['bogus.txt'], RuntimeError)
+        self.mock_exiftool_session.get_tags_batch.assert_not_called()
+
     def test_it_should_return_the_right_rotation_value_if_it_exists_for_mp4_files(self):
         rotation = self.test_model.get_rotation(TEST_FILE_MP4)
         self.assertEqual(rotation, 90)
@@ -96,8 +186,17 @@ class TestMetadataHelper(unittest.TestCase):
 
     def test_it_should_correctly_set_rotation_on_image_files(self):
         self.test_model.set_rotation(TEST_FILE_JPG, 3)
-        self.mock_exiftool_instance.execute.assert_called_once_with('-EXIF:Orientation=3', '-n', '-overwrite_original',
-                                                                    TEST_FILE_JPG)
+        self.mock_exiftool_session.execute.assert_called_once_with('-EXIF:Orientation=3', '-n', '-overwrite_original',
+                                                                   TEST_FILE_JPG)
+
+    def test_it_should_reuse_the_same_exiftool_session_for_every_file(self):
+        self.test_model.get_date_taken(TEST_FILE_JPG)
+        self.test_model.get_rotation(TEST_FILE_JPG)
+        self.assertEqual(self.mock_exiftool_session.get_metadata.call_count, 2)
+
+    def test_it_should_close_the_exiftool_session(self):
+        self.test_model.close()
+        self.mock_exiftool_session.close.assert_called_once_with()
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,69 @@
+import os
+import struct
+import unittest
+
+from mp4_box_reader import Mp4BoxReader
+from test.temp_dir_test_case import TempDirTestCase
+
+CREATION_TIME = 3527540804  # 2015-10-13 00:26:44 UTC, in seconds since 1904
+
+
+def box(box_type, payload):
+    return struct.pack('>I4s', len(payload) + 8, box_type) + payload
+
+
+def large_box(box_type, payload):
+    return struct.pack('>I4sQ', 1, box_type, len(payload) + 16) + payload
+
+
+def mvhd(creation_time, version=0):
+    if version == 1:
+        return box('mvhd', struct.pack('>B3xQQIQ', 1, creation_time, creation_time, 1000, 0))
+
+    return box('mvhd', struct.pack('>B3xIIII', 0, creation_time, creation_time, 1000, 0))
+
+
+class TestMp4BoxReader(TempDirTestCase):
+    def setUp(self):
+        super(TestMp4BoxReader, self).setUp()
+        self.test_model = Mp4BoxReader()
+
+    def __read(self, *boxes):
+        path_to_file = os.path.join(self.temp_dir, 'file.mp4')
+        with open(path_to_file, 'wb') as f:
+            for b in boxes:
+                f.write(b)
+
+        return self.test_model.read_metadata(path_to_file)
+
+    def test_it_should_read_the_create_date_when_moov_comes_first(self):
+        metadata = self.__read(box('ftyp', 'isom'), box('moov', mvhd(CREATION_TIME)), box('mdat', 'x' * 1024))
+        self.assertEqual(metadata, {'QuickTime:CreateDate': '2015:10:13 00:26:44'})
+
+    def test_it_should_read_the_create_date_when_moov_comes_after_the_media_data(self):
+        metadata = self.__read(box('ftyp', 'isom'), large_box('mdat', 'x' * 4096), box('moov', mvhd(CREATION_TIME)))
+        self.assertEqual(metadata, {'QuickTime:CreateDate': '2015:10:13 00:26:44'})
+
+    def test_it_should_find_mvhd_after_other_boxes_in_moov(self):
+        metadata = self.__read(box('ftyp', 'isom'), box('moov', box('udta', 'x' * 16) + mvhd(CREATION_TIME)))
+        self.assertEqual(metadata, {'QuickTime:CreateDate': '2015:10:13 00:26:44'})
+
+    def test_it_should_read_version_1_movie_headers(self):
+        metadata = self.__read(box('ftyp', 'isom'), box('moov', mvhd(CREATION_TIME, version=1)))
+        self.assertEqual(metadata, {'QuickTime:CreateDate': '2015:10:13 00:26:44'})
+
+    def test_it_should_return_nothing_if_the_create_date_isnt_set(self):
+        self.assertEqual(self.__read(box('ftyp', 'isom'), box('moov', mvhd(0))), {})
+
+    def test_it_should_return_nothing_if_there_is_no_moov_box(self):
+        self.assertEqual(self.__read(box('ftyp', 'isom'), box('mdat', 'x' * 1024)), {})
+
+    def test_it_should_return_nothing_if_the_file_is_truncated(self):
+        self.assertEqual(self.__read(box('ftyp', 'isom'), box('moov', mvhd(CREATION_TIME))[:-10]), {})
+
+    def test_it_should_return_nothing_if_the_file_doesnt_exist(self):
+        self.assertEqual(self.test_model.read_metadata(os.path.join(self.temp_dir, 'missing.mp4')), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,12 +2,16 @@ import unittest
 import util
 
 from config import Config
+from libmtp_driver import LibMTPDriver
 from mock import ANY
+from mock import call
 from mock import MagicMock
 from mock import patch
 from mtp_device import MTPDevice
 from mtp_driver import MTPDriver
 from mtp_object import MTPObject
+from mtp_presence import MTPPresence
+from transfer_ledger import TransferLedger
 
 
 class TestMTPDevice(unittest.TestCase):
@@ -38,8 +42,10 @@ class TestMTPDevice(unittest.TestCase):
         self.mock_config.mtp_media_directories.return_value = ['DCIM', 'Pictures']
         self.mock_config.haystack_root.return_value = '/haystack'
         self.mock_config.staging_directory.return_value = '/haystack/staging/serial-number'
+        self.mock_config.max_concurrent_transfers.return_value = 2
 
         self.mock_mtp = MagicMock(spec=MTPDriver)
+        self.mock_mtp.can_list_folders.return_value = False
         self.setUp_mtp_get_folder_list(self.mock_mtp)
         self.setUp_mtp_get_filelisting(self.mock_mtp)
         self.mock_mtp.detect_device.return_value = {
@@ -50,12 +56,57 @@ class TestMTPDevice(unittest.TestCase):
 
         self.mock_util = MagicMock(spec=util.Util)
 
-        self.test_model = MTPDevice(self.mock_config, self.mock_mtp, self.mock_util)
+        self.mock_ledger = MagicMock(spec=TransferLedger)
+        self.mock_ledger.has_transferred.return_value = False
+
+        self.mock_presence = MagicMock(spec=MTPPresence)
+        self.mock_presence.may_be_connected.return_value = True
+
+        self.test_model = MTPDevice(self.mock_config, self.mock_mtp, self.mock_util, self.mock_ledger,
+                                    self.mock_presence)
+
+    def setUp_mtp_list_folder(self):
+        children = {
+            None: ([self.mock_folder('Music', 1), self.mock_folder('DCIM', 5), self.mock_folder('Pictures', 6)], []),
+            5: ([self.mock_folder('Camera', 15, 5)], [self.mock_file('IMG_0001.jpg', 40, 5, 1024)]),
+            6: ([self.mock_folder('Screenshots', 7, 6), self.mock_folder('Messenger', 8, 6)],
+                [self.mock_file('wallpaper.jpg', 41, 6, 1024)]),
+            7: ([], [self.mock_file('Screenshot_1.jpg', 42, 7, 1024)]),
+            15: ([], [self.mock_file('IMG_1234.jpg', 33, 15, 2048)])
+        }
+        self.mock_mtp = MagicMock(spec=LibMTPDriver)
+        self.mock_mtp.detect_device.return_value = {'manufacturer': 'LG', 'serial': 'serial-number', 'model': 'Moto X'}
+        self.mock_mtp.can_list_folders.return_value = True
+        self.mock_mtp.list_folder.side_effect = lambda folder_id: children[folder_id]
+        self.mock_config.mtp_media_directories.return_value = ['DCIM', '/Pictures/Screenshots']
+        self.test_model = MTPDevice(self.mock_config, self.mock_mtp, self.mock_util, self.mock_ledger,
+                                    self.mock_presence)
+
+    def test_transfer_media_should_list_only_the_media_directories_when_folders_can_be_listed(self):
+        self.setUp_mtp_list_folder()
+        self.test_model.transfer_media()
+        self.assertEqual(self.mock_mtp.list_folder.call_args_list, [call(None), call(5), call(6), call(15), call(7)])
+        self.mock_mtp.get_filelisting.assert_not_called()
+        self.mock_mtp.get_folder_list.assert_not_called()
+
+    def test_transfer_media_should_transfer_media_from_inside_the_media_directories(self):
+        self.setUp_mtp_list_folder()
+        self.test_model.transfer_media()
+        self.assertEqual(self.mock_mtp.get_file_to_file.call_args_list,
+                         [call(40, '/haystack/staging/serial-number/IMG_0001.jpg'),
+                          call(33, '/haystack/staging/serial-number/IMG_1234.jpg'),
+                          call(42, '/haystack/staging/serial-number/Screenshot_1.jpg')])
 
     def test_transfer_media_should_do_nothing_if_no_devices_are_connected(self):
         self.mock_mtp.detect_device.return_value = None
         self.test_model.transfer_media()
         self.mock_mtp.get_folder_list.assert_not_called()
+        self.mock_presence.mark_not_connected.assert_called_once_with()
+
+    def test_transfer_media_should_not_look_for_devices_if_none_can_be_connected(self):
+        self.mock_presence.may_be_connected.return_value = False
+        self.test_model.transfer_media()
+        self.mock_mtp.detect_device.assert_not_called()
 
     def test_transfer_media_should_only_transfer_media_from_proper_directories(self):
         self.test_model.transfer_media()
@@ -80,6 +131,34 @@ class TestMTPDevice(unittest.TestCase):
         self.test_model.transfer_media()
         self.mock_mtp.delete_object.assert_called_once_with(33)
 
+    @patch('os.path.getsize')
+    @patch('os.path.isfile')
+    def test_transfer_media_should_report_each_verified_transfer(self, mock_isfile, mock_getsize):
+        mock_isfile.return_value = True
+        mock_getsize.return_value = 2048
+        on_transferred = MagicMock()
+
+        self.test_model.transfer_media(on_transferred)
+        on_transferred.assert_called_once_with('serial-number', '/haystack/staging/serial-number/IMG_1234.jpg')
+
+    @patch('os.path.getsize')
+    def test_transfer_media_should_not_report_failed_transfers(self, mock_getsize):
+        mock_getsize.return_value = 2047
+        on_transferred = MagicMock()
+
+        self.test_model.transfer_media(on_transferred)
+        on_transferred.assert_not_called()
+
+    def test_transfer_media_should_close_the_device_when_done(self):
+        self.test_model.transfer_media()
+        self.mock_mtp.close.assert_called_once_with()
+
+    def test_transfer_media_should_close_the_device_if_the_transfer_fails(self):
+        self.mock_mtp.get_file_to_file.side_effect = RuntimeError
+        with self.assertRaises(RuntimeError):
+            self.test_model.transfer_media()
+        self.mock_mtp.close.assert_called_once_with()
+
     @patch('os.path.isfile')
     def test_transfer_media_should_not_delete_media_if_it_didnt_transfer(self, mock_isfile):
         mock_isfile.return_value = False
@@ -94,6 +173,56 @@ class TestMTPDevice(unittest.TestCase):
         self.test_model.transfer_media()
         self.mock_mtp.delete_object.assert_not_called()
 
+    @patch('os.path.getsize')
+    @patch('os.path.isfile')
+    def test_transfer_media_should_record_verified_transfers_until_they_are_deleted(self, mock_isfile, mock_getsize):
+        mock_isfile.return_value = True
+        mock_getsize.return_value = 2048
+
+        self.test_model.transfer_media()
+        transferred = self.mock_file('IMG_1234.jpg', 33, 20, 2048)
+        self.mock_ledger.record_transfer.assert_called_once_with('serial-number', transferred)
+        self.mock_ledger.forget_transfer.assert_called_once_with('serial-number', transferred)
+
+    @patch('os.path.getsize')
+    def test_transfer_media_should_not_record_failed_transfers(self, mock_getsize):
+        mock_getsize.return_value = 2047
+
+        self.test_model.transfer_media()
+        self.mock_ledger.record_transfer.assert_not_called()
+
+    def test_transfer_media_should_only_retry_the_delete_for_files_already_transferred(self):
+        self.mock_ledger.has_transferred.return_value = True
+        on_transferred = MagicMock()
+
+        self.test_model.transfer_media(on_transferred)
+        self.mock_mtp.get_file_to_file.assert_not_called()
+        self.mock_mtp.delete_object.assert_called_once_with(33)
+        self.mock_ledger.forget_transfer.assert_called_once_with('serial-number', ANY)
+        on_transferred.assert_not_called()
+
+    @patch('os.path.getsize')
+    @patch('os.path.isfile')
+    def test_transfer_media_should_keep_going_if_a_delete_fails(self, mock_isfile, mock_getsize):
+        mock_isfile.return_value = True
+        mock_getsize.return_value = 2048
+        self.mock_mtp.delete_object.side_effect = RuntimeError('Unable to delete object from MTP device!')
+        on_transferred = MagicMock()
+
+        self.test_model.transfer_media(on_transferred)
+        self.mock_ledger.record_transfer.assert_called_once_with('serial-number', ANY)
+        self.mock_ledger.forget_transfer.assert_not_called()
+        on_transferred.assert_called_once_with('serial-number', '/haystack/staging/serial-number/IMG_1234.jpg')
+
+    def test_transfer_media_should_forget_transfers_of_files_no_longer_on_the_device(self):
+        self.test_model.transfer_media()
+        self.mock_ledger.forget_missing.assert_called_once_with('serial-number',
+                                                                [self.mock_file('IMG_1234.jpg', 33, 20, 2048)])
+
+    def test_close_should_close_the_ledger(self):
+        self.test_model.close()
+        self.mock_ledger.close.assert_called_once_with()
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -67,6 +67,9 @@ class TestMTPDriver(unittest.TestCase):
 
         return contents
 
+    def __stream_resource(self, resource_name):
+        return iter(self.__get_resource(resource_name).splitlines())
+
     def test_it_should_know_if_no_devices_are_connected(self):
         self.mock_executor.execute_output.return_value = self.__get_resource(MTP_DETECT_NOT_CONNECTED_RESOURCE)
         self.assertFalse(self.test_model.detect_device())
@@ -76,14 +79,27 @@ class TestMTPDriver(unittest.TestCase):
         self.assertEqual(EXPECTED_DEVICE_INFO, self.test_model.detect_device())
 
     def test_it_should_accurately_describe_the_devices_folders(self):
-        self.mock_executor.execute_output.return_value = self.__get_resource(MTP_FOLDERS_CONNECTED_RESOURCE)
-        actual_folder_list = self.test_model.get_folder_list()
+        self.mock_executor.execute_lines.return_value = self.__stream_resource(MTP_FOLDERS_CONNECTED_RESOURCE)
+        actual_folder_list = list(self.test_model.get_folder_list())
         self.assertItemsEqual(actual_folder_list, EXPECTED_FOLDER_STRUCTURE)
+        self.mock_executor.execute_lines.assert_called_once_with(['mtp-folders'])
 
     def test_it_should_accurately_describe_the_file_structure(self):
-        self.mock_executor.execute_output.return_value = self.__get_resource(MTP_FILES_CONNECTED_RESOURCE)
-        actual_file_list = self.test_model.get_filelisting()
+        self.mock_executor.execute_lines.return_value = self.__stream_resource(MTP_FILES_CONNECTED_RESOURCE)
+        actual_file_list = list(self.test_model.get_filelisting())
         self.assertEqual(actual_file_list, EXPECTED_FILE_STRUCTURE)
+        self.mock_executor.execute_lines.assert_called_once_with(['mtp-files'])
+
+    def test_it_should_yield_files_before_the_listing_is_finished(self):
+        lines = self.__stream_resource(MTP_FILES_CONNECTED_RESOURCE)
+        self.mock_executor.execute_lines.return_value = lines
+        first_file = next(self.test_model.get_filelisting())
+        self.assertEqual(first_file, EXPECTED_FILE_STRUCTURE[0])
+        self.assertIn('File ID: 11', list(lines))
+
+    def test_it_should_describe_a_device_without_folders(self):
+        self.mock_executor.execute_lines.return_value = iter(['Attempting to connect device(s)', 'OK.'])
+        self.assertEqual(list(self.test_model.get_folder_list()), [])
 
     def test_it_should_properly_copy_a_file(self):
         self.test_model.get_file_to_file(42, '/root/staging/id/file.jpg')
@@ -93,6 +109,13 @@ class TestMTPDriver(unittest.TestCase):
         self.test_model.delete_object(42)
         self.mock_executor.execute.assert_called_once_with(['mtp-delfile', '-n', '42'])
 
+    def test_it_should_not_be_able_to_list_single_folders(self):
+        self.assertFalse(self.test_model.can_list_folders())
+
+    def test_it_should_not_need_to_release_anything_when_closed(self):
+        self.test_model.close()
+        self.mock_executor.execute.assert_not_called()
+
 
 if __name__ == '__main__':
     unittest.main()
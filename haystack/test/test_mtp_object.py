@@ -23,3 +23,13 @@ class TestMTPObject(unittest.TestCase):
         other = MTPObject(42, 'file.jpg', 2, 2356)
         self.assertEqual(self.test_model, other)
         self.assertTrue(self.test_model == other)
+
+    def test_it_should_know_when_objects_differ(self):
+        self.assertTrue(self.test_model != MTPObject(42, 'file.jpg', 2, 1))
+
+    def test_it_should_describe_itself(self):
+        self.assertEqual(str(self.test_model), str({'id': 42, 'name': 'file.jpg', 'parent_id': 2, 'size': 2356}))
+
+    def test_it_should_not_accept_unknown_attributes(self):
+        with self.assertRaises(AttributeError):
+            self.test_model.unknown = True
@@ -0,0 +1,97 @@
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+
+from mtp_presence import MTPPresence
+
+logging.disable(logging.CRITICAL)
+
+
+class TestMTPPresence(unittest.TestCase):
+    def setUp(self):
+        self.sysfs_root = tempfile.mkdtemp()
+        self.__add_device('usb1', 1)
+        self.__add_device('1-1', 2)
+        self.__add_interface('1-1:1.0', '03')
+
+        self.test_model = MTPPresence(self.sysfs_root)
+
+    def tearDown(self):
+        shutil.rmtree(self.sysfs_root)
+
+    def __write_attribute(self, entry, attribute, value):
+        with open(os.path.join(self.sysfs_root, entry, attribute), 'w') as f:
+            f.write(value + '\n')
+
+    def __add_device(self, name, devnum):
+        os.mkdir(os.path.join(self.sysfs_root, name))
+        self.__write_attribute(name, 'devnum', str(devnum))
+
+    def __add_interface(self, name, interface_class, interface_name=None):
+        os.mkdir(os.path.join(self.sysfs_root, name))
+        self.__write_attribute(name, 'bInterfaceClass', interface_class)
+        if interface_name is not None:
+            self.__write_attribute(name, 'interface', interface_name)
+
+    def __plug_in_phone(self, devnum=3):
+        self.__add_device('1-2', devnum)
+        self.__add_interface('1-2:1.0', 'ff', 'MTP')
+
+    def __unplug_phone(self):
+        shutil.rmtree(os.path.join(self.sysfs_root, '1-2'))
+        shutil.rmtree(os.path.join(self.sysfs_root, '1-2:1.0'))
+
+    def test_it_should_know_no_mtp_devices_can_be_connected(self):
+        self.assertFalse(self.test_model.may_be_connected())
+
+    def test_it_should_recognize_devices_with_an_mtp_interface(self):
+        self.__plug_in_phone()
+        self.assertTrue(self.test_model.may_be_connected())
+
+    def test_it_should_recognize_still_image_devices(self):
+        self.__add_device('1-3', 4)
+        self.__add_interface('1-3:1.0', '06')
+        self.assertTrue(self.test_model.may_be_connected())
+
+    def test_it_should_keep_reporting_a_device_that_is_still_connected(self):
+        self.__plug_in_phone()
+        self.assertTrue(self.test_model.may_be_connected())
+        self.assertTrue(self.test_model.may_be_connected())
+
+    def test_it_should_notice_when_a_device_is_plugged_in(self):
+        self.assertFalse(self.test_model.may_be_connected())
+        self.__plug_in_phone()
+        self.assertTrue(self.test_model.may_be_connected())
+
+    def test_it_should_notice_when_a_device_is_unplugged(self):
+        self.__plug_in_phone()
+        self.assertTrue(self.test_model.may_be_connected())
+        self.__unplug_phone()
+        self.assertFalse(self.test_model.may_be_connected())
+
+    def test_it_should_only_examine_interfaces_when_the_devices_change(self):
+        self.assertFalse(self.test_model.may_be_connected())
+        self.__write_attribute('1-1:1.0', 'bInterfaceClass', '06')
+        self.assertFalse(self.test_model.may_be_connected())
+
+    def test_it_should_not_look_again_after_finding_nothing_until_the_devices_change(self):
+        self.__plug_in_phone()
+        self.assertTrue(self.test_model.may_be_connected())
+        self.test_model.mark_not_connected()
+        self.assertFalse(self.test_model.may_be_connected())
+
+        self.__unplug_phone()
+        self.__plug_in_phone(devnum=4)
+        self.assertTrue(self.test_model.may_be_connected())
+
+    def test_it_should_always_look_for_devices_without_sysfs(self):
+        test_model = MTPPresence(os.path.join(self.sysfs_root, 'missing'))
+        self.assertTrue(test_model.may_be_connected())
+        test_model.mark_not_connected()
+        self.assertTrue(test_model.may_be_connected())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,15 +1,19 @@
 import config
 import logging
 import mtp_device
-import sched
 import unittest
 import usb_device
 import usb_device_manager
 import indexer
+import change_watcher
+import indexing_pipeline
+import device_workers
 
 from mock import ANY
 from mock import call
 from mock import MagicMock
+from mock import patch
+from indexer import RunSummary
 from starter import Starter
 
 logging.disable(logging.CRITICAL)
@@ -20,10 +24,13 @@ class TestStarter(unittest.TestCase):
     def setUp(self):
         self.mock_config = MagicMock(config.Config)
         self.mock_config.indexer_delay.return_value = 999
+        self.mock_config.indexer_max_delay.return_value = 3000
+        self.mock_config.indexer_run_budget.return_value = 500
         self.mock_config.usb_mount_points.return_value = ['/media']
         self.mock_config.usb_devices_to_ignore.return_value = ['ignore-me']
+        self.mock_config.stream_transfers.return_value = True
+        self.mock_config.max_concurrent_transfers.return_value = 2
 
-        self.mock_scheduler = MagicMock(spec=sched.scheduler)
         self.mock_mtp_device = MagicMock(spec=mtp_device.MTPDevice)
 
         self.mock_usb_device_manager = MagicMock(spec=usb_device_manager.USBDeviceManager)
@@ -31,15 +38,36 @@ class TestStarter(unittest.TestCase):
                                                                           ('/media/dev2', 'dev2')]
 
         self.mock_usb_device = MagicMock(spec=usb_device.USBDevice)
+        # Every USB device is transferred from on its own thread, and a mock creates its methods on first use without a
+        # lock, so create this one up front for all of them to share.
+        self.mock_usb_device.transfer_media.return_value = None
 
         self.mock_indexer = MagicMock(spec=indexer.Indexer)
+        self.mock_indexer.run.return_value = RunSummary(2, 2, False)
 
-        self.test_model = Starter(self.mock_config, self.mock_scheduler, self.mock_mtp_device,
-                                  self.mock_usb_device_manager, self.mock_usb_device, self.mock_indexer)
+        # Stop after the first wait, unless a test needs more runs.
+        self.mock_watcher = MagicMock(spec=change_watcher.ChangeWatcher)
+        self.mock_watcher.wait.side_effect = lambda delay: self.__stop_after_runs(1)
+        self.mock_watcher.devices_changed.return_value = False
+
+        self.mock_pipeline = MagicMock(spec=indexing_pipeline.IndexingPipeline)
+        self.mock_pipeline.finish.return_value = RunSummary(0, 0, False)
+
+        self.test_model = Starter(self.mock_config, self.mock_mtp_device, self.mock_usb_device_manager,
+                                  self.mock_usb_device, self.mock_indexer, self.mock_watcher, self.mock_pipeline)
+
+    def __stop_after_runs(self, runs):
+        if self.mock_indexer.run.call_count >= runs:
+            self.test_model.running = False
+
+    def __run_with_summaries(self, *summaries):
+        self.mock_indexer.run.side_effect = list(summaries)
+        self.mock_watcher.wait.side_effect = lambda delay: self.__stop_after_runs(len(summaries))
+        self.test_model.start()
 
     def test_it_should_transfer_media_from_an_mtp_device(self):
         self.test_model.start()
-        self.mock_mtp_device.transfer_media.assert_called_once_with()
+        self.mock_mtp_device.transfer_media.assert_called_once_with(self.mock_pipeline.submit)
 
     def test_it_should_use_the_right_mount_points_for_usb_devices(self):
         self.test_model.start()
@@ -51,32 +79,204 @@ class TestStarter(unittest.TestCase):
 
     def test_it_should_transfer_media_from_usb_devices(self):
         self.test_model.start()
-        calls = [call('/media/dev1', 'dev1'), call('/media/dev2', 'dev2')]
-        self.mock_usb_device.transfer_media.assert_has_calls(calls)
+        calls = [call('/media/dev1', 'dev1', self.mock_pipeline.submit),
+                 call('/media/dev2', 'dev2', self.mock_pipeline.submit)]
+        self.mock_usb_device.transfer_media.assert_has_calls(calls, any_order=True)
 
-    def test_it_should_start_the_indexer(self):
+    def test_it_should_forget_usb_devices_that_are_no_longer_mounted(self):
         self.test_model.start()
-        self.mock_indexer.run.assert_called_once_with()
+        self.mock_usb_device.forget_missing.assert_called_once_with(['/media/dev1', '/media/dev2'])
+
+    def test_it_should_start_the_indexer_with_the_run_budget(self):
+        self.test_model.start()
+        self.mock_indexer.run.assert_called_once_with(500)
 
     def test_it_should_catch_errors_in_the_indexer(self):
         self.mock_indexer.run.side_effect = RuntimeError
         self.test_model.start()
 
-    def test_it_should_use_the_config_value_to_schedule_jobs(self):
+    def test_it_should_forget_earlier_changes_before_looking_for_devices(self):
+        self.mock_usb_device_manager.get_devices_to_index.side_effect = \
+            lambda mounts, ignore: self.mock_watcher.mark.assert_called_once_with() or []
+        self.test_model.start()
+        self.mock_usb_device_manager.get_devices_to_index.assert_called_once_with(['/media'], ['ignore-me'])
+
+    def test_it_should_check_whether_devices_changed_once_a_run_finishes(self):
+        self.mock_indexer.run.side_effect = \
+            lambda max_files: self.mock_watcher.devices_changed.assert_not_called() or RunSummary(0, 0, False)
+        self.test_model.start()
+        self.mock_watcher.devices_changed.assert_called_once_with()
+
+    def test_it_should_check_whether_devices_changed_after_a_failed_run(self):
+        self.mock_pipeline.finish.side_effect = RuntimeError
+        # The indexer never runs, so stop on the first wait instead.
+        self.mock_watcher.wait.side_effect = lambda delay: setattr(self.test_model, 'running', False)
+        self.test_model.start()
+        self.mock_watcher.devices_changed.assert_called_once_with()
+
+    def test_it_should_start_the_next_run_right_away_when_devices_changed_during_a_run(self):
+        self.mock_watcher.devices_changed.side_effect = [True, False]
+        self.__run_with_summaries(RunSummary(0, 0, False), RunSummary(0, 0, False))
+        self.mock_watcher.wait.assert_called_once_with(999)
+
+    def test_it_should_wait_for_changes_for_at_most_the_configured_interval(self):
+        self.test_model.start()
+        self.mock_watcher.wait.assert_called_once_with(999)
+
+    def test_it_should_start_the_indexing_pipeline_before_transferring_media(self):
+        self.mock_mtp_device.transfer_media.side_effect = \
+            lambda on_transferred: self.mock_pipeline.start.assert_called_once_with()
+        self.test_model.start()
+
+    def test_it_should_finish_the_indexing_pipeline_before_running_the_indexer(self):
+        self.mock_indexer.run.side_effect = lambda max_files: \
+            self.mock_pipeline.finish.assert_called_once_with() or RunSummary(0, 0, False)
+        self.test_model.start()
+
+    def test_it_should_finish_the_indexing_pipeline_if_a_transfer_fails(self):
+        self.mock_mtp_device.transfer_media.side_effect = RuntimeError
+        self.test_model.run_once(500)
+        self.mock_pipeline.finish.assert_called_once_with()
+
+    def test_it_should_index_staged_media_if_a_transfer_fails(self):
+        self.mock_usb_device_manager.get_devices_to_index.side_effect = RuntimeError
+        self.assertEqual(self.test_model.run_once(500), RunSummary(2, 2, False))
+        self.mock_indexer.run.assert_called_once_with(500)
+
+    # Signals are handled on the main thread, which is waiting for the transfers to finish.
+    def test_it_should_stop_running_when_asked_to_exit_during_a_transfer(self):
+        mock_workers = MagicMock(spec=device_workers.DeviceWorkers)
+        mock_workers.run.side_effect = SystemExit(0)
+        self.test_model = Starter(self.mock_config, self.mock_mtp_device, self.mock_usb_device_manager,
+                                  self.mock_usb_device, self.mock_indexer, self.mock_watcher, self.mock_pipeline,
+                                  mock_workers)
+        with self.assertRaises(SystemExit):
+            self.test_model.start()
+        self.mock_watcher.wait.assert_not_called()
+
+    def test_it_should_stop_running_when_asked_to_exit_while_indexing(self):
+        self.mock_indexer.run.side_effect = SystemExit(0)
+        with self.assertRaises(SystemExit):
+            self.test_model.start()
+        self.mock_watcher.wait.assert_not_called()
+
+    def test_it_should_keep_running_when_a_transfer_fails(self):
+        self.mock_mtp_device.transfer_media.side_effect = [RuntimeError, None]
+        self.mock_watcher.wait.side_effect = lambda delay: self.__stop_after_runs(2)
+        self.test_model.start()
+        self.assertEqual(self.mock_mtp_device.transfer_media.call_count, 2)
+        self.assertEqual(self.mock_indexer.run.call_args_list, [call(500), call(500)])
+        self.assertEqual(self.mock_watcher.wait.call_args_list, [call(999), call(999)])
+
+    def test_it_should_transfer_from_every_device_at_the_same_time(self):
+        mock_workers = MagicMock(spec=device_workers.DeviceWorkers)
+        self.test_model = Starter(self.mock_config, self.mock_mtp_device, self.mock_usb_device_manager,
+                                  self.mock_usb_device, self.mock_indexer, self.mock_watcher, self.mock_pipeline,
+                                  mock_workers)
+        self.test_model.run_once(500)
+
+        transfers = mock_workers.run.call_args[0][0]
+        self.assertEqual([device_id for device_id, _ in transfers], ['MTP', 'dev1', 'dev2'])
+        self.mock_usb_device.transfer_media.assert_not_called()
+
+        for _, transfer in transfers:
+            transfer()
+        self.mock_mtp_device.transfer_media.assert_called_once_with(self.mock_pipeline.submit)
+        self.mock_usb_device.transfer_media.assert_has_calls([call('/media/dev1', 'dev1', self.mock_pipeline.submit),
+                                                              call('/media/dev2', 'dev2', self.mock_pipeline.submit)])
+
+    def test_it_should_not_stream_transfers_unless_configured_to(self):
+        self.mock_config.stream_transfers.return_value = False
+        self.test_model.start()
+        self.mock_pipeline.start.assert_not_called()
+        self.mock_mtp_device.transfer_media.assert_called_once_with(None)
+
+    def test_it_should_count_streamed_files_as_work(self):
+        self.mock_pipeline.finish.return_value = RunSummary(4, 4, False)
+        self.assertEqual(self.test_model.run_once(500), RunSummary(6, 6, False))
+
+    def test_it_should_keep_running_until_stopped(self):
+        self.__run_with_summaries(RunSummary(1, 1, False), RunSummary(1, 1, False), RunSummary(1, 1, False))
+        self.assertEqual(self.mock_indexer.run.call_count, 3)
+        self.assertEqual(self.mock_watcher.wait.call_count, 3)
+
+    def test_it_should_start_the_next_run_right_away_when_a_run_reaches_its_budget(self):
+        self.__run_with_summaries(RunSummary(500, 500, True), RunSummary(3, 3, False))
+        self.mock_watcher.wait.assert_called_once_with(999)
+
+    def test_it_should_wait_after_a_run_that_reaches_its_budget_without_indexing_anything(self):
+        self.__run_with_summaries(RunSummary(500, 0, True))
+        self.mock_watcher.wait.assert_called_once_with(999)
+
+    def test_it_should_back_off_while_runs_find_nothing_to_index(self):
+        self.__run_with_summaries(RunSummary(0, 0, False), RunSummary(0, 0, False), RunSummary(0, 0, False),
+                                  RunSummary(0, 0, False))
+        self.assertEqual(self.mock_watcher.wait.call_args_list, [call(999), call(1998), call(3000), call(3000)])
+
+    def test_it_should_stop_backing_off_once_a_run_finds_something_to_index(self):
+        self.__run_with_summaries(RunSummary(0, 0, False), RunSummary(0, 0, False), RunSummary(1, 0, False),
+                                  RunSummary(0, 0, False))
+        self.assertEqual(self.mock_watcher.wait.call_args_list, [call(999), call(1998), call(999), call(999)])
+
+    def test_it_should_back_off_when_the_indexer_fails(self):
+        self.mock_indexer.run.side_effect = [RuntimeError, RuntimeError]
+        self.mock_watcher.wait.side_effect = lambda delay: self.__stop_after_runs(2)
+        self.test_model.start()
+        self.assertEqual(self.mock_watcher.wait.call_args_list, [call(999), call(1998)])
+
+    @patch('starter.logging')
+    @patch('time.time')
+    def test_it_should_report_runs_that_overrun_their_slot(self, mock_time, mock_logging):
+        mock_time.side_effect = [0, 1000]
         self.test_model.start()
-        self.mock_scheduler.enter.assert_called_once_with(999, ANY, ANY, argument=ANY)
+        mock_logging.warn.assert_called_once_with(ANY, 1000, 999)
 
-    def test_it_should_use_a_zero_priority_when_scheduling_jobs(self):
+    @patch('starter.logging')
+    @patch('time.time')
+    def test_it_should_not_report_runs_that_fit_in_their_slot(self, mock_time, mock_logging):
+        mock_time.side_effect = [0, 998]
         self.test_model.start()
-        self.mock_scheduler.enter.assert_called_once_with(ANY, 0, ANY, argument=ANY)
+        mock_logging.warn.assert_not_called()
 
-    def test_it_should_not_include_any_arguments(self):
+    def test_it_should_remove_copies_left_by_interrupted_transfers_before_the_first_run(self):
+        transfer_media = self.mock_usb_device.transfer_media
+        self.mock_usb_device.remove_temp_files.side_effect = lambda: transfer_media.assert_not_called()
         self.test_model.start()
-        self.mock_scheduler.enter.assert_called_once_with(ANY, ANY, ANY, argument=())
+        self.mock_usb_device.remove_temp_files.assert_called_once_with()
 
-    def test_it_should_run_the_scheduler(self):
+    def test_it_should_stop_running_when_stopped(self):
+        self.mock_watcher.wait.side_effect = lambda delay: self.test_model.stop()
         self.test_model.start()
-        self.mock_scheduler.run.assert_called_once_with()
+        self.mock_indexer.run.assert_called_once_with(500)
+
+    # The indexer's worker pool has to start before anything else opens connections or threads.
+    @patch('starter.USBDevice')
+    @patch('starter.MTPDevice')
+    @patch('starter.Indexer')
+    def test_it_should_create_the_indexer_before_the_devices(self, mock_indexer_class, mock_mtp_device_class,
+                                                             mock_usb_device_class):
+        def assert_indexer_created(*args, **kwargs):
+            mock_indexer_class.assert_called_once_with(self.mock_config)
+
+        mock_mtp_device_class.side_effect = assert_indexer_created
+        mock_usb_device_class.side_effect = assert_indexer_created
+        Starter(self.mock_config, usb_device_manager=self.mock_usb_device_manager, watcher=self.mock_watcher,
+                pipeline=self.mock_pipeline)
+        mock_mtp_device_class.assert_called_once_with(self.mock_config, transfer_slots=ANY)
+        mock_usb_device_class.assert_called_once_with(self.mock_config, transfer_slots=ANY)
+
+    def test_it_should_close_the_indexer_when_stopped(self):
+        self.test_model.stop()
+        self.mock_indexer.close.assert_called_once_with()
+
+    def test_it_should_close_the_watcher_when_stopped(self):
+        self.test_model.stop()
+        self.mock_watcher.close.assert_called_once_with()
+
+    def test_it_should_close_the_devices_when_stopped(self):
+        self.test_model.stop()
+        self.mock_mtp_device.close.assert_called_once_with()
+        self.mock_usb_device.close.assert_called_once_with()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,77 @@
+import os
+import unittest
+
+from config import Config
+from content_hash import ContentHasher
+from failure_tracker import FailureTracker
+from hash_cache import HashCache
+from local_index import LocalIndex
+from mock import MagicMock
+from state_database import IN_MEMORY
+from state_database import open_state_database
+from test.temp_dir_test_case import TempDirTestCase
+from transfer_ledger import TransferLedger
+from transfer_manifest import TransferManifest
+from util import Util
+
+SCHEMA = ['CREATE TABLE IF NOT EXISTS things (name TEXT NOT NULL)']
+SELECT_TABLES = "SELECT name FROM sqlite_master WHERE type = 'table'"
+SYNCHRONOUS_NORMAL = 1
+
+
+class TestStateDatabase(TempDirTestCase):
+    def setUp(self):
+        super(TestStateDatabase, self).setUp()
+        self.path_to_database = os.path.join(self.temp_dir, 'state', 'state.db')
+        self.mock_config = MagicMock(spec=Config)
+        self.mock_config.state_database_path.return_value = self.path_to_database
+        self.mock_config.firebase_sync_enabled.return_value = False
+        self.mock_config.haystack_root.return_value = self.temp_dir
+
+    def test_it_should_create_the_directory_for_the_database(self):
+        open_state_database(self.mock_config, Util(), SCHEMA).close()
+        self.assertTrue(os.path.isfile(self.path_to_database))
+
+    def test_it_should_not_need_a_directory_for_a_database_in_memory(self):
+        mock_util = MagicMock(spec=Util)
+        open_state_database(self.mock_config, mock_util, SCHEMA, IN_MEMORY).close()
+        mock_util.mkdirp.assert_not_called()
+
+    def test_it_should_keep_tables_that_already_exist(self):
+        connection = open_state_database(self.mock_config, Util(), SCHEMA)
+        with connection:
+            connection.execute('INSERT INTO things VALUES (?)', ('thing',))
+        connection.close()
+
+        connection = open_state_database(self.mock_config, Util(), SCHEMA)
+        self.assertEqual(connection.execute('SELECT name FROM things').fetchall(), [('thing',)])
+        connection.close()
+
+    def test_it_should_return_text_as_it_was_stored(self):
+        connection = open_state_database(self.mock_config, Util(), SCHEMA, IN_MEMORY)
+        connection.execute('INSERT INTO things VALUES (?)', ('IMG_\xc3\xa9t\xc3\xa9.jpg',))
+        self.assertEqual(connection.execute('SELECT name FROM things').fetchone()[0], 'IMG_\xc3\xa9t\xc3\xa9.jpg')
+        connection.close()
+
+    def test_it_should_use_write_ahead_logging(self):
+        connection = open_state_database(self.mock_config, Util(), SCHEMA)
+        self.assertEqual(connection.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+        self.assertEqual(connection.execute('PRAGMA synchronous').fetchone()[0], SYNCHRONOUS_NORMAL)
+        connection.close()
+
+    def test_it_should_keep_the_state_of_every_store_in_the_same_database(self):
+        stores = [LocalIndex(self.mock_config), HashCache(self.mock_config, ContentHasher()),
+                  FailureTracker(self.mock_config), TransferLedger(self.mock_config),
+                  TransferManifest(self.mock_config)]
+        for store in stores:
+            store.close()
+
+        connection = open_state_database(self.mock_config, Util(), [])
+        tables = set(row[0] for row in connection.execute(SELECT_TABLES))
+        connection.close()
+        self.assertEqual(tables, set(['media', 'hashes', 'failures', 'mtp_transfers', 'usb_transfers']))
+        self.assertEqual(os.listdir(os.path.dirname(self.path_to_database)), ['state.db'])
+
+
+if __name__ == '__main__':
+    unittest.main()
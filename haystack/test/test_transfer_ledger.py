@@ -0,0 +1,83 @@
+import logging
+import os
+import unittest
+
+from config import Config
+from mock import MagicMock
+from mtp_object import MTPObject
+from state_database import IN_MEMORY
+from test.temp_dir_test_case import TempDirTestCase
+from transfer_ledger import TransferLedger
+from util import Util
+
+logging.disable(logging.CRITICAL)
+
+SERIAL = 'TA965195GE'
+
+
+class TestTransferLedger(unittest.TestCase):
+    def setUp(self):
+        self.file = MTPObject(43, 'IMG_20150613_115842622.jpg', 28, 1286823)
+        self.test_model = TransferLedger(MagicMock(spec=Config), MagicMock(spec=Util), IN_MEMORY)
+
+    def tearDown(self):
+        self.test_model.close()
+
+    def test_it_should_not_know_about_files_that_were_never_transferred(self):
+        self.assertFalse(self.test_model.has_transferred(SERIAL, self.file))
+
+    def test_it_should_remember_transferred_files(self):
+        self.test_model.record_transfer(SERIAL, self.file)
+        self.assertTrue(self.test_model.has_transferred(SERIAL, self.file))
+
+    def test_it_should_only_remember_files_for_the_device_they_came_from(self):
+        self.test_model.record_transfer(SERIAL, self.file)
+        self.assertFalse(self.test_model.has_transferred('other-serial', self.file))
+
+    def test_it_should_not_mistake_a_different_file_with_the_same_id(self):
+        self.test_model.record_transfer(SERIAL, self.file)
+        self.assertFalse(self.test_model.has_transferred(SERIAL, MTPObject(43, 'IMG_20160101_000000000.jpg', 28,
+                                                                           1286823)))
+        self.assertFalse(self.test_model.has_transferred(SERIAL, MTPObject(43, self.file.name, 28, 1)))
+
+    def test_it_should_allow_a_file_to_be_recorded_more_than_once(self):
+        self.test_model.record_transfer(SERIAL, self.file)
+        self.test_model.record_transfer(SERIAL, self.file)
+        self.assertTrue(self.test_model.has_transferred(SERIAL, self.file))
+
+    def test_it_should_forget_files_once_they_are_deleted(self):
+        self.test_model.record_transfer(SERIAL, self.file)
+        self.test_model.forget_transfer(SERIAL, self.file)
+        self.assertFalse(self.test_model.has_transferred(SERIAL, self.file))
+
+    def test_it_should_forget_files_that_are_no_longer_on_the_device(self):
+        remaining = MTPObject(44, 'IMG_\xc3\xa9t\xc3\xa9.jpg', 28, 1328437)
+        other_device_file = MTPObject(45, 'IMG_20150616_083227764.jpg', 28, 838619)
+        self.test_model.record_transfer(SERIAL, self.file)
+        self.test_model.record_transfer(SERIAL, remaining)
+        self.test_model.record_transfer('other-serial', other_device_file)
+
+        self.test_model.forget_missing(SERIAL, [remaining])
+
+        self.assertFalse(self.test_model.has_transferred(SERIAL, self.file))
+        self.assertTrue(self.test_model.has_transferred(SERIAL, remaining))
+        self.assertTrue(self.test_model.has_transferred('other-serial', other_device_file))
+
+
+class TestTransferLedgerOnDisk(TempDirTestCase):
+    def test_it_should_remember_transferred_files_after_a_restart(self):
+        mock_config = MagicMock(spec=Config)
+        mock_config.state_database_path.return_value = os.path.join(self.temp_dir, 'state.db')
+        file = MTPObject(43, 'IMG_20150613_115842622.jpg', 28, 1286823)
+
+        ledger = TransferLedger(mock_config, Util())
+        ledger.record_transfer(SERIAL, file)
+        ledger.close()
+
+        ledger = TransferLedger(mock_config, Util())
+        self.assertTrue(ledger.has_transferred(SERIAL, file))
+        ledger.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import logging
+import os
+import unittest
+
+from config import Config
+from mock import MagicMock
+from state_database import IN_MEMORY
+from test.temp_dir_test_case import TempDirTestCase
+from transfer_manifest import Transfer
+from transfer_manifest import TransferManifest
+from util import Util
+
+logging.disable(logging.CRITICAL)
+
+DEVICE_ID = 'my-dev'
+SOURCE_PATH = 'haystack-queue/IMG_0001.jpg'
+TEMP_FILE = '/haystack/staging/USB/.some-uuid.part'
+
+
+class TestTransferManifest(unittest.TestCase):
+    def setUp(self):
+        self.test_model = TransferManifest(MagicMock(spec=Config), MagicMock(spec=Util), IN_MEMORY)
+
+    def tearDown(self):
+        self.test_model.close()
+
+    def test_it_should_not_know_about_files_that_were_never_transferred(self):
+        self.assertIsNone(self.test_model.find_transfer(DEVICE_ID, SOURCE_PATH))
+
+    def test_it_should_record_transfers_as_unverified_when_they_start(self):
+        self.test_model.start_transfer(DEVICE_ID, SOURCE_PATH, 1024, 1434217122.5, TEMP_FILE)
+        self.assertEqual(self.test_model.find_transfer(DEVICE_ID, SOURCE_PATH),
+                         Transfer(SOURCE_PATH, 1024, 1434217122.5, TEMP_FILE, None))
+
+    def test_it_should_record_the_checksum_of_verified_transfers(self):
+        self.test_model.start_transfer(DEVICE_ID, SOURCE_PATH, 1024, 1434217122.5, TEMP_FILE)
+        self.test_model.verify_transfer(DEVICE_ID, SOURCE_PATH, 'some-checksum')
+        self.assertEqual(self.test_model.find_transfer(DEVICE_ID, SOURCE_PATH).checksum, 'some-checksum')
+
+    def test_it_should_start_over_when_a_transfer_is_started_again(self):
+        self.test_model.start_transfer(DEVICE_ID, SOURCE_PATH, 1024, 1434217122.5, TEMP_FILE)
+        self.test_model.verify_transfer(DEVICE_ID, SOURCE_PATH, 'some-checksum')
+        self.test_model.start_transfer(DEVICE_ID, SOURCE_PATH, 2048, 1434217199.0, TEMP_FILE)
+        self.assertEqual(self.test_model.find_transfer(DEVICE_ID, SOURCE_PATH),
+                         Transfer(SOURCE_PATH, 2048, 1434217199.0, TEMP_FILE, None))
+
+    def test_it_should_keep_transfers_from_each_device_apart(self):
+        self.test_model.start_transfer(DEVICE_ID, SOURCE_PATH, 1024, 1434217122.5, TEMP_FILE)
+        self.assertIsNone(self.test_model.find_transfer('other-dev', SOURCE_PATH))
+
+    def test_it_should_forget_finished_transfers(self):
+        self.test_model.start_transfer(DEVICE_ID, SOURCE_PATH, 1024, 1434217122.5, TEMP_FILE)
+        self.test_model.finish_transfer(DEVICE_ID, SOURCE_PATH)
+        self.assertIsNone(self.test_model.find_transfer(DEVICE_ID, SOURCE_PATH))
+
+
+class TestTransferManifestOnDisk(TempDirTestCase):
+    def test_it_should_remember_transfers_after_a_restart(self):
+        mock_config = MagicMock(spec=Config)
+        mock_config.state_database_path.return_value = os.path.join(self.temp_dir, 'state.db')
+
+        manifest = TransferManifest(mock_config, Util())
+        manifest.start_transfer(DEVICE_ID, SOURCE_PATH, 1024, 1434217122.5, TEMP_FILE)
+        manifest.close()
+
+        manifest = TransferManifest(mock_config, Util())
+        self.assertIsNotNone(manifest.find_transfer(DEVICE_ID, SOURCE_PATH))
+        manifest.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,17 +1,29 @@
 import config
+import errno
+import os
 import unittest
 import util
 
+from copy_engine import CopyEngine
+from copy_engine import load_libc
 from mock import MagicMock
+from mock import Mock
 from mock import call
 from mock import patch
+from state_database import IN_MEMORY
+from test.temp_dir_test_case import TempDirTestCase
+from transfer_manifest import TransferManifest
+from usb_device import find_mount_id
 from usb_device import USBDevice
 
+FILE_CONTENTS = 'not really a jpeg'
+FILE_HASH = '08a83d6686281a5a292732435b21f83a'
+
 
 def mock_walk(*args):
-    return [(args[0], None, ['file-top.jpg']),
-            (args[0] + '/subfolder1', None, ['file-1.jpg', 'unrecognized.txt']),
-            (args[0] + '/subfolder1/subfolder2', None, ['file-2.jpg'])]
+    return [(args[0], ['subfolder1'], ['file-top.jpg']),
+            (args[0] + '/subfolder1', ['subfolder2'], ['file-1.jpg', 'unrecognized.txt']),
+            (args[0] + '/subfolder1/subfolder2', [], ['file-2.jpg'])]
 
 
 def mock_isdir(*args):
@@ -28,8 +40,18 @@ def mock_join(*args):
     return '/'.join(args)
 
 
-class TestUSBDevice(unittest.TestCase):
+def write_mountinfo(path_to_mountinfo, mount_id, mount_point):
+    with open(path_to_mountinfo, 'w') as f:
+        f.write('22 1 8:2 / / rw,relatime shared:1 - ext4 /dev/sda2 rw\n')
+        f.write('{0} 22 8:17 / {1} rw,relatime shared:2 - vfat /dev/sdb1 rw\n'.format(mount_id, mount_point))
+
+
+class TestUSBDevice(TempDirTestCase):
     def setUp(self):
+        super(TestUSBDevice, self).setUp()
+        self.path_to_mountinfo = os.path.join(self.temp_dir, 'mountinfo')
+        write_mountinfo(self.path_to_mountinfo, 36, '/Volumes/my-dev')
+
         self.mock_walk_patcher = patch('os.walk')
         self.mock_walk = self.mock_walk_patcher.start()
         self.mock_walk.side_effect = mock_walk
@@ -42,23 +64,35 @@ class TestUSBDevice(unittest.TestCase):
         self.mock_join = self.mock_join_patcher.start()
         self.mock_join.side_effect = mock_join
 
-        self.mock_shutil_move_patcher = patch('shutil.move')
-        self.mock_shutil_move = self.mock_shutil_move_patcher.start()
+        self.mock_stat_patcher = patch('os.stat')
+        self.mock_stat = self.mock_stat_patcher.start()
+        self.mock_stat.return_value = Mock(st_mtime=1434217122, st_size=2048, st_dev=2065)
+
+        self.mock_rename_patcher = patch('os.rename')
+        self.mock_rename = self.mock_rename_patcher.start()
 
         self.mock_config = MagicMock(spec=config.Config)
         self.mock_config.usb_media_directories.return_value = ['to-index', 'also-to-index', 'third-to-index']
         self.mock_config.staging_directory.return_value = '/root/staging/device'
+        self.mock_config.max_concurrent_transfers.return_value = 2
 
         self.mock_util = MagicMock(spec=util.Util)
         self.mock_util.get_uuid.return_value = 'some-uuid'
 
-        self.test_model = USBDevice(self.mock_config, self.mock_util)
+        self.mock_copy_engine = MagicMock(spec=CopyEngine)
+
+        self.mock_manifest = MagicMock(spec=TransferManifest)
+        self.mock_manifest.find_transfer.return_value = None
+
+        self.test_model = USBDevice(self.mock_config, self.mock_util, copy_engine=self.mock_copy_engine,
+                                    manifest=self.mock_manifest, mountinfo_path=self.path_to_mountinfo)
 
     def tearDown(self):
         self.mock_walk_patcher.stop()
         self.mock_isdir_patcher.stop()
         self.mock_join_patcher.stop()
-        self.mock_shutil_move_patcher.stop()
+        self.mock_stat_patcher.stop()
+        self.mock_rename_patcher.stop()
 
     def test_transfer_media_should_use_the_same_staging_directory_for_all_usb_devices(self):
         self.test_model.transfer_media('/Volumes/my-dev', 'my-dev')
@@ -74,4 +108,281 @@ class TestUSBDevice(unittest.TestCase):
                  call('/Volumes/my-dev/also-to-index/subfolder1/file-1.jpg', '/root/staging/device/some-uuid.jpg'),
                  call('/Volumes/my-dev/also-to-index/subfolder1/subfolder2/file-2.jpg',
                       '/root/staging/device/some-uuid.jpg')]
-        self.mock_shutil_move.assert_has_calls(calls)
+        self.mock_rename.assert_has_calls(calls)
+
+    def test_transfer_media_should_not_need_the_manifest_for_files_on_the_same_filesystem(self):
+        self.test_model.transfer_media('/Volumes/my-dev', 'my-dev')
+        self.mock_manifest.start_transfer.assert_not_called()
+        self.mock_copy_engine.copy.assert_not_called()
+
+    def test_transfer_media_should_report_each_transferred_file(self):
+        on_transferred = MagicMock()
+        self.test_model.transfer_media('/Volumes/my-dev', 'my-dev', on_transferred)
+        self.assertEqual(on_transferred.call_count, 6)
+        on_transferred.assert_called_with('USB', '/root/staging/device/some-uuid.jpg')
+
+    def test_transfer_media_should_hold_a_transfer_slot_while_moving_each_file(self):
+        events = []
+        mock_slots = MagicMock()
+        mock_slots.__enter__.side_effect = lambda: events.append('acquire')
+        mock_slots.__exit__.side_effect = lambda *args: events.append('release')
+        self.mock_rename.side_effect = lambda *args: events.append('move')
+        self.test_model = USBDevice(self.mock_config, self.mock_util, mock_slots, self.mock_copy_engine,
+                                    self.mock_manifest)
+
+        self.test_model.transfer_media('/Volumes/my-dev', 'my-dev')
+        self.assertEqual(events, ['acquire', 'move', 'release'] * 6)
+
+    def test_transfer_media_should_skip_devices_whose_media_directories_have_not_changed(self):
+        self.test_model.transfer_media('/Volumes/my-dev', 'my-dev')
+        self.test_model.transfer_media('/Volumes/my-dev', 'my-dev')
+        self.assertEqual(self.mock_rename.call_count, 6)
+        self.assertEqual(self.mock_walk.call_count, 5)
+
+    def test_transfer_media_should_transfer_again_once_a_media_directory_changes(self):
+        self.test_model.transfer_media('/Volumes/my-dev', 'my-dev')
+        self.mock_stat.side_effect = lambda path: Mock(st_mtime=1434217999 if 'subfolder2' in path else 1434217122,
+                                                       st_dev=2065)
+        self.test_model.transfer_media('/Volumes/my-dev', 'my-dev')
+        self.assertEqual(self.mock_rename.call_count, 12)
+
+    def test_transfer_media_should_transfer_again_if_the_media_directories_are_reconfigured(self):
+        self.test_model.transfer_media('/Volumes/my-dev', 'my-dev')
+        self.mock_config.usb_media_directories.return_value = ['to-index']
+        self.test_model.transfer_media('/Volumes/my-dev', 'my-dev')
+        self.assertEqual(self.mock_rename.call_count, 9)
+
+    def test_transfer_media_should_fingerprint_each_device_separately(self):
+        self.test_model.transfer_media('/Volumes/my-dev', 'my-dev')
+        self.test_model.transfer_media('/Volumes/other-dev', 'other-dev')
+        walks = self.mock_walk.call_count
+
+        self.test_model.transfer_media('/Volumes/my-dev', 'my-dev')
+        self.test_model.transfer_media('/Volumes/other-dev', 'other-dev')
+        self.assertEqual(self.mock_walk.call_count, walks)
+        self.assertIn(call('/Volumes/other-dev/to-index'), self.mock_walk.call_args_list)
+
+    def test_transfer_media_should_transfer_again_once_a_device_is_mounted_again(self):
+        self.test_model.transfer_media('/Volumes/my-dev', 'my-dev')
+        write_mountinfo(self.path_to_mountinfo, 37, '/Volumes/my-dev')
+        self.test_model.transfer_media('/Volumes/my-dev', 'my-dev')
+        self.assertEqual(self.mock_rename.call_count, 12)
+
+    def test_transfer_media_should_transfer_again_if_another_volume_is_mounted_in_the_same_place(self):
+        self.test_model.transfer_media('/Volumes/my-dev', 'my-dev')
+        self.mock_stat.return_value = Mock(st_mtime=1434217122, st_size=2048, st_dev=2066)
+        self.test_model.transfer_media('/Volumes/my-dev', 'my-dev')
+        self.assertEqual(self.mock_rename.call_count, 12)
+
+    def test_transfer_media_should_transfer_again_once_a_device_has_been_missing(self):
+        self.test_model.transfer_media('/Volumes/my-dev', 'my-dev')
+        self.test_model.forget_missing([])
+        self.test_model.transfer_media('/Volumes/my-dev', 'my-dev')
+        self.assertEqual(self.mock_rename.call_count, 12)
+
+    def test_transfer_media_should_keep_skipping_devices_that_are_still_mounted(self):
+        self.test_model.transfer_media('/Volumes/my-dev', 'my-dev')
+        self.test_model.forget_missing(['/Volumes/my-dev'])
+        self.test_model.transfer_media('/Volumes/my-dev', 'my-dev')
+        self.assertEqual(self.mock_rename.call_count, 6)
+
+    def test_find_mount_id_should_find_the_latest_mount_on_a_mount_point(self):
+        with open(self.path_to_mountinfo, 'a') as f:
+            f.write('40 22 8:33 / /Volumes/my-dev rw - vfat /dev/sdc1 rw\n')
+        self.assertEqual(find_mount_id('/Volumes/my-dev/', self.path_to_mountinfo), '40')
+
+    def test_find_mount_id_should_understand_escaped_mount_points(self):
+        write_mountinfo(self.path_to_mountinfo, 36, '/media/NO\\040NAME')
+        self.assertEqual(find_mount_id('/media/NO NAME', self.path_to_mountinfo), '36')
+        self.assertIsNone(find_mount_id('/media/other', self.path_to_mountinfo))
+
+    def test_find_mount_id_should_return_none_without_a_mount_table(self):
+        self.assertIsNone(find_mount_id('/Volumes/my-dev', '/does/not/exist'))
+
+    @patch('time.time')
+    def test_transfer_media_should_not_trust_directories_that_changed_too_recently(self, mock_time):
+        mock_time.return_value = 1434217123
+        self.test_model.transfer_media('/Volumes/my-dev', 'my-dev')
+        self.test_model.transfer_media('/Volumes/my-dev', 'my-dev')
+        self.assertEqual(self.mock_rename.call_count, 12)
+
+    def test_transfer_media_should_not_skip_a_device_after_a_failed_transfer(self):
+        self.mock_rename.side_effect = OSError('Input/output error')
+        with self.assertRaises(OSError):
+            self.test_model.transfer_media('/Volumes/my-dev', 'my-dev')
+
+        self.mock_rename.side_effect = None
+        self.test_model.transfer_media('/Volumes/my-dev', 'my-dev')
+        self.assertEqual(self.mock_rename.call_count, 7)
+
+    def test_close_should_close_the_manifest(self):
+        self.test_model.close()
+        self.mock_manifest.close.assert_called_once_with()
+
+
+# Transfers real files, as if the device were on another filesystem.
+class TestUSBDeviceAcrossFilesystems(TempDirTestCase):
+    def setUp(self):
+        super(TestUSBDeviceAcrossFilesystems, self).setUp()
+        self.device_path = os.path.join(self.temp_dir, 'my-dev')
+        self.staging_dir = os.path.join(self.temp_dir, 'staging')
+        self.src_file = os.path.join(self.device_path, 'to-index', 'file.jpg')
+        self.dest_file = os.path.join(self.staging_dir, 'some-uuid.jpg')
+        os.makedirs(os.path.dirname(self.src_file))
+        os.makedirs(self.staging_dir)
+        with open(self.src_file, 'wb') as f:
+            f.write(FILE_CONTENTS)
+
+        self.mock_config = MagicMock(spec=config.Config)
+        self.mock_config.usb_media_directories.return_value = ['to-index']
+        self.mock_config.staging_directory.return_value = self.staging_dir
+        self.mock_config.max_concurrent_transfers.return_value = 2
+
+        self.mock_util = MagicMock(spec=util.Util)
+        self.mock_util.get_uuid.return_value = 'some-uuid'
+
+        self.manifest = TransferManifest(self.mock_config, self.mock_util, IN_MEMORY)
+        self.copy_engine = CopyEngine()
+
+        self.rename = os.rename
+        self.mock_rename_patcher = patch('os.rename', side_effect=self.__rename)
+        self.mock_rename_patcher.start()
+
+        self.test_model = USBDevice(self.mock_config, self.mock_util, copy_engine=self.copy_engine,
+                                    manifest=self.manifest)
+
+    def tearDown(self):
+        self.mock_rename_patcher.stop()
+        self.manifest.close()
+
+    def __rename(self, src, dest):
+        if src.startswith(self.device_path):
+            raise OSError(errno.EXDEV, 'Invalid cross-device link')
+        self.rename(src, dest)
+
+    def __read_file(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def test_it_should_copy_the_file_into_staging_and_remove_the_original(self):
+        on_transferred = MagicMock()
+        self.test_model.transfer_media(self.device_path, 'my-dev', on_transferred)
+
+        self.assertEqual(self.__read_file(self.dest_file), FILE_CONTENTS)
+        self.assertFalse(os.path.exists(self.src_file))
+        self.assertEqual(os.listdir(self.staging_dir), ['some-uuid.jpg'])
+        self.assertIsNone(self.manifest.find_transfer('my-dev', 'to-index/file.jpg'))
+        on_transferred.assert_called_once_with('USB', self.dest_file)
+
+    @unittest.skipUnless(hasattr(load_libc(), 'copy_file_range'), 'copy_file_range is not available')
+    def test_it_should_copy_the_file_in_the_kernel(self):
+        libc = load_libc()
+        mock_libc = MagicMock()
+        mock_libc.copy_file_range.side_effect = libc.copy_file_range
+        self.test_model = USBDevice(self.mock_config, self.mock_util, copy_engine=CopyEngine(mock_libc),
+                                    manifest=self.manifest)
+
+        self.test_model.transfer_media(self.device_path, 'my-dev')
+
+        self.assertGreater(mock_libc.copy_file_range.call_count, 0)
+        mock_libc.sendfile.assert_not_called()
+        self.assertEqual(self.__read_file(self.dest_file), FILE_CONTENTS)
+        self.assertFalse(os.path.exists(self.src_file))
+
+    def test_it_should_copy_the_file_again_if_a_copy_was_interrupted(self):
+        path_to_temp_file = os.path.join(self.staging_dir, '.old-uuid.part')
+        with open(path_to_temp_file, 'wb') as f:
+            f.write(FILE_CONTENTS[:5])
+        stat = os.stat(self.src_file)
+        self.manifest.start_transfer('my-dev', 'to-index/file.jpg', stat.st_size, stat.st_mtime, path_to_temp_file)
+
+        self.test_model.transfer_media(self.device_path, 'my-dev')
+
+        self.assertEqual(os.listdir(self.staging_dir), ['some-uuid.jpg'])
+        self.assertEqual(self.__read_file(self.dest_file), FILE_CONTENTS)
+        self.assertFalse(os.path.exists(self.src_file))
+
+    def test_it_should_only_remove_the_original_of_a_verified_copy(self):
+        stat = os.stat(self.src_file)
+        self.manifest.start_transfer('my-dev', 'to-index/file.jpg', stat.st_size, stat.st_mtime, '/gone.part')
+        self.manifest.verify_transfer('my-dev', 'to-index/file.jpg', FILE_HASH)
+        on_transferred = MagicMock()
+
+        self.test_model.transfer_media(self.device_path, 'my-dev', on_transferred)
+
+        self.assertFalse(os.path.exists(self.src_file))
+        self.assertEqual(os.listdir(self.staging_dir), [])
+        self.assertIsNone(self.manifest.find_transfer('my-dev', 'to-index/file.jpg'))
+        on_transferred.assert_not_called()
+
+    def test_it_should_copy_a_verified_file_again_if_the_original_changed(self):
+        self.manifest.start_transfer('my-dev', 'to-index/file.jpg', 1, 0, '/gone.part')
+        self.manifest.verify_transfer('my-dev', 'to-index/file.jpg', FILE_HASH)
+
+        self.test_model.transfer_media(self.device_path, 'my-dev')
+        self.assertEqual(self.__read_file(self.dest_file), FILE_CONTENTS)
+
+    def test_it_should_copy_a_verified_file_again_if_the_original_no_longer_matches_its_checksum(self):
+        stat = os.stat(self.src_file)
+        self.manifest.start_transfer('my-dev', 'to-index/file.jpg', stat.st_size, stat.st_mtime, '/gone.part')
+        self.manifest.verify_transfer('my-dev', 'to-index/file.jpg', 'some-other-checksum')
+        on_transferred = MagicMock()
+
+        self.test_model.transfer_media(self.device_path, 'my-dev', on_transferred)
+
+        self.assertEqual(self.__read_file(self.dest_file), FILE_CONTENTS)
+        self.assertFalse(os.path.exists(self.src_file))
+        on_transferred.assert_called_once_with('USB', self.dest_file)
+
+    def test_it_should_keep_the_original_and_remove_the_partial_copy_if_copying_fails(self):
+        with patch.object(self.copy_engine, 'copy', side_effect=IOError('disk full')):
+            with self.assertRaises(IOError):
+                self.test_model.transfer_media(self.device_path, 'my-dev')
+
+        self.assertTrue(os.path.exists(self.src_file))
+        self.assertEqual(os.listdir(self.staging_dir), [])
+        self.assertIsNone(self.manifest.find_transfer('my-dev', 'to-index/file.jpg').checksum)
+
+    def test_it_should_not_read_the_copy_again_to_verify_it(self):
+        with patch.object(self.test_model.checksums, 'hash_file') as mock_hash_file:
+            self.test_model.transfer_media(self.device_path, 'my-dev')
+
+        mock_hash_file.assert_not_called()
+        self.assertEqual(self.__read_file(self.dest_file), FILE_CONTENTS)
+
+    def test_it_should_record_the_checksum_of_a_verified_copy(self):
+        with patch('os.remove', side_effect=OSError(errno.EROFS, 'Read-only file system')):
+            with self.assertRaises(OSError):
+                self.test_model.transfer_media(self.device_path, 'my-dev')
+
+        transfer = self.manifest.find_transfer('my-dev', 'to-index/file.jpg')
+        self.assertEqual(transfer.checksum, FILE_HASH)
+        self.assertEqual(transfer.size, len(FILE_CONTENTS))
+        self.assertEqual(self.__read_file(self.dest_file), FILE_CONTENTS)
+
+    def test_it_should_remove_copies_left_by_interrupted_transfers(self):
+        for filename in ['.old-uuid.part', 'other-uuid.jpg']:
+            with open(os.path.join(self.staging_dir, filename), 'wb') as f:
+                f.write(FILE_CONTENTS[:5])
+
+        self.test_model.remove_temp_files()
+        self.assertEqual(os.listdir(self.staging_dir), ['other-uuid.jpg'])
+
+    def test_it_should_not_need_a_staging_directory_to_remove_copies(self):
+        os.rmdir(self.staging_dir)
+        self.test_model.remove_temp_files()
+
+    @patch('time.time')
+    def test_it_should_transfer_again_once_a_missing_media_directory_appears(self, mock_time):
+        mock_time.return_value = os.stat(self.device_path).st_mtime + 60
+        self.mock_config.usb_media_directories.return_value = ['to-index', 'later']
+        self.test_model.transfer_media(self.device_path, 'my-dev')
+
+        later_file = os.path.join(self.device_path, 'later', 'file.jpg')
+        os.mkdir(os.path.dirname(later_file))
+        with open(later_file, 'wb') as f:
+            f.write(FILE_CONTENTS)
+        mock_time.return_value = os.stat(os.path.dirname(later_file)).st_mtime + 60
+
+        self.test_model.transfer_media(self.device_path, 'my-dev')
+        self.assertFalse(os.path.exists(later_file))
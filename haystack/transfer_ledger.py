@@ -0,0 +1,67 @@
+import logging
+import time
+
+from config import Config
+from state_database import open_state_database
+from util import Util
+
+SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS mtp_transfers (
+           serial TEXT NOT NULL,
+           object_id INTEGER NOT NULL,
+           name TEXT NOT NULL,
+           size INTEGER NOT NULL,
+           date_transferred INTEGER NOT NULL,
+           PRIMARY KEY (serial, object_id, name, size))'''
+]
+
+SELECT_TRANSFER = 'SELECT 1 FROM mtp_transfers WHERE serial = ? AND object_id = ? AND name = ? AND size = ?'
+SELECT_DEVICE_TRANSFERS = 'SELECT object_id, name, size FROM mtp_transfers WHERE serial = ?'
+INSERT_TRANSFER = 'INSERT OR REPLACE INTO mtp_transfers VALUES (?, ?, ?, ?, ?)'
+DELETE_TRANSFER = 'DELETE FROM mtp_transfers WHERE serial = ? AND object_id = ? AND name = ? AND size = ?'
+
+
+# Remembers the MTP objects that were downloaded and verified, but couldn't be deleted from the device yet. Objects are
+# identified by the device's serial number along with their id, name and size, so a different file that reuses an id
+# is still downloaded. An object is forgotten once it's deleted from the device, or is no longer on it.
+class TransferLedger:
+    def __init__(self, config=None, util=None, path_to_database=None):
+        if config is None:
+            config = Config()
+
+        if util is None:
+            util = Util()
+
+        # Names come back as they were given, so they compare equal to the names in device listings.
+        self.connection = open_state_database(config, util, SCHEMA, path_to_database)
+
+    def has_transferred(self, serial, mtp_object):
+        return self.connection.execute(SELECT_TRANSFER, self.__key(serial, mtp_object)).fetchone() is not None
+
+    def record_transfer(self, serial, mtp_object):
+        with self.connection:
+            self.connection.execute(INSERT_TRANSFER, self.__key(serial, mtp_object) + (int(time.time()),))
+
+    def forget_transfer(self, serial, mtp_object):
+        with self.connection:
+            self.connection.execute(DELETE_TRANSFER, self.__key(serial, mtp_object))
+
+    # Forgets every object recorded for the device that isn't among the given objects, which should be everything that
+    # was found in the device's media folders.
+    def forget_missing(self, serial, mtp_objects):
+        present = set(self.__key(serial, o) for o in mtp_objects)
+        missing = [(serial,) + tuple(row) for row in self.connection.execute(SELECT_DEVICE_TRANSFERS, (serial,))]
+        missing = [key for key in missing if key not in present]
+        if not missing:
+            return
+
+        logging.info('Forgetting transfers of objects no longer on the device. serial=%s count=%d',
+                     serial, len(missing))
+        with self.connection:
+            self.connection.executemany(DELETE_TRANSFER, missing)
+
+    def close(self):
+        self.connection.close()
+
+    def __key(self, serial, mtp_object):
+        return serial, mtp_object.id, mtp_object.name, mtp_object.size
@@ -0,0 +1,66 @@
+import collections
+import threading
+
+from config import Config
+from state_database import open_state_database
+from util import Util
+
+SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS usb_transfers (
+           device_id TEXT NOT NULL,
+           source_path TEXT NOT NULL,
+           size INTEGER NOT NULL,
+           mtime REAL NOT NULL,
+           path_to_temp_file TEXT NOT NULL,
+           checksum TEXT,
+           PRIMARY KEY (device_id, source_path))'''
+]
+
+SELECT_TRANSFER = '''SELECT source_path, size, mtime, path_to_temp_file, checksum FROM usb_transfers
+                     WHERE device_id = ? AND source_path = ?'''
+INSERT_TRANSFER = 'INSERT OR REPLACE INTO usb_transfers VALUES (?, ?, ?, ?, ?, NULL)'
+MARK_VERIFIED = 'UPDATE usb_transfers SET checksum = ? WHERE device_id = ? AND source_path = ?'
+DELETE_TRANSFER = 'DELETE FROM usb_transfers WHERE device_id = ? AND source_path = ?'
+
+# A file being copied off a USB device. Once its copy has been verified and is in staging, checksum is the MD5 of the
+# original, and it's None until then.
+Transfer = collections.namedtuple('Transfer', ['source_path', 'size', 'mtime', 'path_to_temp_file', 'checksum'])
+
+
+# Records each file being copied off a USB device, from before the copy starts until the original has been removed from
+# the device. After a crash or a pulled cable, it tells which copies in staging can be trusted: a verified transfer
+# only needs its original removed, and anything else has to be copied again.
+class TransferManifest:
+    def __init__(self, config=None, util=None, path_to_database=None):
+        if config is None:
+            config = Config()
+
+        if util is None:
+            util = Util()
+
+        # Several USB devices can be transferred from at once.
+        self.lock = threading.Lock()
+        self.connection = open_state_database(config, util, SCHEMA, path_to_database)
+
+    # Returns the Transfer recorded for a file on the device, or None.
+    def find_transfer(self, device_id, source_path):
+        with self.lock:
+            row = self.connection.execute(SELECT_TRANSFER, (device_id, source_path)).fetchone()
+
+        return Transfer(*row) if row is not None else None
+
+    def start_transfer(self, device_id, source_path, size, mtime, path_to_temp_file):
+        with self.lock, self.connection:
+            self.connection.execute(INSERT_TRANSFER, (device_id, source_path, size, mtime, path_to_temp_file))
+
+    def verify_transfer(self, device_id, source_path, checksum):
+        with self.lock, self.connection:
+            self.connection.execute(MARK_VERIFIED, (checksum, device_id, source_path))
+
+    def finish_transfer(self, device_id, source_path):
+        with self.lock, self.connection:
+            self.connection.execute(DELETE_TRANSFER, (device_id, source_path))
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -1,45 +1,191 @@
+import errno
+import fnmatch
 import logging
 import os
-import shutil
+import threading
+import time
 
 from config import Config
+from content_hash import ContentHasher
+from copy_engine import CopyEngine
+from copy_engine import remove_quietly
 from file import File
+from media_placer import TEMP_FILE_TEMPLATE
+from transfer_manifest import TransferManifest
 from util import Util
 
 USB_DEVICE_ID = 'USB'
 
+# FAT only keeps modification times to the nearest 2 seconds, so a directory that changed in the last 2 seconds might
+# change again without its modification time changing.
+MTIME_RESOLUTION_IN_SECONDS = 2
+
+MOUNTINFO = '/proc/self/mountinfo'
+MOUNT_ID_FIELD = 0
+MOUNT_POINT_FIELD = 4
+MOUNTINFO_ESCAPES = [('\\040', ' '), ('\\011', '\t'), ('\\012', '\n'), ('\\134', '\\')]
+
+
+# Returns the id of the mount at mount_point, which is different every time something is mounted, or None if it can't
+# be found. Later mounts on the same mount point hide earlier ones, so the last one wins.
+def find_mount_id(mount_point, mountinfo_path=MOUNTINFO):
+    try:
+        with open(mountinfo_path, 'r') as f:
+            lines = f.readlines()
+    except IOError:
+        return None
+
+    mount_id = None
+    for line in lines:
+        fields = line.split()
+        if len(fields) <= MOUNT_POINT_FIELD:
+            continue
+
+        path = fields[MOUNT_POINT_FIELD]
+        for escaped, character in MOUNTINFO_ESCAPES:
+            path = path.replace(escaped, character)
+
+        if path == mount_point.rstrip('/'):
+            mount_id = fields[MOUNT_ID_FIELD]
+
+    return mount_id
+
 
 class USBDevice:
-    def __init__(self, config=None, util=None):
+    # transfer_slots limits how many files are copied at once. Share it with the other devices being transferred from.
+    def __init__(self, config=None, util=None, transfer_slots=None, copy_engine=None, manifest=None,
+                 mountinfo_path=MOUNTINFO):
         if config is None:
             config = Config()
 
         if util is None:
             util = Util()
 
+        if transfer_slots is None:
+            transfer_slots = threading.BoundedSemaphore(config.max_concurrent_transfers())
+
+        if copy_engine is None:
+            copy_engine = CopyEngine()
+
+        if manifest is None:
+            manifest = TransferManifest(config, util)
+
         self.config = config
         self.util = util
+        self.transfer_slots = transfer_slots
+        self.copy_engine = copy_engine
+        self.manifest = manifest
+        self.mountinfo_path = mountinfo_path
+        self.fingerprints = {}
+        # Copies are checked with MD5 whatever HashAlgorithm is, since these checksums never leave the manifest.
+        self.checksums = ContentHasher()
 
-    def transfer_media(self, device_path, device_id):
+    # If given, on_transferred is called with the staging directory name and path of each file once it has been moved
+    # into staging. A device whose media directories haven't changed since the last transfer is skipped, as long as
+    # it's the same volume, still mounted from the last transfer.
+    def transfer_media(self, device_path, device_id, on_transferred=None):
         paths_to_index = self.config.usb_media_directories()
+        media_paths = [os.path.join(device_path, p) for p in paths_to_index]
+        volume = self.__identify_volume(device_path)
+        if self.__is_unchanged(device_path, volume, media_paths):
+            logging.info('Media directories have not changed since the last transfer, skipping USB device. ' +
+                         'device_id=%s device_path=%s', device_id, device_path)
+            return
+
+        # Taken before transferring, so anything added during the transfer still counts as a change next time.
+        fingerprint = self.__fingerprint(volume, media_paths)
+
         dest_dir = self.config.staging_directory(USB_DEVICE_ID)
         logging.info('Transferring media from USB device. device_id=%s dest_dir=%s device_path=%s paths_to_index=%s',
                      device_id, dest_dir, device_path, paths_to_index)
-        for p in paths_to_index:
-            media_path = os.path.join(device_path, p)
+        for media_path in media_paths:
             if os.path.isdir(media_path):
-                self.__transfer_media_from_directory(media_path, dest_dir)
+                self.__transfer_media_from_directory(device_path, device_id, media_path, dest_dir, on_transferred)
             else:
                 logging.info('Media path could not be found on device. device=%s media_path=%s', device_id, media_path)
 
-    def __transfer_media_from_directory(self, media_path, dest_dir):
+        self.fingerprints[device_path] = fingerprint
+
+    # Removes copies left in staging by transfers that were interrupted before this process started, like by a crash or
+    # power loss. Only call this while nothing is being transferred, since every copy that's in progress is in staging.
+    def remove_temp_files(self):
+        dest_dir = self.config.staging_directory(USB_DEVICE_ID)
+        try:
+            filenames = os.listdir(dest_dir)
+        except OSError:
+            return
+
+        for filename in fnmatch.filter(filenames, TEMP_FILE_TEMPLATE.format('*')):
+            path_to_temp_file = os.path.join(dest_dir, filename)
+            logging.info('Removing copy left by an interrupted transfer. path_to_temp_file=%s', path_to_temp_file)
+            remove_quietly(path_to_temp_file)
+
+    def close(self):
+        self.manifest.close()
+
+    # Forgets the fingerprints of every device that isn't among the given device paths, which should be every device
+    # that's mounted. A card that's taken out may have media added elsewhere (without changing any directory's
+    # modification time, as cameras often do) before it's put back.
+    def forget_missing(self, device_paths):
+        for device_path in set(self.fingerprints) - set(device_paths):
+            del self.fingerprints[device_path]
+
+    # Returns None if the volume can't be identified, in which case it's never skipped.
+    def __identify_volume(self, device_path):
+        try:
+            st_dev = os.stat(device_path).st_dev
+        except OSError:
+            return None
+
+        return st_dev, find_mount_id(device_path, self.mountinfo_path)
+
+    # Every directory inside the media directories, along with its modification time, which changes whenever anything is
+    # added to or removed from it. Media directories that don't exist are included with a modification time of None.
+    # Returns None if something changed too recently to be sure its modification time will change again.
+    def __fingerprint(self, volume, media_paths):
+        if volume is None:
+            return None
+
+        directories = {}
+        for media_path in media_paths:
+            directories[media_path] = self.__get_mtime(media_path)
+            for root, dirs, files in os.walk(media_path):
+                for name in dirs:
+                    path = os.path.join(root, name)
+                    directories[path] = self.__get_mtime(path)
+
+        recently = time.time() - MTIME_RESOLUTION_IN_SECONDS
+        if any(mtime is not None and mtime > recently for mtime in directories.values()):
+            return None
+
+        return volume, tuple(media_paths), directories
+
+    # Checking a fingerprint takes a stat of each directory, without listing any of them.
+    def __is_unchanged(self, device_path, volume, media_paths):
+        fingerprint = self.fingerprints.get(device_path)
+        if fingerprint is None:
+            return False
+
+        fingerprinted_volume, fingerprinted_media_paths, directories = fingerprint
+        if fingerprinted_volume != volume or fingerprinted_media_paths != tuple(media_paths):
+            return False
+
+        return all(self.__get_mtime(path) == mtime for path, mtime in directories.items())
+
+    def __get_mtime(self, path):
+        try:
+            return os.stat(path).st_mtime
+        except OSError:
+            return None
+
+    def __transfer_media_from_directory(self, device_path, device_id, media_path, dest_dir, on_transferred):
         self.util.mkdirp(dest_dir)
         for root, dirs, files in os.walk(media_path):
             for name in files:
-                self.__transfer_file(root, name, dest_dir)
+                self.__transfer_file(device_path, device_id, root, name, dest_dir, on_transferred)
         return
 
-    def __transfer_file(self, path, filename, dest_dir):
+    def __transfer_file(self, device_path, device_id, path, filename, dest_dir, on_transferred):
         try:
             File(filename)
         except RuntimeError:
@@ -53,4 +199,61 @@ class USBDevice:
         dest_file = os.path.join(dest_dir, dest_filename)
         src_file = os.path.join(path, filename)
         logging.info('Transferring file from USB device. src_file=%s dest_file=%s', src_file, dest_file)
-        shutil.move(src_file, dest_file)
+        # Files are recorded by their path on the device, since the device may be mounted somewhere else next time.
+        source_path = os.path.relpath(src_file, device_path)
+        with self.transfer_slots:
+            transferred = self.__move_file(device_id, source_path, src_file, dest_file)
+
+        if transferred and on_transferred is not None:
+            on_transferred(USB_DEVICE_ID, dest_file)
+
+    # Moves a file into staging. A file on another filesystem is copied to a temp file, which is renamed once the copy
+    # is complete, and the original is only removed after that. Every step is recorded in the manifest, so that if
+    # this is interrupted, the next transfer knows whether to copy the file again or just remove the original, which it
+    # only does once the original still matches the checksum of its copy. Returns False if the file had already been
+    # moved into staging.
+    def __move_file(self, device_id, source_path, src_file, dest_file):
+        stat = os.stat(src_file)
+        transfer = self.manifest.find_transfer(device_id, source_path)
+        if transfer is not None:
+            if transfer.checksum is not None and transfer.size == stat.st_size and transfer.mtime == stat.st_mtime and \
+                    self.checksums.hash_file(src_file) == transfer.checksum:
+                logging.info('File was already copied to staging, removing the original. device_id=%s ' +
+                             'source_path=%s checksum=%s', device_id, source_path, transfer.checksum)
+                os.remove(src_file)
+                self.manifest.finish_transfer(device_id, source_path)
+                return False
+
+            logging.info('Found an interrupted transfer, copying the file again. device_id=%s source_path=%s',
+                         device_id, source_path)
+            remove_quietly(transfer.path_to_temp_file)
+
+        try:
+            os.rename(src_file, dest_file)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+        else:
+            if transfer is not None:
+                self.manifest.finish_transfer(device_id, source_path)
+            return True
+
+        path_to_temp_file = os.path.join(os.path.dirname(dest_file), TEMP_FILE_TEMPLATE.format(self.util.get_uuid()))
+        self.manifest.start_transfer(device_id, source_path, stat.st_size, stat.st_mtime, path_to_temp_file)
+
+        # The copy engine checks that the copy is the same size as the original, and checksums it without reading it
+        # again afterwards.
+        checksum = self.checksums.new()
+        try:
+            self.copy_engine.copy(src_file, path_to_temp_file, checksum)
+        except Exception:
+            remove_quietly(path_to_temp_file)
+            raise
+
+        # Renaming first means a crash can only leave an extra copy in staging (which is indexed as a duplicate), never
+        # a verified transfer without its copy.
+        os.rename(path_to_temp_file, dest_file)
+        self.manifest.verify_transfer(device_id, source_path, checksum.hexdigest())
+        os.remove(src_file)
+        self.manifest.finish_transfer(device_id, source_path)
+        return True